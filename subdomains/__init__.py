@@ -1 +1,3 @@
 __version__ = (2, 1, '0')
+
+default_app_config = 'subdomains.apps.SubdomainsConfig'
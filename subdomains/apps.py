@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class SubdomainsConfig(AppConfig):
+    name = 'subdomains'
+    verbose_name = 'Subdomains'
+
+    def ready(self):
+        """
+        Warms the subdomain urlconfs when the application registry is ready,
+        if ``settings.SUBDOMAIN_WARM_URLCONFS`` is set.
+        """
+        if getattr(settings, 'SUBDOMAIN_WARM_URLCONFS', False):
+            from subdomains.utils import warm_urlconfs
+            warm_urlconfs()
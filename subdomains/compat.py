@@ -0,0 +1,87 @@
+"""
+Imports that differ between the supported versions of Python and Django.
+"""
+import sys
+
+from django.conf import settings
+
+try:
+    from django.urls import (NoReverseMatch, Resolver404, clear_url_caches,
+        get_resolver, get_script_prefix, get_urlconf, resolve, reverse,
+        set_urlconf)
+except ImportError:  # Django < 1.10
+    from django.core.urlresolvers import (NoReverseMatch,  # noqa
+        Resolver404, clear_url_caches, get_resolver, get_script_prefix,
+        get_urlconf, resolve, reverse, set_urlconf)
+
+try:
+    from django.urls.resolvers import _get_cached_resolver
+except ImportError:  # Django < 3.0
+    _get_cached_resolver = get_resolver
+
+
+def get_resolver_count():
+    """
+    Returns the number of resolvers held by Django's resolver cache.
+    """
+    try:
+        return _get_cached_resolver.cache_info().currsize
+    except AttributeError:  # Django < 1.7
+        from django.core.urlresolvers import _resolver_cache
+        return len(_resolver_cache)
+
+
+try:
+    from django.urls.resolvers import RegexPattern, URLResolver
+except ImportError:  # Django < 2.0
+    try:
+        from django.urls import RegexURLResolver
+    except ImportError:  # Django < 1.10
+        from django.core.urlresolvers import RegexURLResolver
+
+    def make_resolver(urlconf):
+        return RegexURLResolver(r'^/', urlconf)
+else:
+    def make_resolver(urlconf):
+        return URLResolver(RegexPattern(r'^/'), urlconf)
+
+try:
+    from django.apps import apps
+except ImportError:  # Django < 1.7
+    def is_installed(app):
+        return app in settings.INSTALLED_APPS
+else:
+    is_installed = apps.is_installed
+
+try:
+    from django.core.cache import caches
+except ImportError:  # Django < 1.7
+    from django.core.cache import get_cache  # noqa
+else:
+    get_cache = caches.__getitem__
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # Django < 1.8
+    from django.test.signals import setting_changed  # noqa
+
+try:
+    from django.utils.http import urlquote
+except ImportError:  # Django >= 4.0
+    from urllib.parse import quote as urlquote  # noqa
+
+
+def with_metaclass(meta, *bases):
+    """
+    Returns a base class created with the metaclass ``meta``, which can be
+    used in class statements on both Python 2 and 3.
+    """
+    return meta(str('NewBase'), bases, {})
+
+
+if sys.version_info[0] >= 3:
+    from django.utils.encoding import force_str as force_text
+    string_types = (str,)
+else:
+    from django.utils.encoding import force_text  # noqa
+    string_types = (basestring,)  # noqa
@@ -0,0 +1,40 @@
+"""
+Native coroutine support for the subdomain middleware, used when it runs in an
+asynchronous (ASGI) middleware chain on Django 3.1 or newer.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    iscoroutinefunction = asyncio.iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+
+class AsyncMiddlewareMixin(object):
+    async def __acall__(self, request):
+        """
+        Processes ``request`` on the event loop if everything it needs is held
+        in memory (see ``is_cached``), and otherwise in the thread that runs
+        the synchronous code of the request, since identifying the subdomain
+        may then block (e.g. on the database, to look up the current ``Site``,
+        or on the cache shared with other processes.) The rest of the chain
+        is awaited on the event loop.
+        """
+        if self.is_cached():
+            response = self.process_request(request)
+        else:
+            response = await sync_to_async(self.process_request,
+                thread_sensitive=True)(request)
+
+        if response is None:
+            response = await self.get_response(request)
+
+        if hasattr(self, 'process_response'):
+            response = self.process_response(request, response)
+        return response
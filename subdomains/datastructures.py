@@ -0,0 +1,105 @@
+import threading
+
+# The links of the list that orders the items of an LRUCache, from the least
+# to the most recently used (collections.OrderedDict is not available on
+# Python 2.6.)
+PREVIOUS, NEXT, KEY, VALUE = range(4)
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that holds at most ``maxsize`` items, discarding the
+    least recently used item when it is full.
+
+    Hits, misses and evictions are counted so that the effectiveness of the
+    cache can be inspected with :meth:`stats`.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._data = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for ``key``, marking it as recently used, or
+        ``default`` if the key is not in the cache.
+        """
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[VALUE]
+
+    def set(self, key, value):
+        """
+        Stores ``value`` for ``key``, evicting the least recently used item if
+        the cache is full.
+        """
+        if not self.maxsize:
+            return
+        with self._lock:
+            link = self._data.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+            while len(self._data) >= self.maxsize:
+                oldest = self._root[NEXT]
+                self._unlink(oldest)
+                del self._data[oldest[KEY]]
+                self.evictions += 1
+            link = self._data[key] = [None, None, key, value]
+            self._append(link)
+
+    def _unlink(self, link):
+        link[PREVIOUS][NEXT] = link[NEXT]
+        link[NEXT][PREVIOUS] = link[PREVIOUS]
+
+    def _append(self, link):
+        last = self._root[PREVIOUS]
+        link[PREVIOUS], link[NEXT] = last, self._root
+        last[NEXT] = self._root[PREVIOUS] = link
+
+    def items(self):
+        """
+        Returns a list of the ``(key, value)`` pairs in the cache, from the
+        least to the most recently used, without marking them as used.
+        """
+        with self._lock:
+            items = []
+            link = self._root[NEXT]
+            while link is not self._root:
+                items.append((link[KEY], link[VALUE]))
+                link = link[NEXT]
+            return items
+
+    def clear(self):
+        """
+        Removes all items from the cache. Statistics are kept.
+        """
+        with self._lock:
+            self._data.clear()
+            self._root[:] = [self._root, self._root, None, None]
+
+    def stats(self):
+        """
+        Returns a dictionary describing the current state of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
@@ -0,0 +1,284 @@
+"""
+A URL reversing engine that compiles named routes ahead of time.
+
+When ``settings.SUBDOMAIN_FAST_REVERSE`` is set,
+:func:`subdomains.utils.reverse` reverses URLs through a
+:class:`ReverseEngine`, which is built once for the current domain, script
+prefix and language. Every named route of the urlconfs
+returned by :func:`subdomains.utils.get_urlconfs` is compiled into a format
+string and a precompiled validation pattern, and routes that do not take any
+arguments are compiled into complete URLs for each of the subdomains in
+``settings.SUBDOMAIN_URLCONFS``, so reversing them is a dictionary lookup.
+
+The engine reproduces the reversing rules of the ``reverse`` method of
+Django's URL resolvers. Any view name that it cannot compile, such as
+namespaced or callable views, and any arguments that do not match a compiled
+route are reversed by Django instead, so errors are reported exactly as
+before.
+"""
+import re
+
+from django.conf import settings
+from django.utils.encoding import iri_to_uri
+from django.utils.translation import get_language
+
+try:
+    from django.utils.http import RFC3986_SUBDELIMS
+except ImportError:  # Django < 1.6
+    RFC3986_SUBDELIMS = "!$&'()*+,;="
+
+from subdomains.compat import (force_text, get_script_prefix,
+    setting_changed, string_types, urlquote)
+from subdomains.datastructures import LRUCache
+from subdomains.utils import (get_domain, get_urlconfs, resolver_cache,
+    urljoin)
+
+
+SAFE_CHARACTERS = RFC3986_SUBDELIMS + str('/~:@')
+
+
+class Candidate(object):
+    """
+    A single way of reversing a named route, compiled from an entry of the
+    ``reverse_dict`` of a resolver.
+
+    ``converters`` are the path converters of the route on Django 2.0 and
+    newer, or ``None`` on older versions of Django.
+    """
+    def __init__(self, script_prefix, result, params, pattern, defaults,
+            converters=None):
+        self.params = params
+        self.defaults = defaults
+        self.converters = converters
+        self.default_keys = frozenset(defaults)
+        self.keys = frozenset(params) | self.default_keys
+        self.format = script_prefix.replace('%', '%%') + result
+        self.regex = re.compile('^%s%s' % (re.escape(script_prefix), pattern),
+            re.UNICODE)
+
+        #: The path of the candidate if it can be reversed without arguments.
+        self.path = None
+        if not params:
+            try:
+                self.path = self.substitute({})
+            except ValueError:
+                # Leave reporting malformed patterns to Django.
+                pass
+
+    def substitute(self, subs):
+        candidate = self.format % subs
+        if not self.regex.search(candidate):
+            return None
+        url = urlquote(candidate, safe=SAFE_CHARACTERS)
+        # Don't allow construction of scheme relative urls.
+        if url.startswith('//'):
+            url = '/%%2F%s' % url[2:]
+        return force_text(iri_to_uri(url))
+
+    def to_text(self, subs):
+        """
+        Converts the values of ``subs`` to text the way the resolvers of the
+        installed version of Django do, raising :exc:`ValueError` if a path
+        converter rejects a value.
+        """
+        if self.converters is None:
+            return dict((k, force_text(v)) for k, v in subs.items())
+
+        text = {}
+        for key, value in subs.items():
+            if key in self.converters:
+                text[key] = self.converters[key].to_url(value)
+            else:
+                text[key] = str(value)
+        return text
+
+    def reverse(self, args, kwargs):
+        """
+        Returns the path for the given arguments, or ``None`` if they don't
+        match this candidate.
+        """
+        if args:
+            if len(args) != len(self.params):
+                return None
+            subs = dict(zip(self.params, args))
+        else:
+            if frozenset(kwargs) | self.default_keys != self.keys:
+                return None
+            for key, value in self.defaults.items():
+                if kwargs.get(key, value) != value:
+                    return None
+            if not self.params and not kwargs:
+                return self.path
+            subs = kwargs
+
+        try:
+            subs = self.to_text(subs)
+        except ValueError:
+            return None
+        return self.substitute(subs)
+
+
+def compile_resolver(resolver, script_prefix):
+    """
+    Returns a dictionary of the :class:`Candidate` lists for each named route
+    of ``resolver``, leaving out any routes that cannot be compiled.
+    """
+    routes = {}
+    reverse_dict = resolver.reverse_dict
+    callback_strs = getattr(resolver, '_callback_strs', ())
+    for name in reverse_dict:
+        if not isinstance(name, string_types) or name in callback_strs:
+            continue
+
+        candidates = []
+        for entry in reverse_dict.getlist(name):
+            if len(entry) == 3:  # Django < 2.0
+                (possibility, pattern, defaults), converters = entry, None
+            elif len(entry) == 4:
+                possibility, pattern, defaults, converters = entry
+            else:
+                break
+            for result, params in possibility:
+                candidates.append(Candidate(script_prefix, result, params,
+                    pattern, defaults, converters))
+        else:
+            routes[name] = candidates
+    return routes
+
+
+def compile_urlconf(urlconf, script_prefix=None):
+    """
+    Returns the compiled routes of ``urlconf`` for ``script_prefix`` (the
+    current script prefix by default) and the current language.
+
+    The routes are kept on the cached resolver of ``urlconf``, so they are
+    compiled once per resolver and discarded along with it.
+    """
+    if script_prefix is None:
+        script_prefix = get_script_prefix()
+    resolver = resolver_cache.get(urlconf)
+    key = (script_prefix, get_language())
+    try:
+        compiled = resolver.compiled_routes
+    except AttributeError:
+        compiled = resolver.compiled_routes = {}
+    routes = compiled.get(key)
+    if routes is None:
+        routes = compiled[key] = compile_resolver(resolver, script_prefix)
+    return routes
+
+
+class ReverseEngine(object):
+    """
+    Reverses URLs from routes compiled for one domain, script prefix and
+    language.
+    """
+    def __init__(self, domain, script_prefix, scheme):
+        self.domain = domain
+        self.scheme = scheme
+        self.routes = {}
+        self.prefixes = {}
+        self.urls = {}
+
+        for urlconf in get_urlconfs():
+            self.routes[urlconf] = compile_urlconf(urlconf, script_prefix)
+
+        for subdomain, urlconf in settings.SUBDOMAIN_URLCONFS.items():
+            for name in self.routes[urlconf]:
+                try:
+                    url = self.reverse(name, subdomain, urlconf, scheme, (),
+                        {})
+                except KeyError:
+                    # Parameters that are only satisfied by defaults fail to
+                    # substitute, just as they would with Django.
+                    continue
+                if url is not None:
+                    self.urls[subdomain, name] = url
+
+    def get_prefix(self, subdomain, scheme):
+        """
+        Returns the scheme and host part of URLs for ``subdomain``.
+        """
+        try:
+            return self.prefixes[subdomain, scheme]
+        except KeyError:
+            host = self.domain if subdomain is None else \
+                '%s.%s' % (subdomain, self.domain)
+            prefix = self.prefixes[subdomain, scheme] = \
+                urljoin(host, scheme=scheme)
+            return prefix
+
+    def reverse(self, viewname, subdomain, urlconf, scheme, args, kwargs):
+        """
+        Returns the full URL for the provided arguments, or ``None`` if the
+        URL must be reversed by Django instead.
+        """
+        if scheme is None:
+            scheme = self.scheme
+
+        if not args and not kwargs and scheme == self.scheme:
+            url = self.urls.get((subdomain, viewname))
+            if url is not None:
+                return url
+
+        try:
+            candidates = self.routes[urlconf][viewname]
+        except (KeyError, TypeError):
+            return None
+
+        if args and kwargs:
+            return None
+
+        args, kwargs = args or (), kwargs or {}
+        for candidate in candidates:
+            path = candidate.reverse(args, kwargs)
+            if path is not None:
+                return self.get_prefix(subdomain, scheme) + path
+        return None
+
+
+_engines = LRUCache(16)
+
+
+def clear_engines(**kwargs):
+    """
+    Discards all compiled engines.
+    """
+    _engines.clear()
+
+
+def get_engine(domain=None):
+    """
+    Returns the :class:`ReverseEngine` for the current domain, script prefix
+    and language, compiling a new one if any of them (or the URL resolvers)
+    have changed.
+    """
+    if domain is None:
+        domain = get_domain()
+    key = (domain, get_script_prefix(), get_language(),
+        getattr(settings, 'DEFAULT_URL_SCHEME', 'http'), settings.ROOT_URLCONF,
+        resolver_cache.validate())
+    engine = _engines.get(key)
+    if engine is None:
+        engine = ReverseEngine(key[0], key[1], key[3])
+        _engines.set(key, engine)
+    return engine
+
+
+def reverse(viewname, subdomain, urlconf, scheme=None, args=None, kwargs=None,
+        domain=None):
+    """
+    Reverses a URL with the compiled engine, returning ``None`` if it must be
+    reversed with :func:`django.core.urlresolvers.reverse` instead.
+    """
+    return get_engine(domain).reverse(viewname, subdomain, urlconf, scheme,
+        args, kwargs)
+
+
+def settings_changed(setting, **kwargs):
+    if setting in ('SUBDOMAIN_URLCONFS', 'SUBDOMAIN_URLCONF_PATTERNS',
+            'ROOT_URLCONF'):
+        clear_engines()
+
+
+setting_changed.connect(settings_changed)
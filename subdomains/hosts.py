@@ -0,0 +1,248 @@
+import re
+from abc import ABCMeta, abstractmethod
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from subdomains.compat import force_text, setting_changed, with_metaclass
+from subdomains.datastructures import LRUCache
+
+
+#: Returned by :meth:`HostMatcher.match` when a host does not belong to the
+#: domain of the matcher.
+NO_MATCH = object()
+
+_missing = object()
+
+#: The IDNA encodings of the most recently seen non-ASCII host names.
+_idna_names = LRUCache(1024)
+
+
+def encode_idna(name):
+    """
+    Returns the ASCII (punycode) form of the internationalized host ``name``,
+    or ``name`` itself if it is not a valid internationalized name.
+    """
+    encoded = _idna_names.get(name)
+    if encoded is None:
+        try:
+            encoded = force_text(name).encode('idna').decode('ascii')
+        except UnicodeError:
+            encoded = name
+        _idna_names.set(name, encoded)
+    return encoded
+
+
+def split_host(host):
+    """
+    Returns the canonical name and the port (or ``''``) of ``host``.
+
+    Every form of a host name is mapped to the same name: it is lowercased,
+    encoded with IDNA (see :func:`encode_idna`) if it contains non-ASCII
+    characters, and stripped of the trailing dot of fully qualified names.
+    IPv6 addresses keep their brackets, e.g. ``('[::1]', '8000')``.
+    """
+    host = host.lower()
+    if host.startswith('['):
+        name, _, port = host.partition(']')
+        return name + ']', port[1:]
+
+    name, _, port = host.partition(':')
+    try:
+        name.encode('ascii')
+    except UnicodeError:
+        name = encode_idna(name)
+    if name.endswith('.'):
+        name = name[:-1]
+    return name, port
+
+
+def normalize_host(host, keep_port=False):
+    """
+    Returns the canonical name of ``host`` (see :func:`split_host`), followed
+    by its port if ``keep_port`` is set.
+    """
+    name, port = split_host(host)
+    if keep_port and port:
+        return '%s:%s' % (name, port)
+    return name
+
+
+class HostMatcher(with_metaclass(ABCMeta, object)):
+    """
+    Identifies the subdomain part of HTTP hosts that belong to ``domain``.
+
+    This is an abstract class: subclasses must implement :meth:`parse`.
+    """
+    def __init__(self, domain):
+        self.domain = normalize_host(domain)
+
+    def match(self, host):
+        """
+        Returns the subdomain part of ``host``, ``None`` if the host is the
+        domain itself, or :data:`NO_MATCH` if the host does not belong to the
+        domain at all. Hosts are normalized with :func:`normalize_host`, so
+        any port number on the host is ignored.
+        """
+        return self.parse(normalize_host(host))
+
+    @abstractmethod
+    def parse(self, host):
+        """
+        Returns the result of :meth:`match` for a ``host`` that is already
+        normalized with :func:`normalize_host`. This abstract method performs
+        the actual matching.
+        """
+
+
+class RegexHostMatcher(HostMatcher):
+    """
+    Matches hosts with a regular expression that is compiled once per domain,
+    memoizing the results for up to ``cache_size`` distinct hosts.
+
+    This is the historical matching behavior of
+    :class:`~subdomains.middleware.SubdomainMiddleware`.
+    """
+    def __init__(self, domain, cache_size=1024):
+        super(RegexHostMatcher, self).__init__(domain)
+        self.pattern = re.compile(r'^(?:(?P<subdomain>.*?)\.)?%s(?::.*)?$' %
+            re.escape(self.domain))
+        self.cache = LRUCache(cache_size)
+
+    def parse(self, host):
+        subdomain = self.cache.get(host, _missing)
+        if subdomain is _missing:
+            matches = self.pattern.match(host)
+            subdomain = matches.group('subdomain') if matches else NO_MATCH
+            self.cache.set(host, subdomain)
+        return subdomain
+
+
+class SuffixHostMatcher(HostMatcher):
+    """
+    Matches hosts by splitting off the port and comparing the remainder with
+    the domain as a plain string suffix, without using regular expressions.
+    """
+    def __init__(self, domain):
+        super(SuffixHostMatcher, self).__init__(domain)
+        self.suffix = '.' + self.domain
+
+    def parse(self, host):
+        if host == self.domain:
+            return None
+        elif host.endswith(self.suffix):
+            return host[:-len(self.suffix)]
+        return NO_MATCH
+
+
+#: Host matcher implementations that can be selected with the
+#: ``SUBDOMAIN_HOST_MATCHER`` setting.
+HOST_MATCHERS = {
+    'regex': RegexHostMatcher,
+    'suffix': SuffixHostMatcher,
+}
+
+_matchers = LRUCache(64)
+
+
+def make_host_matcher(domain):
+    """
+    Returns a new host matcher for ``domain``, using the implementation named
+    by ``settings.SUBDOMAIN_HOST_MATCHER`` (``suffix`` by default, or
+    ``regex``.)
+    """
+    name = getattr(settings, 'SUBDOMAIN_HOST_MATCHER', 'suffix')
+    try:
+        cls = HOST_MATCHERS[name]
+    except KeyError:
+        raise ImproperlyConfigured('Unknown SUBDOMAIN_HOST_MATCHER %r, '
+            'expected one of: %s' % (name, ', '.join(sorted(HOST_MATCHERS))))
+    if issubclass(cls, RegexHostMatcher):
+        return cls(domain,
+            cache_size=getattr(settings, 'SUBDOMAIN_HOST_CACHE_SIZE', 1024))
+    return cls(domain)
+
+
+def get_host_matcher(domain):
+    """
+    Returns the host matcher for ``domain`` (see :func:`make_host_matcher`.)
+
+    Matchers are constructed once per domain and reused across requests,
+    until the settings of the matchers are changed.
+    """
+    matcher = _matchers.get(domain)
+    if matcher is None:
+        matcher = make_host_matcher(domain)
+        _matchers.set(domain, matcher)
+    return matcher
+
+
+def clear_host_matchers(setting=None, **kwargs):
+    if setting in (None, 'SUBDOMAIN_HOST_MATCHER',
+            'SUBDOMAIN_HOST_CACHE_SIZE'):
+        _matchers.clear()
+
+
+setting_changed.connect(clear_host_matchers)
+
+
+def join_host(subdomain, domain):
+    """
+    Returns the host of ``subdomain`` (or of the domain itself, if ``None``.)
+    """
+    if subdomain:
+        return '%s.%s' % (subdomain, domain)
+    return domain
+
+
+def build_redirect_table(domain, redirects):
+    """
+    Returns a dictionary of the normalized hosts (without a port) of the
+    subdomains of ``domain`` that are keys of ``redirects`` to the hosts they
+    are redirected to. Chains of redirects are followed, so that each host is
+    redirected to its canonical host at once.
+
+    Raises :exc:`~django.core.exceptions.ImproperlyConfigured` if the
+    redirects loop.
+    """
+    domain = normalize_host(domain)
+    table = {}
+    for subdomain in redirects:
+        target, seen = subdomain, set()
+        while target in redirects:
+            if target in seen:
+                raise ImproperlyConfigured('SUBDOMAIN_REDIRECTS loops from '
+                    'subdomain %r' % subdomain)
+            seen.add(target)
+            target = redirects[target]
+        table[normalize_host(join_host(subdomain, domain))] = \
+            normalize_host(join_host(target, domain))
+    return table
+
+
+_redirect_tables = LRUCache(64)
+
+
+def get_redirect_table(domain):
+    """
+    Returns the redirect table of ``domain`` built from
+    ``settings.SUBDOMAIN_REDIRECTS``, a dictionary of subdomains (or ``None``
+    for the domain itself) to the subdomains they are redirected to, which
+    redirects ``www`` to the domain by default.
+
+    Tables are built once per domain and reused across requests.
+    """
+    table = _redirect_tables.get(domain)
+    if table is None:
+        redirects = getattr(settings, 'SUBDOMAIN_REDIRECTS', {'www': None})
+        table = build_redirect_table(domain, redirects)
+        _redirect_tables.set(domain, table)
+    return table
+
+
+def clear_redirect_tables(setting=None, **kwargs):
+    if setting in (None, 'SUBDOMAIN_REDIRECTS'):
+        _redirect_tables.clear()
+
+
+setting_changed.connect(clear_redirect_tables)
@@ -0,0 +1,118 @@
+"""
+Subdomain-based URL reversing in Jinja2 templates.
+
+:class:`SubdomainExtension` adds ``url`` and ``shorturl`` functions to the
+globals of a Jinja2 environment, which take the same arguments as the
+``url`` and ``shorturl`` tags of the ``subdomainurls`` template tag library::
+
+    TEMPLATES = [{
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'OPTIONS': {
+            'extensions': ['subdomains.jinja2.SubdomainExtension'],
+        },
+    }]
+
+and in templates:
+
+.. code-block:: html+jinja
+
+    <a href="{{ url('view-name', subdomain='subdomain') }}">...</a>
+    <a href="{{ shorturl('view-name', 'subdomain', 42) }}">...</a>
+
+URLs are reversed with :func:`subdomains.utils.reverse` (and therefore with
+the reverse cache and the compiled routes of :mod:`subdomains.fastreverse`
+when they are enabled), and cached for the duration of the render.
+"""
+from __future__ import absolute_import
+
+from jinja2.ext import Extension
+
+try:
+    from jinja2 import pass_context
+except ImportError:  # Jinja2 < 3.0
+    from jinja2 import contextfunction as pass_context
+
+from subdomains.utils import (get_arguments_key, get_request_origin, reverse,
+    shorten_url)
+
+
+def get_cache(context):
+    """
+    Returns the dictionary of the URLs reversed during the render of
+    ``context``.
+    """
+    cache = getattr(context, '_subdomain_urls', None)
+    if cache is None:
+        cache = context._subdomain_urls = {}
+    return cache
+
+
+def reverse_url(context, viewname, args, kwargs, shortest=False):
+    """
+    Reverses a URL like the ``url`` template tag: the subdomain is given by
+    the ``subdomain`` keyword argument or the first positional argument,
+    defaulting to the subdomain of the ``request`` in ``context``, and an
+    empty subdomain is the domain itself.
+    """
+    if 'subdomain' in kwargs:
+        subdomain = kwargs.pop('subdomain')
+    elif args:
+        subdomain, args = args[0], args[1:]
+    else:
+        subdomain = getattr(context.get('request'), 'subdomain', None)
+    if subdomain == '':
+        subdomain = None
+
+    cache = get_cache(context)
+    try:
+        key = (viewname, subdomain, get_arguments_key(args, kwargs),
+            shortest)
+        url = cache.get(key)
+    except TypeError:  # Unhashable arguments.
+        key = url = None
+    if url is not None:
+        return url
+
+    origin = None
+    if shortest:
+        origin = cache.get(get_request_origin)
+        request = context.get('request')
+        if origin is None and request is not None:
+            origin = cache[get_request_origin] = get_request_origin(request)
+
+    if origin is None:
+        url = reverse(viewname, subdomain=subdomain, args=args, kwargs=kwargs)
+    else:
+        url = shorten_url(reverse(viewname, subdomain=subdomain,
+            scheme=origin[0], args=args, kwargs=kwargs), origin)
+
+    if key is not None:
+        cache[key] = url
+    return url
+
+
+@pass_context
+def url(context, viewname, *args, **kwargs):
+    """
+    Returns the URL of ``viewname``, like the ``url`` template tag.
+    """
+    return reverse_url(context, viewname, args, kwargs)
+
+
+@pass_context
+def shorturl(context, viewname, *args, **kwargs):
+    """
+    Returns the shortest URL of ``viewname`` from the page of the ``request``
+    in the context, like the ``shorturl`` template tag.
+    """
+    return reverse_url(context, viewname, args, kwargs, shortest=True)
+
+
+class SubdomainExtension(Extension):
+    """
+    Adds the :func:`url` and :func:`shorturl` functions to the globals of the
+    environment.
+    """
+    def __init__(self, environment):
+        super(SubdomainExtension, self).__init__(environment)
+        environment.globals.update(url=url, shorturl=shorturl)
@@ -0,0 +1,94 @@
+import cProfile
+import sys
+from optparse import make_option
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from subdomains.replay import (clear_caches, format_profile, format_report,
+    read_entries, replay, replay_in_processes)
+
+
+#: The options of the command, as ``(flags, attributes)`` pairs that are
+#: given to both ``optparse`` (Django < 1.8) and ``argparse``.
+OPTIONS = (
+    (('-r', '--repeat'), {'default': 1,
+        'help': 'replay the log this many times (default: 1)'}),
+    (('-p', '--profile'), {'action': 'store_true', 'default': False,
+        'help': 'print the functions that took the most time'}),
+    (('--profile-output',), {'default': None,
+        'help': 'write the profile to this file, for use with pstats'}),
+    (('--reverse',), {'action': 'store_true', 'default': False,
+        'help': 'also reverse the URL of each resolved route'}),
+    (('-j', '--processes'), {'default': None,
+        'help': 'replay the log in this many processes at the same time'}),
+    (('--cold',), {'action': 'store_true', 'default': False,
+        'help': 'start with empty caches (with --processes, instead of '
+            'replaying the log once before measuring)'}),
+)
+
+
+class Command(BaseCommand):
+    help = ('Replays the (host, path) pairs of an access log through the '
+        'subdomain middleware and URL resolution, and reports the throughput, '
+        'the latency percentiles of each subdomain and the unmatched host '
+        'rate, optionally in several processes at the same time.')
+    args = '<file>'
+
+    if django.VERSION < (1, 8):
+        option_list = BaseCommand.option_list + tuple(
+            make_option(*flags, **attributes) for flags, attributes in OPTIONS)
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="the log file, or '-' for stdin")
+        for flags, attributes in OPTIONS:
+            parser.add_argument(*flags, **attributes)
+
+    def handle(self, *args, **options):
+        path = options.get('file') or (args[0] if args else None)
+        if path is None:
+            raise CommandError('Enter the path of the log file to replay.')
+        try:
+            repeat = int(options['repeat'])
+            processes = options['processes']
+            if processes is not None:
+                processes = int(processes)
+        except ValueError:
+            raise CommandError('--repeat and --processes must be numbers.')
+        if processes is not None and processes < 1:
+            raise CommandError('--processes must be at least 1.')
+
+        if path == '-':
+            entries = list(read_entries(sys.stdin))
+        else:
+            try:
+                with open(path) as lines:
+                    entries = list(read_entries(lines))
+            except IOError as error:
+                raise CommandError('Unable to read %s: %s' % (path, error))
+
+        profiler = None
+        if options['profile'] or options['profile_output']:
+            if processes is not None:
+                raise CommandError('Profiling is not supported with '
+                    '--processes.')
+            profiler = cProfile.Profile()
+
+        if processes is not None:
+            try:
+                stats = replay_in_processes(entries, processes, repeat=repeat,
+                    cold=options['cold'], reverse=options['reverse'])
+            except RuntimeError as error:
+                raise CommandError(error)
+        else:
+            if options['cold']:
+                clear_caches()
+            stats = replay(entries, repeat=repeat, profiler=profiler,
+                reverse=options['reverse'])
+        self.stdout.write(format_report(stats))
+
+        if options['profile']:
+            self.stdout.write('')
+            self.stdout.write(format_profile(profiler))
+        if options['profile_output']:
+            profiler.dump_stats(options['profile_output'])
@@ -1,69 +1,441 @@
-import operator
+import atexit
 import logging
-import re
+import sys
+import threading
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponsePermanentRedirect
+from django.middleware.cache import (CacheMiddleware,
+    FetchFromCacheMiddleware, UpdateCacheMiddleware)
 from django.utils.cache import patch_vary_headers
 
-from subdomains.utils import get_domain
+from subdomains.compat import setting_changed
+from subdomains.datastructures import LRUCache
+from subdomains.hosts import (NO_MATCH, get_host_matcher, get_redirect_table,
+    normalize_host, split_host)
+from subdomains.registry import get_host_registry
+from subdomains.routing import get_router
+from subdomains.stats import get_collector, timer
+from subdomains.utils import (get_domain, is_domain_cached, resolver_cache,
+    urljoin)
+
+try:
+    if sys.version_info < (3, 5):
+        raise ImportError('Coroutines require Python 3.5 or newer')
+    from subdomains.coroutines import (AsyncMiddlewareMixin,
+        iscoroutinefunction, markcoroutinefunction)
+except ImportError:  # Python 2, or Django < 3.0
+    AsyncMiddlewareMixin = object
+
+    def iscoroutinefunction(func):
+        return False
+
+    markcoroutinefunction = None
 
 
 logger = logging.getLogger(__name__)
-lower = operator.methodcaller('lower')
 
 UNSET = object()
 
+UNKNOWN_HOST_POLICIES = ('pass', 'reject', 'redirect')
+
+#: Changed whenever a setting of this library is changed, causing the
+#: middleware to read its settings again (see
+#: :meth:`SubdomainMiddleware.configure`.)
+_settings_version = 0
+
+#: The :class:`UnknownHostLog` instances with a summary pending, by id.
+_pending_logs = {}
+
+
+class MiddlewareMixin(AsyncMiddlewareMixin):
+    """
+    Allows the middleware classes to be used in ``MIDDLEWARE_CLASSES`` as well
+    as in ``MIDDLEWARE`` (Django 1.10 and newer), where they run natively in
+    both synchronous and asynchronous (Django 3.1 and newer) handlers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def is_cached(self):
+        """
+        Returns whether :meth:`process_request` can run without blocking on
+        the database or a cache, so that an asynchronous handler may call it
+        on the event loop.
+        """
+        return False
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        response = self.process_request(request)
+        if response is None:
+            response = self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = self.process_response(request, response)
+        return response
+
+
+def reset_middleware(setting=None, **kwargs):
+    global _settings_version
+    if setting is None or setting.startswith('SUBDOMAIN_'):
+        _settings_version += 1
+
+
+setting_changed.connect(reset_middleware)
+
+
+class UnknownHostLog(object):
+    """
+    Rate-limits the warnings logged for hosts that do not belong to the domain.
+
+    The first request for each host is logged as it happens, for at most
+    ``limit`` hosts in every interval of ``interval`` seconds. Further
+    requests, whether for the same hosts or for more hosts, are counted and
+    reported together in a single warning at the end of the interval, by the
+    next request, by a timer if no request comes, or when the interpreter
+    exits (see :func:`flush_unknown_hosts`.) The hosts seen in the
+    current interval are held in a cache of at most ``maxsize`` hosts, so a
+    flood of distinct hosts can't exhaust the memory.
+    """
+    def __init__(self, interval=60, maxsize=1024, limit=10):
+        self.interval = interval
+        self.limit = limit
+        self.hosts = LRUCache(maxsize)
+        self.logged = 0
+        self.started = timer()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, host, domain):
+        """
+        Records a request for ``host``, which does not belong to ``domain``.
+        """
+        now, summary = timer(), None
+        with self._lock:
+            if now - self.started >= self.interval:
+                summary = self.rotate(now)
+            key = (host, domain)
+            count, logged = self.hosts.get(key, (0, False))
+            log = not count and self.logged < self.limit
+            if log:
+                self.logged += 1
+            elif self._timer is None:
+                self.schedule(now)
+            self.hosts.set(key, (count + 1, logged or log))
+
+        if summary is not None:
+            self.log_summary(*summary)
+        if log:
+            logger.warning('The host %s does not belong to the domain %s, '
+                'unable to identify the subdomain for this request',
+                host, domain)
+
+    def flush(self, started=None):
+        """
+        Ends the current interval, logging the requests that were not logged
+        in it. If ``started`` is given, nothing is done unless the current
+        interval started then.
+        """
+        with self._lock:
+            if started is not None and started != self.started:
+                return
+            summary = self.rotate(timer())
+        self.log_summary(*summary)
+
+    def rotate(self, now):
+        """
+        Starts a new interval at ``now``, returning the ``(count, host)``
+        pairs of the requests that were not logged in the last one (most
+        frequent first) and its length.
+        """
+        suppressed = sorted(((count - logged, key[0]) for key, (count, logged)
+            in self.hosts.items() if count > logged), reverse=True)
+        elapsed, self.started = now - self.started, now
+        self.hosts.clear()
+        self.logged = 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            _pending_logs.pop(id(self), None)
+        return suppressed, elapsed
+
+    def schedule(self, now):
+        """
+        Starts a timer that flushes the current interval when it ends.
+        """
+        delay = max(self.started + self.interval - now, 0)
+        self._timer = threading.Timer(delay, self.flush, (self.started,))
+        self._timer.daemon = True
+        self._timer.start()
+        _pending_logs[id(self)] = self
+
+    def log_summary(self, suppressed, elapsed):
+        if suppressed:
+            logger.warning('%d requests for %d hosts that do not belong to '
+                'their domain were not logged in the last %d seconds: %s',
+                sum(count for count, _ in suppressed), len(suppressed),
+                elapsed, ', '.join('%s (%d)' % (host, count)
+                    for count, host in suppressed))
+
+
+def flush_unknown_hosts():
+    """
+    Logs the pending summaries of every :class:`UnknownHostLog` and stops
+    their timers, which is done when the interpreter exits.
+    """
+    for log in list(_pending_logs.values()):
+        timer = log._timer
+        log.flush()
+        if timer is not None and timer is not threading.current_thread():
+            timer.join(1)
+
+
+atexit.register(flush_unknown_hosts)
+
+
+class LazySubdomain(object):
+    """
+    The ``subdomain`` attribute of requests processed by
+    :class:`SubdomainMiddleware` in lazy mode, which identifies the subdomain
+    of the request when it is first read. The result is stored on the request,
+    hiding this descriptor from then on.
+    """
+    def __get__(self, request, owner=None):
+        if request is None:
+            return self
+        request._subdomain_middleware.identify_subdomain(request)
+        return request.__dict__['subdomain']
+
+
+_lazy_classes = {}
+
 
-class SubdomainMiddleware(object):
+def make_lazy(request, middleware):
+    """
+    Gives ``request`` a lazy ``subdomain`` attribute that is identified by
+    ``middleware``, by changing its class to a subclass with a
+    :class:`LazySubdomain` attribute.
+    """
+    cls = request.__class__
+    lazy_class = _lazy_classes.get(cls)
+    if lazy_class is None:
+        lazy_class = _lazy_classes[cls] = type(str('Lazy%s' % cls.__name__),
+            (cls,), {'subdomain': LazySubdomain()})
+    request.__class__ = lazy_class
+    request._subdomain_middleware = middleware
+
+
+class SubdomainMiddleware(MiddlewareMixin):
     """
     A middleware class that adds a ``subdomain`` attribute to the current request.
+
+    If ``settings.SUBDOMAIN_LAZY`` is set, the subdomain is only identified
+    when the attribute is first read (see :meth:`is_lazy`.)
+
+    Requests for hosts that do not belong to the domain are handled according
+    to ``settings.SUBDOMAIN_UNKNOWN_HOST``: ``'pass'`` (the default) processes
+    them with a ``subdomain`` of ``None``, ``'reject'`` responds immediately
+    with ``settings.SUBDOMAIN_UNKNOWN_HOST_STATUS`` (400 by default), and
+    ``'redirect'`` permanently redirects them to the same path on the domain.
     """
+    def __init__(self, get_response=None):
+        super(SubdomainMiddleware, self).__init__(get_response)
+        self.configure()
+
+    def configure(self):
+        """
+        Reads the settings of the middleware, which is done again before the
+        next request whenever a setting of this library is changed.
+        """
+        self.settings_version = _settings_version
+        self.unknown_hosts = UnknownHostLog(
+            getattr(settings, 'SUBDOMAIN_UNKNOWN_HOST_LOG_INTERVAL', 60),
+            getattr(settings, 'SUBDOMAIN_UNKNOWN_HOST_CACHE_SIZE', 1024),
+            getattr(settings, 'SUBDOMAIN_UNKNOWN_HOST_LOG_LIMIT', 10))
+        self.unknown_host_policy = getattr(settings, 'SUBDOMAIN_UNKNOWN_HOST',
+            'pass')
+        self.registry = get_host_registry()
+        self.lazy = getattr(settings, 'SUBDOMAIN_LAZY', False) and \
+            self.unknown_host_policy == 'pass' and self.registry is None
+        self.site_matcher = (None, None)
+
+    def get_host_matcher(self, domain):
+        """
+        Returns the host matcher for ``domain``. The matcher of the domain of
+        the current site is kept by the middleware.
+        """
+        site_domain, matcher = self.site_matcher
+        if domain == site_domain:
+            return matcher
+        return get_host_matcher(domain)
+
     def get_domain_for_request(self, request):
         """
         Returns the domain that will be used to identify the subdomain part
-        for this request.
+        for this request: the host itself if it is a custom domain listed in
+        the host registry, otherwise the domain of the current site.
         """
-        return get_domain()
+        domain = get_domain()
+        site_domain, matcher = self.site_matcher
+        if domain != site_domain:
+            matcher = get_host_matcher(domain)
+            self.site_matcher = (domain, matcher)
+        entry = getattr(request, 'host_entry', None)
+        if entry is not None and matcher.parse(entry.host) is NO_MATCH:
+            return entry.host
+        return domain
+
+    def is_lazy(self):
+        """
+        Returns whether the subdomain should only be identified when the
+        ``subdomain`` attribute of the request is first read, which is the
+        case if ``settings.SUBDOMAIN_LAZY`` is set, unless requests may be
+        rejected or redirected by ``settings.SUBDOMAIN_UNKNOWN_HOST`` or the
+        host registry is enabled.
+        """
+        return self.lazy
+
+    def is_cached(self):
+        """
+        Returns whether the settings have been read and the domain of the
+        current site and the index of the host registry (if enabled) are held
+        in memory, so that processing a request does not block.
+        """
+        if self.settings_version != _settings_version:
+            return False
+        if self.is_lazy():
+            return True
+        registry = self.registry
+        if registry is not None and not registry.is_current():
+            return False
+        return is_domain_cached()
 
     def process_request(self, request):
         """
-        Adds a ``subdomain`` attribute to the ``request`` parameter.
+        Adds a ``subdomain`` attribute to the ``request`` parameter, returning
+        a response if the host is rejected or redirected.
+
+        If the host registry is enabled (see :mod:`subdomains.registry`), the
+        :class:`~subdomains.registry.HostEntry` of the host (or ``None``) and
+        its tenant are also added as ``host_entry`` and ``tenant``.
+        """
+        if self.settings_version != _settings_version:
+            self.configure()
+        if self.is_lazy():
+            make_lazy(request, self)
+            return None
+        return self.identify_subdomain(request)
+
+    def identify_subdomain(self, request):
+        """
+        Identifies the subdomain of ``request``, as described in
+        :meth:`process_request`.
         """
-        domain, host = map(lower,
-            (self.get_domain_for_request(request), request.get_host()))
+        collector = get_collector()
+        if collector is not None:
+            start = timer()
 
-        pattern = r'^(?:(?P<subdomain>.*?)\.)?%s(?::.*)?$' % re.escape(domain)
-        matches = re.match(pattern, host)
+        host = request.get_host()
+        name = normalize_host(host)
 
-        if matches:
-            request.subdomain = matches.group('subdomain')
+        registry = self.registry
+        if registry is not None:
+            request.host_entry = entry = registry.get_index().get(name)
+            request.tenant = None
+            if entry is not None and entry.tenant:
+                request.tenant = entry.tenant
+
+        domain = self.get_domain_for_request(request)
+
+        subdomain = self.get_host_matcher(domain).parse(name)
+
+        if subdomain is not NO_MATCH:
+            request.subdomain = subdomain
+            if collector is not None:
+                collector.subdomain_identified(subdomain, timer() - start)
         else:
             request.subdomain = None
-            logger.warning('The host %s does not belong to the domain %s, '
-                'unable to identify the subdomain for this request',
-                request.get_host(), domain)
+            self.unknown_hosts.add(host, domain)
+            if collector is not None:
+                collector.host_unmatched(host, domain, timer() - start)
+            return self.process_unknown_host(request, domain)
+
+    def process_unknown_host(self, request, domain):
+        """
+        Returns the response for a request for a host that does not belong to
+        ``domain``, or ``None`` to process the request as usual.
+        """
+        policy = self.unknown_host_policy
+        if policy == 'pass':
+            return None
+        elif policy == 'reject':
+            return HttpResponse(
+                status=getattr(settings, 'SUBDOMAIN_UNKNOWN_HOST_STATUS', 400))
+        elif policy == 'redirect':
+            scheme = 'https' if request.is_secure() else 'http'
+            return HttpResponsePermanentRedirect(
+                urljoin(domain, request.get_full_path(), scheme))
+        raise ImproperlyConfigured('Invalid SUBDOMAIN_UNKNOWN_HOST policy '
+            '%r, expected one of: %s' % (policy,
+                ', '.join(UNKNOWN_HOST_POLICIES)))
 
 
 class SubdomainURLRoutingMiddleware(SubdomainMiddleware):
     """
     A middleware class that allows for subdomain-based URL routing.
     """
+    def is_lazy(self):
+        # The subdomain is always needed to select the urlconf.
+        return False
+
     def process_request(self, request):
         """
-        Sets the current request's ``urlconf`` attribute to the urlconf
-        associated with the subdomain, if it is listed in
-        ``settings.SUBDOMAIN_URLCONFS``.
+        Sets the current request's ``urlconf`` attribute to the urlconf of the
+        host in the host registry, or to the urlconf associated with the
+        subdomain, if it is listed in ``settings.SUBDOMAIN_URLCONFS`` or
+        matches a pattern in ``settings.SUBDOMAIN_URLCONF_PATTERNS``. The
+        labels captured by the pattern are added to the request as a
+        ``subdomain_kwargs`` dictionary.
         """
-        super(SubdomainURLRoutingMiddleware, self).process_request(request)
+        response = super(SubdomainURLRoutingMiddleware,
+            self).process_request(request)
+        if response is not None:
+            return response
+
+        collector = get_collector()
+        if collector is not None:
+            start = timer()
 
         subdomain = getattr(request, 'subdomain', UNSET)
+        request.subdomain_kwargs = {}
 
         if subdomain is not UNSET:
-            urlconf = settings.SUBDOMAIN_URLCONFS.get(subdomain)
+            entry = getattr(request, 'host_entry', None)
+            if entry is not None and entry.urlconf:
+                urlconf = entry.urlconf
+            else:
+                urlconf = settings.SUBDOMAIN_URLCONFS.get(subdomain)
+            if urlconf is None:
+                match = get_router().match(subdomain)
+                if match is not None:
+                    urlconf, request.subdomain_kwargs = match
             if urlconf is not None:
                 logger.debug("Using urlconf %s for subdomain: %s",
                     repr(urlconf), repr(subdomain))
                 request.urlconf = urlconf
+                resolver_cache.get_request_resolver(urlconf)
+
+            if collector is not None:
+                collector.urlconf_selected(subdomain, urlconf, timer() - start)
 
     def process_response(self, request, response):
         """
@@ -74,3 +446,202 @@ class SubdomainURLRoutingMiddleware(SubdomainMiddleware):
             patch_vary_headers(response, ('Host',))
 
         return response
+
+
+class SubdomainRedirectMiddleware(MiddlewareMixin):
+    """
+    A middleware class that permanently redirects requests for alias hosts to
+    their canonical host, keeping the scheme, port, path and query string.
+
+    The aliases are listed in ``settings.SUBDOMAIN_REDIRECTS`` (see
+    :func:`~subdomains.hosts.get_redirect_table`), and looked up in a table
+    of hosts that is built once per domain, so alias requests are answered
+    without identifying the subdomain or resolving a urlconf. This middleware
+    should be placed at the front of the middleware.
+    """
+    def is_cached(self):
+        return is_domain_cached()
+
+    def process_request(self, request):
+        name, port = split_host(request.get_host())
+        target = get_redirect_table(get_domain()).get(name)
+        if target is None:
+            return None
+        if port:
+            target = '%s:%s' % (target, port)
+        scheme = 'https' if request.is_secure() else 'http'
+        return HttpResponsePermanentRedirect(
+            urljoin(target, request.get_full_path(), scheme))
+
+
+class MiddlewareChain(object):
+    """
+    A chain of middleware built from a list of middleware paths, the same way
+    Django builds ``settings.MIDDLEWARE``, ending with ``get_response``.
+    """
+    def __init__(self, paths, get_response):
+        from django.core.handlers.exception import (
+            convert_exception_to_response)
+        from django.utils.module_loading import import_string
+
+        self.view_middleware = []
+        self.template_response_middleware = []
+        self.exception_middleware = []
+
+        handler = get_response
+        for path in reversed(paths):
+            try:
+                instance = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if instance is None:
+                raise ImproperlyConfigured('Middleware factory %s returned '
+                    'None.' % path)
+
+            if hasattr(instance, 'process_view'):
+                self.view_middleware.insert(0, instance.process_view)
+            if hasattr(instance, 'process_template_response'):
+                self.template_response_middleware.append(
+                    instance.process_template_response)
+            if hasattr(instance, 'process_exception'):
+                self.exception_middleware.append(instance.process_exception)
+
+            handler = convert_exception_to_response(instance)
+        self.handler = handler
+
+
+class SubdomainDispatchMiddleware(object):
+    """
+    A middleware class that runs a separate middleware chain for each
+    subdomain, as listed in ``settings.SUBDOMAIN_MIDDLEWARE``. Subdomains that
+    are not listed run the middleware in
+    ``settings.SUBDOMAIN_DEFAULT_MIDDLEWARE``, if any. The chains are built
+    once, when the middleware is loaded.
+
+    This middleware must be listed in ``settings.MIDDLEWARE`` (Django 1.10 and
+    newer) after :class:`SubdomainMiddleware` or
+    :class:`SubdomainURLRoutingMiddleware`.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response=None):
+        if get_response is None:
+            raise ImproperlyConfigured('SubdomainDispatchMiddleware can only '
+                'be used in settings.MIDDLEWARE (Django 1.10 and newer).')
+        self.get_response = get_response
+        self.chains = dict((subdomain, MiddlewareChain(paths, get_response))
+            for subdomain, paths
+            in getattr(settings, 'SUBDOMAIN_MIDDLEWARE', {}).items())
+        self.default_chain = MiddlewareChain(getattr(settings,
+            'SUBDOMAIN_DEFAULT_MIDDLEWARE', ()), get_response)
+
+    def get_chain(self, request):
+        """
+        Returns the :class:`MiddlewareChain` for the subdomain of ``request``.
+        """
+        return self.chains.get(getattr(request, 'subdomain', None),
+            self.default_chain)
+
+    def __call__(self, request):
+        return self.get_chain(request).handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for method in self.get_chain(request).view_middleware:
+            response = method(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+
+    def process_template_response(self, request, response):
+        for method in self.get_chain(request).template_response_middleware:
+            response = method(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        for method in self.get_chain(request).exception_middleware:
+            response = method(request, exception)
+            if response is not None:
+                return response
+
+
+class SubdomainCacheKeyMixin(object):
+    """
+    Generates the cache keys of Django's cache middleware from the subdomain
+    of a request and the domain, rather than from the HTTP ``Host`` header, so
+    that hosts that only differ by their case or port (or by a subdomain alias
+    listed in ``settings.SUBDOMAIN_CACHE_ALIASES``, e.g. ``{'www': None}``)
+    share the same cached pages.
+
+    Requests for hosts that do not belong to the domain are cached by their
+    HTTP ``Host`` header, as usual.
+    """
+    def get_cache_host(self, request):
+        """
+        Returns the host used to generate the cache keys for ``request``, or
+        ``None`` if the host does not belong to the domain.
+        """
+        domain = get_domain()
+        subdomain = get_host_matcher(domain).match(request.get_host())
+        if subdomain is NO_MATCH:
+            return None
+
+        aliases = getattr(settings, 'SUBDOMAIN_CACHE_ALIASES', None)
+        if aliases:
+            subdomain = aliases.get(subdomain, subdomain)
+        if subdomain:
+            return '%s.%s' % (subdomain, domain)
+        return domain
+
+    def call_with_cache_host(self, request, func, *args):
+        """
+        Calls ``func`` with ``args`` while the host of ``request`` is replaced
+        by its cache host.
+        """
+        host = self.get_cache_host(request)
+        if host is None:
+            return func(*args)
+
+        meta = request.META
+        saved = dict((key, meta[key]) for key in
+            ('HTTP_HOST', 'HTTP_X_FORWARDED_HOST') if key in meta)
+        meta['HTTP_HOST'] = host
+        meta.pop('HTTP_X_FORWARDED_HOST', None)
+        try:
+            return func(*args)
+        finally:
+            meta.pop('HTTP_HOST', None)
+            meta.update(saved)
+
+
+class SubdomainUpdateCacheMiddleware(SubdomainCacheKeyMixin,
+        UpdateCacheMiddleware):
+    """
+    A replacement for :class:`django.middleware.cache.UpdateCacheMiddleware`
+    that partitions the cache by subdomain (see
+    :class:`SubdomainCacheKeyMixin`.)
+    """
+    def process_response(self, request, response):
+        return self.call_with_cache_host(request,
+            super(SubdomainUpdateCacheMiddleware, self).process_response,
+            request, response)
+
+
+class SubdomainFetchFromCacheMiddleware(SubdomainCacheKeyMixin,
+        FetchFromCacheMiddleware):
+    """
+    A replacement for :class:`django.middleware.cache.FetchFromCacheMiddleware`
+    that partitions the cache by subdomain (see
+    :class:`SubdomainCacheKeyMixin`.)
+    """
+    def process_request(self, request):
+        return self.call_with_cache_host(request,
+            super(SubdomainFetchFromCacheMiddleware, self).process_request,
+            request)
+
+
+class SubdomainCacheMiddleware(SubdomainUpdateCacheMiddleware,
+        SubdomainFetchFromCacheMiddleware, CacheMiddleware):
+    """
+    A replacement for :class:`django.middleware.cache.CacheMiddleware` that
+    partitions the cache by subdomain (see :class:`SubdomainCacheKeyMixin`.)
+    """
@@ -0,0 +1,210 @@
+"""
+A registry of hosts, stored with the
+:class:`~subdomains.registry.models.Host` model, that maps custom tenant
+domains and subdomains to urlconfs and tenants.
+
+The registry is an optional application: add ``subdomains.registry`` to
+``settings.INSTALLED_APPS``, run its migrations, and enable it with
+``settings.SUBDOMAIN_HOST_REGISTRY = True``.
+All hosts are loaded into an in-memory index the first time the registry is
+used, so the middleware looks hosts up without querying the database. Saving
+or deleting a host changes a version stamp, which is shared between processes
+through the Django cache named by ``settings.SUBDOMAIN_REGISTRY_CACHE_ALIAS``
+(``default`` by default, or ``None`` to only share it within the process.)
+The version is checked at most every
+``settings.SUBDOMAIN_REGISTRY_CHECK_INTERVAL`` seconds (5 by default), and
+when it has changed, the index is rebuilt in a background thread while the
+previous index keeps serving requests.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+
+from subdomains.compat import get_cache, is_installed
+from subdomains.hosts import normalize_host
+
+
+default_app_config = 'subdomains.registry.apps.HostRegistryConfig'
+
+logger = logging.getLogger(__name__)
+
+#: A host of the registry.
+HostEntry = namedtuple('HostEntry', ('host', 'urlconf', 'tenant'))
+
+
+class HostIndex(object):
+    """
+    An immutable index of :class:`HostEntry` tuples by host.
+    """
+    def __init__(self, entries=()):
+        self._entries = dict((entry.host, entry) for entry in entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, host):
+        return host in self._entries
+
+    def get(self, host):
+        """
+        Returns the entry for the normalized ``host`` without a port (see
+        :func:`~subdomains.hosts.normalize_host`), or ``None``.
+        """
+        return self._entries.get(host)
+
+
+class HostRegistry(object):
+    """
+    Looks hosts up in a :class:`HostIndex` of the
+    :class:`~subdomains.registry.models.Host` objects, rebuilding it when the
+    hosts are changed.
+    """
+    version_key = 'subdomains:host-registry-version'
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.checked = 0
+        self.local_version = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._connected = False
+
+    def get(self, host):
+        """
+        Returns the :class:`HostEntry` for ``host``, or ``None`` if the host is
+        not registered. Any port number on the host is ignored.
+        """
+        return self.get_index().get(normalize_host(host))
+
+    def get_index(self):
+        """
+        Returns the current :class:`HostIndex`, loading it on first use and
+        starting a rebuild if the hosts have changed since it was loaded.
+        """
+        if not self._connected:
+            self.connect()
+
+        index = self.index
+        if index is None:
+            with self._lock:
+                if self.index is None:
+                    self.rebuild()
+                return self.index
+
+        now = time.time()
+        interval = getattr(settings, 'SUBDOMAIN_REGISTRY_CHECK_INTERVAL', 5)
+        if now - self.checked >= interval:
+            self.checked = now
+            if self.get_version() != self.version:
+                self.rebuild_in_background()
+        return index
+
+    def is_current(self):
+        """
+        Returns whether :meth:`get_index` would return the loaded index
+        without checking the version of the registered hosts.
+        """
+        interval = getattr(settings, 'SUBDOMAIN_REGISTRY_CHECK_INTERVAL', 5)
+        return self._connected and self.index is not None and \
+            time.time() - self.checked < interval
+
+    def get_shared_cache(self):
+        alias = getattr(settings, 'SUBDOMAIN_REGISTRY_CACHE_ALIAS', 'default')
+        if alias is None:
+            return None
+        return get_cache(alias)
+
+    def get_version(self):
+        """
+        Returns the version of the registered hosts.
+        """
+        cache = self.get_shared_cache()
+        if cache is None:
+            return self.local_version, None
+        cache.add(self.version_key, uuid.uuid4().hex, None)
+        return self.local_version, cache.get(self.version_key)
+
+    def load(self):
+        """
+        Returns a new :class:`HostIndex` of the registered hosts.
+        """
+        from subdomains.registry.models import Host
+        return HostIndex(HostEntry(*values) for values in
+            Host.objects.values_list('host', 'urlconf', 'tenant').iterator())
+
+    def rebuild(self):
+        """
+        Loads the registered hosts, replacing the current index.
+        """
+        version = self.get_version()
+        self.index, self.version = self.load(), version
+        self.checked = time.time()
+        logger.debug('Loaded %d registered hosts', len(self.index))
+
+    def rebuild_in_background(self):
+        """
+        Rebuilds the index in a new thread, unless a rebuild is already in
+        progress, returning the thread.
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                thread = self._thread = threading.Thread(target=self._rebuild,
+                    name='subdomains-registry')
+                thread.daemon = True
+                thread.start()
+            return thread
+
+    def _rebuild(self):
+        from django.db import connection
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Unable to rebuild the host registry')
+        finally:
+            connection.close()
+            self._thread = None
+
+    def invalidate(self, **kwargs):
+        """
+        Changes the version of the registered hosts, causing the index of this
+        process to be rebuilt when it is next used, and the indexes of other
+        processes within their check interval.
+        """
+        self.local_version += 1
+        self.checked = 0
+        cache = self.get_shared_cache()
+        if cache is not None:
+            cache.set(self.version_key, uuid.uuid4().hex, None)
+
+    def connect(self):
+        if not is_installed('subdomains.registry'):
+            raise ImproperlyConfigured('The host registry requires '
+                '"subdomains.registry" in INSTALLED_APPS.')
+
+        from subdomains.registry.models import Host
+        for signal in (post_save, post_delete):
+            signal.connect(self.invalidate, sender=Host, weak=False,
+                dispatch_uid='subdomains.registry.HostRegistry')
+        self._connected = True
+
+
+#: The process-wide :class:`HostRegistry` used by the middleware.
+host_registry = HostRegistry()
+
+
+def get_host_registry():
+    """
+    Returns :data:`host_registry` if ``settings.SUBDOMAIN_HOST_REGISTRY`` is
+    set, or ``None``.
+    """
+    if getattr(settings, 'SUBDOMAIN_HOST_REGISTRY', False):
+        return host_registry
+    return None
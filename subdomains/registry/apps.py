@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class HostRegistryConfig(AppConfig):
+    name = 'subdomains.registry'
+    label = 'subdomains_registry'
+    verbose_name = 'Subdomain host registry'
+    default_auto_field = 'django.db.models.AutoField'
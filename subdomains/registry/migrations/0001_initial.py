@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='Host',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                    auto_created=True, primary_key=True)),
+                ('host', models.CharField(unique=True, max_length=255,
+                    verbose_name='host', help_text='The host name, without a '
+                    'port, e.g. "shop.example.org".')),
+                ('urlconf', models.CharField(max_length=255, blank=True,
+                    verbose_name='urlconf', help_text='The module path of the '
+                    'urlconf used for the host, if any.')),
+                ('tenant', models.CharField(max_length=255, blank=True,
+                    verbose_name='tenant', help_text='The identifier of the '
+                    'tenant the host belongs to, if any.')),
+            ],
+            options={
+                'db_table': 'subdomains_registry_host',
+                'ordering': ('host',),
+                'verbose_name': 'host',
+                'verbose_name_plural': 'hosts',
+            },
+        ),
+    ]
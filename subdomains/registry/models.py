@@ -0,0 +1,32 @@
+from django.db import models
+
+from subdomains.hosts import normalize_host
+
+
+class Host(models.Model):
+    """
+    A host (a custom tenant domain, or a subdomain of the site domain) that is
+    routed to a urlconf and associated with a tenant, as used by the host
+    registry (see :mod:`subdomains.registry`.)
+    """
+    host = models.CharField('host', max_length=255, unique=True,
+        help_text='The host name, without a port, e.g. "shop.example.org".')
+    urlconf = models.CharField('urlconf', max_length=255, blank=True,
+        help_text='The module path of the urlconf used for the host, if any.')
+    tenant = models.CharField('tenant', max_length=255, blank=True,
+        help_text='The identifier of the tenant the host belongs to, if any.')
+
+    class Meta:
+        db_table = 'subdomains_registry_host'
+        ordering = ('host',)
+        verbose_name = 'host'
+        verbose_name_plural = 'hosts'
+
+    def __str__(self):
+        return self.host
+
+    __unicode__ = __str__
+
+    def save(self, *args, **kwargs):
+        self.host = normalize_host(self.host)
+        super(Host, self).save(*args, **kwargs)
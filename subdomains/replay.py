@@ -0,0 +1,367 @@
+"""
+Replays requests from an access log through the subdomain middleware and URL
+resolution, in process and without a network, to measure how the host
+identification and URL routing perform on a real distribution of hosts and
+urlconfs.
+
+The log is a file of ``host path`` pairs, one per line (further fields are
+ignored, and so are blank lines and lines starting with ``#``)::
+
+    example.com /
+    api.example.com /v1/users/?page=2
+    https://shop.example.com/products/42/
+
+Each request is processed by
+:class:`~subdomains.middleware.SubdomainURLRoutingMiddleware`, which
+identifies the subdomain and selects the urlconf, and its path is then
+resolved with the selected urlconf. Only this processing is timed, not the
+construction of the requests. Optionally, the URL of each resolved route is
+also reversed on the subdomain of the request with
+:func:`subdomains.utils.reverse`.
+
+The log can also be replayed by a pool of forked processes at the same time
+(see :func:`replay_in_processes`), to measure how the library scales across
+cores the way a preforking server runs it. Each worker either starts warm, by
+replaying the log once before it is measured, or cold, with the caches that
+are filled by the first requests cleared (see :func:`clear_caches`.)
+
+The ``replayhosts`` management command replays a log and prints a report::
+
+    python manage.py replayhosts access.log --repeat 3 --profile
+    python manage.py replayhosts access.log --processes 8 --cold --reverse
+"""
+import functools
+import math
+import pstats
+import traceback
+
+from django.core.exceptions import SuspiciousOperation
+
+from subdomains import fastreverse, hosts
+from subdomains.compat import (NoReverseMatch, Resolver404, clear_url_caches,
+    resolve)
+from subdomains.hosts import NO_MATCH, get_host_matcher
+from subdomains.stats import timer
+from subdomains.utils import (domain_cache, resolver_cache, reverse_cache,
+    reverse as subdomain_reverse)
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+
+def read_entries(lines):
+    """
+    Returns an iterator of the ``(host, path)`` pairs in ``lines``. A line
+    may also contain a single absolute URL.
+    """
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        if len(fields) == 1:
+            url = urlsplit(fields[0])
+            if not url.netloc:
+                continue
+            path = url.path or '/'
+            if url.query:
+                path = '%s?%s' % (path, url.query)
+            yield url.netloc, path
+        else:
+            yield fields[0], fields[1]
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of the sorted ``values``.
+    """
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class ReplayStats(object):
+    """
+    The results of replaying requests: the latency of each request by
+    subdomain, and the number of requests for hosts that do not belong to the
+    domain (``unmatched``), that were answered by the middleware
+    (``responded``), whose path could not be resolved (``unresolved``), or
+    whose host was not allowed (``disallowed``).
+
+    ``duration`` is the time spent processing the requests, which is the
+    longest duration of the workers if the requests were replayed by several
+    processes at the same time.
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.duration = 0.0
+        self.workers = 1
+        self.unmatched = 0
+        self.responded = 0
+        self.unresolved = 0
+        self.disallowed = 0
+
+    @property
+    def count(self):
+        return sum(len(values) for values in self.latencies.values())
+
+    def add(self, subdomain, latency):
+        self.latencies.setdefault(subdomain, []).append(latency)
+
+    def merge(self, other, concurrent=False):
+        """
+        Adds the results of ``other`` to these results, which were replayed at
+        the same time by another process if ``concurrent`` is set.
+        """
+        for subdomain, values in other.latencies.items():
+            self.latencies.setdefault(subdomain, []).extend(values)
+        if concurrent:
+            self.duration = max(self.duration, other.duration)
+            self.workers += other.workers
+        else:
+            self.duration += other.duration
+        self.unmatched += other.unmatched
+        self.responded += other.responded
+        self.unresolved += other.unresolved
+        self.disallowed += other.disallowed
+
+    def summary(self):
+        """
+        Returns a dictionary of the throughput, rates and the latency
+        percentiles of each subdomain, in seconds.
+        """
+        count = self.count
+        total = count + self.disallowed
+        subdomains = {}
+        for subdomain, values in self.latencies.items():
+            values = sorted(values)
+            subdomains[subdomain] = {
+                'count': len(values),
+                'p50': percentile(values, 0.5),
+                'p90': percentile(values, 0.9),
+                'p99': percentile(values, 0.99),
+                'p999': percentile(values, 0.999),
+                'max': values[-1],
+            }
+        return {
+            'count': count,
+            'workers': self.workers,
+            'duration': self.duration,
+            'throughput': count / self.duration if self.duration else None,
+            'unmatched': self.unmatched,
+            'unmatched_rate': float(self.unmatched) / total if total else None,
+            'responded': self.responded,
+            'unresolved': self.unresolved,
+            'disallowed': self.disallowed,
+            'subdomains': subdomains,
+        }
+
+
+def replay(entries, repeat=1, profiler=None, reverse=False):
+    """
+    Replays the ``(host, path)`` pairs of ``entries`` ``repeat`` times,
+    returning the :class:`ReplayStats`. If a ``profiler`` (e.g. a
+    :class:`cProfile.Profile`) is given, it is enabled while the requests are
+    processed. If ``reverse`` is set, the URL of each resolved route is also
+    reversed.
+    """
+    from django.test.client import RequestFactory
+    from subdomains.middleware import SubdomainURLRoutingMiddleware
+
+    factory = RequestFactory()
+    middleware = SubdomainURLRoutingMiddleware()
+    stats = ReplayStats()
+    for _ in range(repeat):
+        for host, path in entries:
+            request = factory.get(path, HTTP_HOST=host)
+            if profiler is not None:
+                profiler.enable()
+            start = timer()
+            try:
+                response = middleware.process_request(request)
+                if response is None:
+                    match = resolve(request.path_info,
+                        getattr(request, 'urlconf', None))
+                    if reverse and match.url_name is not None:
+                        reverse_match(request, match)
+            except Resolver404:
+                stats.unresolved += 1
+            except SuspiciousOperation:
+                stats.disallowed += 1
+                continue
+            else:
+                if response is not None:
+                    stats.responded += 1
+            finally:
+                latency = timer() - start
+                if profiler is not None:
+                    profiler.disable()
+
+            stats.duration += latency
+            stats.add(request.subdomain, latency)
+            domain = middleware.get_domain_for_request(request)
+            if get_host_matcher(domain).match(request.get_host()) is NO_MATCH:
+                stats.unmatched += 1
+    return stats
+
+
+def reverse_match(request, match):
+    """
+    Reverses the route of the resolved ``match`` on the subdomain of
+    ``request``, returning the URL or ``None``.
+    """
+    try:
+        return subdomain_reverse(match.view_name, subdomain=request.subdomain,
+            args=None if match.kwargs else match.args, kwargs=match.kwargs)
+    except NoReverseMatch:
+        return None
+
+
+def clear_caches():
+    """
+    Clears the caches of this process that are filled by the first requests:
+    the URL resolvers, the cached site and domain, the host matchers, the
+    reverse cache and the compiled routes of :mod:`subdomains.fastreverse`.
+    """
+    from django.contrib.sites.models import Site
+
+    clear_url_caches()
+    resolver_cache.clear()
+    reverse_cache.clear()
+    fastreverse.clear_engines()
+    hosts._matchers.clear()
+    domain_cache.clear()
+    Site.objects.clear_cache()
+
+
+def run_in_processes(func, processes, setup=None):
+    """
+    Calls ``func`` in each of ``processes`` forked processes, returning the
+    list of the results. Each process calls ``setup`` (if given) first, and
+    ``func`` is only called once every process is set up, so the processes
+    start working at the same moment.
+
+    Raises :exc:`RuntimeError` if a process fails, or if processes cannot be
+    forked on this platform.
+    """
+    import multiprocessing
+    from django.db import connections
+
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:  # Python 2
+        context = multiprocessing
+    except ValueError:
+        raise RuntimeError('Running in several processes requires fork().')
+
+    # The processes open their own database connections (connections to
+    # in-memory SQLite databases are not closed, and are copied instead.)
+    for connection in connections.all():
+        connection.close()
+
+    ready, start, results = context.Queue(), context.Event(), context.Queue()
+    workers = [context.Process(target=_work,
+        args=(func, setup, ready, start, results))
+        for _ in range(processes)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        ready.get()
+    start.set()
+
+    outcomes = [results.get() for worker in workers]
+    for worker in workers:
+        worker.join()
+    for error, result in outcomes:
+        if error is not None:
+            raise RuntimeError('A worker process failed:\n%s' % error)
+    return [result for error, result in outcomes]
+
+
+def _work(func, setup, ready, start, results):
+    try:
+        try:
+            if setup is not None:
+                setup()
+        finally:
+            ready.put(None)
+        start.wait()
+        results.put((None, func()))
+    except Exception:
+        results.put((traceback.format_exc(), None))
+
+
+def replay_in_processes(entries, processes, repeat=1, cold=False,
+        reverse=False):
+    """
+    Replays ``entries`` like :func:`replay` in each of ``processes`` forked
+    processes at the same time, returning the combined :class:`ReplayStats`.
+    Each process replays the entries once before it is measured, or clears
+    its caches with :func:`clear_caches` if ``cold`` is set.
+    """
+    work = functools.partial(replay, entries, repeat=repeat, reverse=reverse)
+    if cold:
+        setup = clear_caches
+    else:
+        setup = functools.partial(replay, entries, reverse=reverse)
+
+    stats = None
+    for result in run_in_processes(work, processes, setup=setup):
+        if stats is None:
+            stats = result
+        else:
+            stats.merge(result, concurrent=True)
+    return stats
+
+
+def format_report(stats):
+    """
+    Returns the summary of the :class:`ReplayStats` ``stats`` as text, with
+    the latencies in microseconds.
+    """
+    summary = stats.summary()
+    if not summary['count']:
+        return 'No requests were replayed.'
+
+    lines = [
+        'Replayed %d requests in %.3fs (%.1f requests/s)' % (summary['count'],
+            summary['duration'], summary['throughput']),
+    ]
+    if summary['workers'] > 1:
+        lines[0] += ' with %d processes' % summary['workers']
+    lines += [
+        'Unmatched hosts: %d (%.2f%%)' % (summary['unmatched'],
+            summary['unmatched_rate'] * 100),
+    ]
+    for name in ('responded', 'unresolved', 'disallowed'):
+        if summary[name]:
+            lines.append('%s: %d' % (name.capitalize(), summary[name]))
+
+    lines.append('')
+    lines.append('%-32s %8s %10s %10s %10s %10s %10s' % ('subdomain',
+        'requests', 'p50', 'p90', 'p99', 'p99.9', 'max'))
+    rows = sorted(summary['subdomains'].items(),
+        key=lambda item: (-item[1]['count'], item[0] or ''))
+    for subdomain, row in rows:
+        lines.append('%-32s %8d %8.1fus %8.1fus %8.1fus %8.1fus %8.1fus' % (
+            '(none)' if subdomain is None else subdomain, row['count'],
+            row['p50'] * 1e6, row['p90'] * 1e6, row['p99'] * 1e6,
+            row['p999'] * 1e6, row['max'] * 1e6))
+    return '\n'.join(lines)
+
+
+def format_profile(profiler, limit=25):
+    """
+    Returns the functions that took the most cumulative time in ``profiler``
+    as text.
+    """
+    stream = StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats(
+        'cumulative').print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,172 @@
+"""
+Pattern-based subdomain routing.
+
+In addition to the exact subdomains listed in ``settings.SUBDOMAIN_URLCONFS``,
+urlconfs can be associated with subdomain patterns in
+``settings.SUBDOMAIN_URLCONF_PATTERNS``::
+
+    SUBDOMAIN_URLCONF_PATTERNS = {
+        '*.api': 'myproject.urls.api',
+        '{tenant}': 'myproject.urls.tenant',
+        '{tenant}.{region}.app': 'myproject.urls.app',
+    }
+
+Each dot-separated label of a pattern is either a literal label, ``*`` which
+matches any single label, or ``{name}`` which matches any single label and
+captures it as ``name``. Patterns are compiled once into a trie of labels, so
+finding the urlconf for a subdomain does not depend on the number of patterns.
+Where more than one pattern matches, literal labels are preferred to captured
+labels, and captured labels to wildcards, starting from the label closest to
+the domain. When a preferred branch of the trie does not lead to a match, the
+next one is tried. Every node of the trie is reached by a single path, which
+always ends at the same label of the subdomain, so each node is tried at most
+once and a match never takes more steps than the trie has nodes.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from subdomains.compat import setting_changed
+
+
+PARAMETER_RE = re.compile(r'^\{([A-Za-z_][A-Za-z0-9_]*)\}$')
+
+
+class Node(object):
+    """
+    A node of the label trie of a :class:`SubdomainRouter`.
+    """
+    def __init__(self):
+        self.children = {}
+        self.parameter_node = None
+        self.wildcard_node = None
+        self.urlconf = None
+        self.pattern = None
+        self.parameters = ()
+
+    def child(self, label):
+        """
+        Returns the child node for ``label``, creating it if necessary.
+        """
+        if label == '*':
+            if self.wildcard_node is None:
+                self.wildcard_node = Node()
+            return self.wildcard_node
+
+        if PARAMETER_RE.match(label):
+            # Parameters share one node whatever their names, which are kept
+            # by the node at the end of each pattern instead.
+            if self.parameter_node is None:
+                self.parameter_node = Node()
+            return self.parameter_node
+
+        if not label or '{' in label or '}' in label or '*' in label:
+            raise ImproperlyConfigured('Invalid subdomain pattern label: %r'
+                % label)
+        return self.children.setdefault(label.lower(), Node())
+
+
+class SubdomainRouter(object):
+    """
+    Finds the urlconf associated with a subdomain from a mapping of subdomain
+    patterns to urlconfs.
+    """
+    def __init__(self, patterns=None):
+        self.root = Node()
+        for pattern, urlconf in (patterns or {}).items():
+            self.add(pattern, urlconf)
+
+    def add(self, pattern, urlconf):
+        labels = pattern.split('.')
+        node = self.root
+        for label in reversed(labels):
+            node = node.child(label)
+        if node.pattern is not None:
+            raise ImproperlyConfigured('Conflicting subdomain patterns %r and '
+                '%r' % (node.pattern, pattern))
+        node.urlconf, node.pattern = urlconf, pattern
+        node.parameters = tuple(match.group(1) for match in
+            map(PARAMETER_RE.match, labels) if match)
+
+    def match(self, subdomain):
+        """
+        Returns a ``(urlconf, kwargs)`` tuple for ``subdomain``, where
+        ``kwargs`` contains the captured labels, or ``None`` if no pattern
+        matches.
+        """
+        if not subdomain:
+            return None
+        labels = subdomain.split('.')
+        result = self._match(self.root, labels, len(labels) - 1)
+        if result is None:
+            return None
+        node, values = result
+        return node.urlconf, dict(zip(node.parameters, values))
+
+    def _match(self, node, labels, index):
+        """
+        Returns the node at the end of the preferred pattern matching the
+        labels up to ``index`` from ``node``, and the list of the labels
+        captured along the way, or ``None``.
+        """
+        if index < 0:
+            if node.urlconf is None:
+                return None
+            return node, []
+
+        label = labels[index]
+        child = node.children.get(label)
+        if child is not None:
+            result = self._match(child, labels, index - 1)
+            if result is not None:
+                return result
+
+        if node.parameter_node is not None:
+            result = self._match(node.parameter_node, labels, index - 1)
+            if result is not None:
+                result[1].append(label)
+                return result
+
+        if node.wildcard_node is not None:
+            return self._match(node.wildcard_node, labels, index - 1)
+
+        return None
+
+    def urlconfs(self):
+        """
+        Returns the set of urlconfs referenced by the router.
+        """
+        urlconfs, nodes = set(), [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node.urlconf is not None:
+                urlconfs.add(node.urlconf)
+            nodes.extend(node.children.values())
+            nodes.extend(n for n in (node.parameter_node, node.wildcard_node)
+                if n is not None)
+        return urlconfs
+
+
+_router = None
+
+
+def get_router():
+    """
+    Returns the :class:`SubdomainRouter` for
+    ``settings.SUBDOMAIN_URLCONF_PATTERNS``, compiling it on first use.
+    """
+    global _router
+    if _router is None:
+        _router = SubdomainRouter(
+            getattr(settings, 'SUBDOMAIN_URLCONF_PATTERNS', None))
+    return _router
+
+
+def clear_router(setting=None, **kwargs):
+    global _router
+    if setting in (None, 'SUBDOMAIN_URLCONF_PATTERNS'):
+        _router = None
+
+
+setting_changed.connect(clear_router)
@@ -0,0 +1,131 @@
+"""
+Hyperlinked fields for Django REST framework serializers that link to
+resources on any subdomain::
+
+    from subdomains.serializers import SubdomainHyperlinkedIdentityField
+
+    class UserSerializer(serializers.ModelSerializer):
+        url = SubdomainHyperlinkedIdentityField(view_name='user-detail',
+            subdomain='api')
+
+The fields build their URLs with a :class:`~subdomains.urlbuilder.URLBuilder`
+for each view name and subdomain, which is kept by the field for as long as
+the serializer, so the links of a whole page of results (with ``many=True``)
+are built from a single lookup of the prefix and route template.
+
+URLs given as input are resolved with the urlconf of the subdomain of their
+host, or of the field's ``subdomain`` for paths.
+"""
+from rest_framework.relations import HyperlinkedRelatedField
+
+from subdomains.compat import get_urlconf, set_urlconf, string_types
+from subdomains.hosts import NO_MATCH, get_host_matcher
+from subdomains.urlbuilder import URLBuilder
+from subdomains.utils import get_domain, get_urlconf_for_subdomain
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+
+UNSET = object()
+
+
+class SubdomainHyperlinkedRelatedField(HyperlinkedRelatedField):
+    """
+    A :class:`~rest_framework.relations.HyperlinkedRelatedField` whose URLs
+    are reversed on ``subdomain``, or on the subdomain of the request if it is
+    not given (``None`` is the domain itself.) The URLs use the scheme of the
+    request, unless ``scheme`` is given.
+
+    Input URLs are resolved with the urlconf of the subdomain of their host,
+    and input paths with the urlconf of ``subdomain``, if it is given.
+    """
+    def __init__(self, view_name=None, subdomain=UNSET, scheme=None, **kwargs):
+        self.subdomain = subdomain
+        self.scheme = scheme
+        self.builders = {}
+        super(SubdomainHyperlinkedRelatedField, self).__init__(view_name,
+            **kwargs)
+
+    def get_builder(self, view_name, request):
+        """
+        Returns the :class:`~subdomains.urlbuilder.URLBuilder` of
+        ``view_name`` for ``request``.
+        """
+        subdomain = self.subdomain
+        if subdomain is UNSET:
+            subdomain = getattr(request, 'subdomain', None)
+        scheme = self.scheme
+        if scheme is None:
+            scheme = 'https' if request.is_secure() else 'http'
+
+        key = (view_name, subdomain, scheme)
+        builder = self.builders.get(key)
+        if builder is None:
+            builder = self.builders[key] = URLBuilder(view_name,
+                subdomain=subdomain, scheme=scheme)
+        return builder
+
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL.
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+
+        kwargs = {self.lookup_url_kwarg: getattr(obj, self.lookup_field)}
+        if format is not None:
+            kwargs['format'] = format
+        return self.get_builder(view_name, request).build(kwargs=kwargs)
+
+    def get_input_urlconf(self, data):
+        """
+        Returns the urlconf of the subdomain of the URL ``data``, of the
+        field's ``subdomain`` if ``data`` is a path, or ``None`` to use the
+        urlconf of the request.
+        """
+        if data.startswith(('http:', 'https:')):
+            subdomain = get_host_matcher(get_domain()).match(
+                urlsplit(data).netloc)
+            if subdomain is NO_MATCH:
+                self.fail('no_match')
+        elif self.subdomain is not UNSET:
+            subdomain = self.subdomain
+        else:
+            return None
+        return get_urlconf_for_subdomain(subdomain)
+
+    def to_internal_value(self, data):
+        urlconf = None
+        if isinstance(data, string_types):
+            urlconf = self.get_input_urlconf(data)
+        if urlconf is None:
+            return super(SubdomainHyperlinkedRelatedField,
+                self).to_internal_value(data)
+
+        previous = get_urlconf()
+        set_urlconf(urlconf)
+        try:
+            return super(SubdomainHyperlinkedRelatedField,
+                self).to_internal_value(data)
+        finally:
+            set_urlconf(previous)
+
+
+class SubdomainHyperlinkedIdentityField(SubdomainHyperlinkedRelatedField):
+    """
+    The subdomain counterpart of
+    :class:`~rest_framework.relations.HyperlinkedIdentityField`, linking to
+    the object itself.
+    """
+    def __init__(self, view_name=None, **kwargs):
+        assert view_name is not None, 'The `view_name` argument is required.'
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super(SubdomainHyperlinkedIdentityField, self).__init__(view_name,
+            **kwargs)
+
+    def use_pk_only_optimization(self):
+        # The object itself is serialized, so the lookup field is always
+        # available.
+        return False
@@ -0,0 +1,304 @@
+"""
+Streaming sitemaps of URLs on any subdomain.
+
+A sitemap section is a :class:`Sitemap` whose items are reversed on its
+``subdomain``. Sections are listed by name, and served by the :func:`index`
+and :func:`sitemap` views::
+
+    from subdomains.sitemaps import Sitemap, index, sitemap, subdomain_sections
+
+    class ProductSitemap(Sitemap):
+        subdomain = 'shop'
+
+        def items(self):
+            return Product.objects.order_by('pk')
+
+        def route(self, product):
+            return 'product-detail', (), {'pk': product.pk}
+
+    sitemaps = dict(subdomain_sections(PageSitemap), products=ProductSitemap)
+
+    urlpatterns = [
+        url(r'^sitemap\\.xml$', index, {'sitemaps': sitemaps}),
+        url(r'^sitemap-(?P<section>.+)\\.xml$', sitemap,
+            {'sitemaps': sitemaps}, name='subdomains-sitemap'),
+    ]
+
+Each section is split into pages of at most 50,000 URLs, and pages are split
+further into parts of as many URLs as fit in 50 MB if each of them had the
+largest size of an entry (``Sitemap.max_entry_size``), which are all listed in
+the sitemap index. The index is built from the number of items of each
+section, without reversing any URL. The documents are streamed as they are
+generated, reversing the URLs in batches with
+:func:`~subdomains.utils.reverse_many`, so that memory use does not depend on
+the number of URLs.
+"""
+import logging
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+
+from subdomains.compat import force_text, reverse as simple_reverse
+from subdomains.utils import reverse_many
+
+
+logger = logging.getLogger(__name__)
+
+#: The maximum number of URLs in a sitemap allowed by the sitemap protocol.
+SITEMAP_LIMIT = 50000
+
+#: The maximum size of a sitemap allowed by the sitemap protocol, in bytes.
+SITEMAP_MAX_SIZE = 50 * 1024 * 1024
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+URLSET_HEADER = XML_HEADER + '<urlset xmlns="%s">\n' % XMLNS
+URLSET_FOOTER = '</urlset>\n'
+
+
+class Sitemap(object):
+    """
+    A section of a sitemap, listing the URLs of its :meth:`items` on its
+    ``subdomain``, similarly to :class:`django.contrib.sitemaps.Sitemap`.
+    ``lastmod``, ``changefreq`` and ``priority`` can be values or methods
+    taking an item.
+    """
+    subdomain = None
+    limit = SITEMAP_LIMIT
+    #: The size of the largest ``<url>`` element listed, in bytes, which
+    #: allows for a URL of the 2,048 characters allowed by the sitemap
+    #: protocol. Larger elements are left out.
+    max_entry_size = 2560
+    batch_size = 1000
+    protocol = None
+    lastmod = None
+    changefreq = None
+    priority = None
+
+    def __init__(self, subdomain=None):
+        if subdomain is not None:
+            self.subdomain = subdomain
+
+    def items(self):
+        """
+        Returns the items of the sitemap. Querysets are iterated without
+        being cached.
+        """
+        return []
+
+    def route(self, item):
+        """
+        Returns the ``(viewname, args, kwargs)`` reversed for ``item``. By
+        default, items are view names.
+        """
+        return item, None, None
+
+    def count(self):
+        items = self.items()
+        try:
+            return items.count()
+        except (AttributeError, TypeError):
+            return len(items)
+
+    @property
+    def num_pages(self):
+        return self.get_num_pages(self.count())
+
+    def get_num_pages(self, count):
+        return max(1, -(-count // self.limit))
+
+    @property
+    def part_size(self):
+        """
+        The number of URLs in each part of a page, which never makes a part
+        larger than ``SITEMAP_MAX_SIZE``.
+        """
+        space = SITEMAP_MAX_SIZE - len(URLSET_HEADER) - len(URLSET_FOOTER)
+        return max(1, space // self.max_entry_size)
+
+    def get_parts(self, page, count=None):
+        """
+        Returns the number of parts of ``page``, given the ``count`` of items
+        of the sitemap (which is counted if not given.)
+        """
+        if count is None:
+            count = self.count()
+        items = min(self.limit, count - (page - 1) * self.limit)
+        return max(1, -(-items // self.part_size))
+
+    def get_page_items(self, page, offset=0, size=None):
+        """
+        Returns an iterator of the items on ``page`` (starting at 1), from
+        the ``offset``-th item of the page, and of at most ``size`` items.
+        """
+        start = (page - 1) * self.limit
+        stop = start + self.limit
+        start += offset
+        if size is not None:
+            stop = min(stop, start + size)
+        items = self.items()
+        if hasattr(items, 'iterator'):
+            return items[start:stop].iterator()
+        return islice(items, start, stop)
+
+    def get_urls(self, page, scheme=None, offset=0, size=None):
+        """
+        Returns an iterator of ``(url, item)`` tuples for at most ``size``
+        items on ``page`` from ``offset``, reversing the URLs ``batch_size``
+        at a time.
+        """
+        items = self.get_page_items(page, offset, size)
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if not batch:
+                break
+            routes = []
+            for item in batch:
+                viewname, args, kwargs = self.route(item)
+                routes.append((viewname, self.subdomain, args, kwargs))
+            for url, item in zip(reverse_many(routes, scheme=scheme), batch):
+                yield url, item
+
+    def get_entries(self, page, scheme=None, part=1):
+        """
+        Returns an iterator of the ``<url>`` elements of ``part`` of ``page``
+        (see :meth:`get_parts`.)
+        """
+        size = self.part_size
+        for url, item in self.get_urls(page, scheme, (part - 1) * size, size):
+            entry = self.render_url(url, item)
+            if len(entry.encode('utf-8')) > self.max_entry_size:
+                logger.warning('The sitemap entry of %s is larger than %d '
+                    'bytes, leaving it out', url, self.max_entry_size)
+                continue
+            yield entry
+
+    def get_attribute(self, name, item):
+        value = getattr(self, name)
+        if callable(value):
+            return value(item)
+        return value
+
+    def render_url(self, url, item):
+        """
+        Returns the ``<url>`` element for ``item``.
+        """
+        parts = ['<url><loc>%s</loc>' % escape(url)]
+        lastmod = self.get_attribute('lastmod', item)
+        if lastmod is not None:
+            parts.append('<lastmod>%s</lastmod>' %
+                lastmod.strftime('%Y-%m-%d'))
+        changefreq = self.get_attribute('changefreq', item)
+        if changefreq is not None:
+            parts.append('<changefreq>%s</changefreq>' % escape(changefreq))
+        priority = self.get_attribute('priority', item)
+        if priority is not None:
+            parts.append('<priority>%s</priority>' % priority)
+        parts.append('</url>\n')
+        return ''.join(parts)
+
+
+def subdomain_sections(sitemap_class, subdomains=None):
+    """
+    Returns a dictionary of sections of ``sitemap_class`` for each of
+    ``subdomains`` (by default, the subdomains of
+    ``settings.SUBDOMAIN_URLCONFS``), named after the subdomain, or ``root``
+    for the domain itself.
+    """
+    if subdomains is None:
+        subdomains = settings.SUBDOMAIN_URLCONFS
+    return dict((subdomain or 'root', sitemap_class(subdomain))
+        for subdomain in subdomains)
+
+
+def get_sections(sitemaps, section=None):
+    if section is not None:
+        if section not in sitemaps:
+            raise Http404('No sitemap available for section: %r' % section)
+        sitemaps = {section: sitemaps[section]}
+    sections = []
+    for name in sorted(sitemaps):
+        site = sitemaps[name]
+        if isinstance(site, type):
+            site = site()
+        sections.append((name, site))
+    return sections
+
+
+def get_scheme(request, site):
+    if site.protocol is not None:
+        return site.protocol
+    return 'https' if request.is_secure() else 'http'
+
+
+def generate_index(request, sections, sitemap_url_name):
+    yield XML_HEADER + '<sitemapindex xmlns="%s">\n' % XMLNS
+    for name, site in sections:
+        location = request.build_absolute_uri(
+            simple_reverse(sitemap_url_name, kwargs={'section': name}))
+        if site.protocol is not None:
+            location = '%s:%s' % (site.protocol, location.split(':', 1)[1])
+        count = site.count()
+        for page in range(1, site.get_num_pages(count) + 1):
+            for part in range(1, site.get_parts(page, count) + 1):
+                if part > 1:
+                    url = '%s?p=%d&part=%d' % (location, page, part)
+                elif page > 1:
+                    url = '%s?p=%d' % (location, page)
+                else:
+                    url = location
+                yield '<sitemap><loc>%s</loc></sitemap>\n' % escape(url)
+    yield '</sitemapindex>\n'
+
+
+def generate_sitemap(request, site, page, part):
+    yield URLSET_HEADER
+    chunk = []
+    for entry in site.get_entries(page, get_scheme(request, site), part):
+        chunk.append(entry)
+        if len(chunk) >= site.batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+    yield URLSET_FOOTER
+
+
+def index(request, sitemaps, sitemap_url_name='subdomains-sitemap'):
+    """
+    Streams the sitemap index of ``sitemaps``, a dictionary of sections, with
+    one sitemap for each part of each page of each section. The URLs of the
+    sitemaps are reversed from ``sitemap_url_name`` with a ``section``
+    keyword argument.
+    """
+    sections = get_sections(sitemaps)
+    return StreamingHttpResponse(
+        generate_index(request, sections, sitemap_url_name),
+        content_type='application/xml')
+
+
+def sitemap(request, sitemaps, section=None):
+    """
+    Streams the part given by the ``part`` query parameter of the page given
+    by the ``p`` query parameter of the sitemap of ``section``, which is only
+    optional if there is a single section.
+    """
+    sections = get_sections(sitemaps, section)
+    if len(sections) != 1:
+        raise Http404('No sitemap section was given')
+    name, site = sections[0]
+    try:
+        page = int(request.GET.get('p', 1))
+        part = int(request.GET.get('part', 1))
+    except ValueError:
+        raise Http404('No page %r, part %r' % (
+            force_text(request.GET.get('p')),
+            force_text(request.GET.get('part'))))
+    count = site.count()
+    if page < 1 or page > site.get_num_pages(count) or part < 1 or \
+            part > site.get_parts(page, count):
+        raise Http404('No page %d, part %d' % (page, part))
+
+    return StreamingHttpResponse(generate_sitemap(request, site, page, part),
+        content_type='application/xml')
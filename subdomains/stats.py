@@ -0,0 +1,187 @@
+"""
+Instrumentation of subdomain identification, URL routing and URL reversing.
+
+A stats collector can be installed by setting
+``settings.SUBDOMAIN_STATS_COLLECTOR`` to the dotted path of a
+:class:`StatsCollector` subclass, e.g.::
+
+    SUBDOMAIN_STATS_COLLECTOR = 'subdomains.stats.MemoryStatsCollector'
+
+The collector is instantiated once, and can be retrieved with
+:func:`get_collector` to read its statistics. When no collector is configured
+(the default), nothing is measured at all.
+"""
+import threading
+from timeit import default_timer as timer  # noqa
+try:
+    from importlib import import_module
+except ImportError:  # Python 2.6
+    from django.utils.importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from subdomains.compat import setting_changed
+
+
+class StatsCollector(object):
+    """
+    The interface of stats collectors, ignoring all events. Durations are
+    passed in seconds.
+    """
+    def subdomain_identified(self, subdomain, duration):
+        """
+        Called by :class:`~subdomains.middleware.SubdomainMiddleware` when the
+        host of a request belongs to the domain.
+        """
+
+    def host_unmatched(self, host, domain, duration):
+        """
+        Called by :class:`~subdomains.middleware.SubdomainMiddleware` when the
+        host of a request does not belong to the domain.
+        """
+
+    def urlconf_selected(self, subdomain, urlconf, duration):
+        """
+        Called by :class:`~subdomains.middleware.SubdomainURLRoutingMiddleware`
+        after looking up the urlconf for a subdomain. ``urlconf`` is ``None``
+        if the default urlconf is used.
+        """
+
+    def url_reversed(self, viewname, subdomain, duration, cached):
+        """
+        Called by :func:`subdomains.utils.reverse`. ``cached`` is ``True`` or
+        ``False`` for reverse cache hits and misses, and ``None`` if the
+        reverse cache was not used.
+        """
+
+
+#: The key under which :class:`MemoryStatsCollector` counts the requests for
+#: subdomains beyond its ``max_subdomains``.
+OTHER = '(other)'
+
+
+class MemoryStatsCollector(StatsCollector):
+    """
+    Aggregates statistics in memory, which can be read with :meth:`snapshot`.
+
+    Requests are counted for at most ``max_subdomains`` distinct subdomains,
+    since subdomains are chosen by clients, and requests for any further
+    subdomains are counted together under :data:`OTHER`.
+    """
+    max_subdomains = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.subdomains = {}
+        self.urlconfs = {}
+        self.unmatched_hosts = 0
+        self.cache_hits = self.cache_misses = 0
+        self.timings = {}
+
+    def record(self, event, duration):
+        timing = self.timings.get(event)
+        if timing is None:
+            timing = self.timings[event] = {'count': 0, 'total': 0.0,
+                'max': 0.0}
+        timing['count'] += 1
+        timing['total'] += duration
+        if duration > timing['max']:
+            timing['max'] = duration
+
+    def subdomain_identified(self, subdomain, duration):
+        with self._lock:
+            if subdomain not in self.subdomains and \
+                    len(self.subdomains) >= self.max_subdomains:
+                subdomain = OTHER
+            self.subdomains[subdomain] = self.subdomains.get(subdomain, 0) + 1
+            self.record('identify', duration)
+
+    def host_unmatched(self, host, domain, duration):
+        with self._lock:
+            self.unmatched_hosts += 1
+            self.record('identify', duration)
+
+    def urlconf_selected(self, subdomain, urlconf, duration):
+        with self._lock:
+            self.urlconfs[urlconf] = self.urlconfs.get(urlconf, 0) + 1
+            self.record('route', duration)
+
+    def url_reversed(self, viewname, subdomain, duration, cached):
+        with self._lock:
+            if cached is True:
+                self.cache_hits += 1
+            elif cached is False:
+                self.cache_misses += 1
+            self.record('reverse', duration)
+
+    def snapshot(self, reset=False):
+        """
+        Returns a copy of the current statistics, optionally resetting them::
+
+            {
+                'subdomains': {None: 10, 'api': 20},
+                'unmatched_hosts': 1,
+                'urlconfs': {None: 10, 'myproject.urls.api': 20},
+                'reverse_cache': {'hits': 90, 'misses': 10, 'ratio': 0.9},
+                'timings': {
+                    'identify': {'count': 31, 'total': 0.0012, 'max': 0.0001},
+                    'route': {...},
+                    'reverse': {...},
+                },
+            }
+        """
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            ratio = float(self.cache_hits) / lookups if lookups else None
+            snapshot = {
+                'subdomains': dict(self.subdomains),
+                'unmatched_hosts': self.unmatched_hosts,
+                'urlconfs': dict(self.urlconfs),
+                'reverse_cache': {
+                    'hits': self.cache_hits,
+                    'misses': self.cache_misses,
+                    'ratio': ratio,
+                },
+                'timings': dict((event, dict(timing))
+                    for event, timing in self.timings.items()),
+            }
+            if reset:
+                self.reset()
+        return snapshot
+
+
+_collector = None
+_configured = False
+
+
+def get_collector():
+    """
+    Returns the stats collector configured by
+    ``settings.SUBDOMAIN_STATS_COLLECTOR``, or ``None``.
+    """
+    global _collector, _configured
+    if not _configured:
+        path = getattr(settings, 'SUBDOMAIN_STATS_COLLECTOR', None)
+        if path is not None:
+            module, _, name = path.rpartition('.')
+            try:
+                cls = getattr(import_module(module), name)
+            except (ImportError, AttributeError, ValueError) as error:
+                raise ImproperlyConfigured('Unable to import the stats '
+                    'collector %r: %s' % (path, error))
+            _collector = cls()
+        _configured = True
+    return _collector
+
+
+def clear_collector(setting=None, **kwargs):
+    global _collector, _configured
+    if setting in (None, 'SUBDOMAIN_STATS_COLLECTOR'):
+        _collector, _configured = None, False
+
+
+setting_changed.connect(clear_collector)
@@ -1,6 +1,13 @@
-from django.template import Library
+from django.template import Library, Node, TemplateSyntaxError, Variable
 
-from subdomains.utils import reverse
+try:
+    from django.template.base import token_kwargs
+except ImportError:  # Django < 1.5
+    from django.template.defaulttags import token_kwargs
+from django.utils.html import conditional_escape
+
+from subdomains.utils import (get_arguments_key, get_request_origin, reverse,
+    shorten_url)
 
 
 register = Library()
@@ -8,36 +15,197 @@ register = Library()
 UNSET = object()
 
 
-@register.simple_tag(takes_context=True)
-def url(context, view, subdomain=UNSET, *args, **kwargs):
+class Constant(object):
+    """
+    A template tag argument whose value was settled when the template was
+    compiled.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def resolve(self, context):
+        return self.value
+
+
+def compile_argument(expression):
+    """
+    Returns ``expression`` as a :class:`Constant` if it is a literal without
+    filters, or the expression itself.
+    """
+    var = expression.var
+    if expression.filters:
+        return expression
+    if isinstance(var, Variable):
+        if var.literal is None or getattr(var, 'translate', False):
+            return expression
+        var = var.literal
+    return Constant(var)
+
+
+class URLNode(Node):
+    def __init__(self, view, subdomain, args, kwargs, asvar=None,
+            shortest=False):
+        self.view = view
+        self.subdomain = subdomain
+        self.args = args
+        self.kwargs = kwargs
+        self.asvar = asvar
+        self.shortest = shortest
+
+    def get_subdomain(self, context):
+        if self.subdomain is UNSET:
+            request = context.get('request')
+            if request is not None:
+                return getattr(request, 'subdomain', None)
+            return None
+
+        subdomain = self.subdomain.resolve(context)
+        if subdomain == '':
+            return None
+        return subdomain
+
+    def get_origin(self, context):
+        """
+        Returns the origin of the request in the context, or ``None``.
+        """
+        origin = context.render_context.get(get_request_origin)
+        if origin is None:
+            request = context.get('request')
+            if request is None:
+                return None
+            origin = context.render_context[get_request_origin] = \
+                get_request_origin(request)
+        return origin
+
+    def reverse(self, context, view, subdomain, args, kwargs):
+        origin = self.get_origin(context) if self.shortest else None
+        if origin is None:
+            return reverse(view, subdomain=subdomain, args=args, kwargs=kwargs)
+        url = reverse(view, subdomain=subdomain, scheme=origin[0], args=args,
+            kwargs=kwargs)
+        return shorten_url(url, origin)
+
+    def render(self, context):
+        view = self.view.resolve(context)
+        subdomain = self.get_subdomain(context)
+        args = tuple(arg.resolve(context) for arg in self.args)
+        kwargs = dict((key, value.resolve(context))
+            for key, value in self.kwargs.items())
+
+        # Links are often repeated within a template, e.g. in loops, so the
+        # URLs are cached for the duration of the current render.
+        cache = context.render_context.get(URLNode)
+        if cache is None:
+            cache = context.render_context[URLNode] = {}
+        try:
+            key = (view, subdomain, get_arguments_key(args, kwargs),
+                self.shortest)
+            url = cache.get(key)
+        except TypeError:  # Unhashable arguments.
+            key = url = None
+
+        if url is None:
+            url = self.reverse(context, view, subdomain, args, kwargs)
+            if key is not None:
+                cache[key] = url
+
+        if self.asvar is not None:
+            context[self.asvar] = url
+            return ''
+        if getattr(context, 'autoescape', True):
+            url = conditional_escape(url)
+        return url
+
+
+def compile_url(parser, token, shortest=False):
+    """
+    Compiles the arguments of the ``url`` and ``shorturl`` tags into a
+    :class:`URLNode`.
+    """
+    bits = token.split_contents()
+    name, bits = bits[0], bits[1:]
+    if not bits:
+        raise TemplateSyntaxError("'%s' takes at least one argument, the "
+            "name of a url()." % name)
+
+    asvar = None
+    if len(bits) >= 2 and bits[-2] == 'as':
+        asvar, bits = bits[-1], bits[:-2]
+
+    view = compile_argument(parser.compile_filter(bits[0]))
+    subdomain, args, kwargs, keywords = UNSET, [], {}, False
+    for bit in bits[1:]:
+        kwarg = token_kwargs([bit], parser)
+        if kwarg:
+            key, value = list(kwarg.items())[0]
+            if key in kwargs or \
+                    (key == 'subdomain' and subdomain is not UNSET):
+                raise TemplateSyntaxError("'%s' received multiple values "
+                    "for keyword argument '%s'" % (name, key))
+            keywords = True
+            if key == 'subdomain':
+                subdomain = compile_argument(value)
+            else:
+                kwargs[key] = compile_argument(value)
+        elif keywords:
+            raise TemplateSyntaxError("'%s' received some positional "
+                "argument(s) after some keyword argument(s)" % name)
+        else:
+            value = compile_argument(parser.compile_filter(bit))
+            if subdomain is UNSET:
+                subdomain = value
+            else:
+                args.append(value)
+
+    return URLNode(view, subdomain, args, kwargs, asvar, shortest)
+
+
+@register.tag
+def url(parser, token):
     """
     Resolves a URL in a template, using subdomain-based URL resolution.
 
     If no subdomain is provided and a ``request`` is in the template context
     when rendering, the URL will be resolved relative to the current request's
     subdomain. If no ``request`` is provided, the URL will be resolved relative
-    to current domain with the ``settings.ROOT_URLCONF``.
+    to current domain with the ``settings.ROOT_URLCONF``. An empty subdomain
+    resolves the URL relative to the current domain.
 
     Usage::
 
         {% load subdomainurls %}
         {% url 'view-name' subdomain='subdomain' %}
+        {% url 'view-name' subdomain='subdomain' as the_url %}
+
+    Literal arguments are resolved when the template is compiled, and URLs are
+    cached for the duration of a render, so repeated links (e.g. in loops) are
+    only reversed once.
 
     .. note:: This tag uses the variable URL syntax introduced in Django
-       1.3 as ``{% load url from future %}`` and was made the standard in Django
-       1.5. If you are upgrading a legacy application from one of the previous
-       template tag formats, make sure to quote your constant string URL names
-       to avoid :exc:`~django.core.urlresolver.NoReverseMatch` errors during
-       template rendering.
+       1.3 as ``{% load url from future %}`` and was made the standard in
+       Django 1.5. If you are upgrading a legacy application from one of the
+       previous template tag formats, make sure to quote your constant string
+       URL names to avoid :exc:`~django.core.urlresolver.NoReverseMatch`
+       errors during template rendering.
 
     """
-    if subdomain is UNSET:
-        request = context.get('request')
-        if request is not None:
-            subdomain = getattr(request, 'subdomain', None)
-        else:
-            subdomain = None
-    elif subdomain is '':
-        subdomain = None
+    return compile_url(parser, token)
+
 
-    return reverse(view, subdomain=subdomain, args=args, kwargs=kwargs)
+@register.tag
+def shorturl(parser, token):
+    """
+    Resolves a URL like :func:`url`, but returns the shortest URL that refers
+    to it from the current page (see :func:`subdomains.utils.shorten_url`):
+    only the path for URLs on the same host and scheme as the ``request`` in
+    the template context, a scheme-relative URL for other hosts on the same
+    scheme, and the full URL otherwise. The URL is reversed with the scheme of
+    the request.
+
+    Usage::
+
+        {% load subdomainurls %}
+        {% shorturl 'view-name' subdomain='subdomain' %}
+
+    """
+    return compile_url(parser, token, shortest=True)
@@ -5,6 +5,7 @@ if not settings.configured:
         INSTALLED_APPS=(
             'django.contrib.sites',
             'subdomains',
+            'subdomains.registry',
         ),
         DATABASES={
             'default': {
@@ -13,10 +14,19 @@ if not settings.configured:
             },
         },
         SITE_ID=1,
+        SECRET_KEY='subdomains',
+        ALLOWED_HOSTS=('*',),
         MIDDLEWARE_CLASSES=(
             'django.middleware.common.CommonMiddleware',
             'subdomains.middleware.SubdomainURLRoutingMiddleware',
         ),
+        MIDDLEWARE=(
+            'django.middleware.common.CommonMiddleware',
+            'subdomains.middleware.SubdomainURLRoutingMiddleware',
+        ),
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        }],
     )
 
 
@@ -0,0 +1,356 @@
+"""
+Benchmarks for subdomain identification, routing, reversing and the
+``subdomainurls`` template tag.
+
+Run with ``make benchmark``, or directly with::
+
+    python -m subdomains.tests.benchmarks [--output results.json]
+
+The results of a previous run can be compared with the current run by passing
+the file to ``--compare``. Settings can be changed for a run with ``--set``,
+e.g. ``--set SUBDOMAIN_HOST_MATCHER="'regex'"``.
+
+With ``--processes``, the benchmarks are run in that many forked processes at
+the same time, and the best, median and worst timings of the processes are
+reported. Each process runs every benchmark once before it is measured, or,
+with ``--cold``, starts with empty caches, and the slowest first call of each
+benchmark is reported as well.
+"""
+from __future__ import print_function
+
+import argparse
+import ast
+import contextlib
+import functools
+import json
+import logging
+import platform
+import sys
+import timeit
+
+import django
+from django.conf import settings
+
+import subdomains.tests  # noqa: configures the settings
+
+
+URL_MODULE_PATH = 'subdomains.tests.urls'
+DOMAIN = 'example.com'
+
+#: The number of generated subdomains that are routed to the synthetic urlconf.
+SUBDOMAINS = 500
+
+BENCHMARK_SETTINGS = {
+    'DEFAULT_URL_SCHEME': 'http',
+    'ROOT_URLCONF': '%s.application' % URL_MODULE_PATH,
+    'SUBDOMAIN_URLCONFS': dict([
+        (None, '%s.marketing' % URL_MODULE_PATH),
+        ('www', '%s.marketing' % URL_MODULE_PATH),
+        ('api', '%s.api' % URL_MODULE_PATH),
+        ('synthetic', '%s.synthetic' % URL_MODULE_PATH),
+    ] + [
+        ('tenant-%d' % i, '%s.synthetic' % URL_MODULE_PATH)
+        for i in range(SUBDOMAINS)
+    ]),
+}
+
+benchmarks = []
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function is called once to set up the
+    benchmark, and returns the callable that is timed, or a context manager
+    that provides it and is exited once the benchmark has run.
+    """
+    def decorator(func):
+        benchmarks.append((name, func))
+        return func
+    return decorator
+
+
+def make_request(host, path='/'):
+    from django.test.client import RequestFactory
+    return RequestFactory().get(path, HTTP_HOST=host)
+
+
+def middleware_benchmark(host):
+    from subdomains.middleware import SubdomainMiddleware
+    middleware, request = SubdomainMiddleware(), make_request(host)
+    return lambda: middleware.process_request(request)
+
+
+@benchmark('middleware.match')
+def middleware_match():
+    return middleware_benchmark('api.%s' % DOMAIN)
+
+
+@benchmark('middleware.match-root')
+def middleware_match_root():
+    return middleware_benchmark(DOMAIN)
+
+
+@benchmark('middleware.match-port')
+def middleware_match_port():
+    return middleware_benchmark('api.%s:8000' % DOMAIN)
+
+
+@benchmark('middleware.no-match')
+@contextlib.contextmanager
+def middleware_no_match():
+    logger = logging.getLogger('subdomains.middleware')
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        yield middleware_benchmark('api.example.org')
+    finally:
+        logger.setLevel(level)
+
+
+def client_benchmark(host, path):
+    from django.test.client import Client
+    client = Client()
+    return lambda: client.get(path, HTTP_HOST=host)
+
+
+@benchmark('routing.client-root')
+def routing_client_root():
+    return client_benchmark(DOMAIN, '/')
+
+
+@benchmark('routing.client-api')
+def routing_client_api():
+    return client_benchmark('api.%s' % DOMAIN, '/view/')
+
+
+@benchmark('routing.client-synthetic')
+def routing_client_synthetic():
+    return client_benchmark('tenant-%d.%s' % (SUBDOMAINS - 1, DOMAIN),
+        '/objects-249/1/slug/')
+
+
+@benchmark('reverse.root')
+def reverse_root():
+    from subdomains.utils import reverse
+    return lambda: reverse('home')
+
+
+@benchmark('reverse.subdomain')
+def reverse_subdomain():
+    from subdomains.utils import reverse
+    return lambda: reverse('view', subdomain='api')
+
+
+@benchmark('reverse.wildcard')
+def reverse_wildcard():
+    from subdomains.utils import reverse
+    return lambda: reverse('application', subdomain='wildcard')
+
+
+@benchmark('reverse.synthetic-kwargs')
+def reverse_synthetic_kwargs():
+    from subdomains.utils import reverse
+    kwargs = {'pk': 1, 'slug': 'slug'}
+    return lambda: reverse('object-249', subdomain='tenant-0', kwargs=kwargs)
+
+
+def template_benchmark(count, loop=False):
+    from django.template import Context, Template
+    if loop:
+        source = ("{% for i in items %}"
+            "{% url 'object-249' subdomain='synthetic' pk=i slug='slug' %}\n"
+            "{% endfor %}")
+    else:
+        source = "{% url 'view' subdomain='api' %}\n" * count
+    template = Template('{% load subdomainurls %}' + source)
+    context = Context({'items': list(range(count))})
+    return lambda: template.render(context)
+
+
+@benchmark('template.url-10')
+def template_url_10():
+    return template_benchmark(10)
+
+
+@benchmark('template.url-200')
+def template_url_200():
+    return template_benchmark(200)
+
+
+@benchmark('template.url-loop-200')
+def template_url_loop_200():
+    return template_benchmark(200, loop=True)
+
+
+def measure(func, number, repeat):
+    """
+    Returns the time taken by each call of ``func`` in each of ``repeat`` runs
+    of ``number`` calls, and the time taken by the first call, in seconds.
+    """
+    timer = timeit.default_timer
+    start = timer()
+    func()  # Warm up any lazily populated state.
+    first = timer() - start
+    timings = []
+    for _ in range(repeat):
+        start = timer()
+        for _ in range(number):
+            func()
+        timings.append((timer() - start) / number)
+    return timings, first
+
+
+def run(names=None, number=1000, repeat=5, verbose=True):
+    """
+    Runs the benchmarks (or those whose name starts with one of ``names``),
+    returning a list of result dictionaries.
+    """
+    from django.contrib.sites.models import Site
+    site = Site.objects.get_current()
+    site.domain = DOMAIN
+    site.save()
+
+    results = []
+    for name, setup in benchmarks:
+        if names and not any(name.startswith(n) for n in names):
+            continue
+        timed = setup()
+        if hasattr(timed, '__enter__'):
+            with timed as func:
+                timings, first = measure(func, number, repeat)
+        else:
+            timings, first = measure(timed, number, repeat)
+        timings.sort()
+        result = {
+            'name': name,
+            'number': number,
+            'repeat': repeat,
+            'best': timings[0],
+            'median': timings[len(timings) // 2],
+            'first': first,
+            'timings': timings,
+        }
+        results.append(result)
+        if verbose:
+            print('%-28s %10.2fus %10.2fus' % (name, result['best'] * 1e6,
+                result['median'] * 1e6))
+    return results
+
+
+def run_in_processes(processes, names=None, number=1000, repeat=5,
+        cold=False, verbose=True):
+    """
+    Runs the benchmarks in ``processes`` forked processes at the same time,
+    returning a list of result dictionaries with the best and median of the
+    timings of all the processes, the worst median timing of a process and
+    the slowest first call.
+    """
+    from subdomains.replay import clear_caches, run_in_processes
+
+    if cold:
+        setup = clear_caches
+    else:
+        setup = functools.partial(run, names, 1, 1, verbose=False)
+    work = functools.partial(run, names, number, repeat, verbose=False)
+
+    results = []
+    for outcomes in zip(*run_in_processes(work, processes, setup=setup)):
+        timings = sorted(timing for outcome in outcomes
+            for timing in outcome['timings'])
+        result = dict(outcomes[0],
+            processes=processes,
+            best=timings[0],
+            median=timings[len(timings) // 2],
+            worst=max(outcome['median'] for outcome in outcomes),
+            timings=timings,
+            first=max(outcome['first'] for outcome in outcomes))
+        results.append(result)
+        if verbose:
+            print('%-28s %10.2fus %10.2fus %10.2fus %10.2fus' % (
+                result['name'], result['best'] * 1e6, result['median'] * 1e6,
+                result['worst'] * 1e6, result['first'] * 1e6))
+    return results
+
+
+def compare(results, previous):
+    """
+    Prints the relative change of the best timing of each benchmark from a
+    previous run.
+    """
+    before = dict((result['name'], result) for result in previous['results'])
+    for result in results:
+        if result['name'] in before:
+            ratio = result['best'] / before[result['name']]['best']
+            print('%-28s %10.2fus -> %10.2fus (%+.1f%%)' % (result['name'],
+                before[result['name']]['best'] * 1e6, result['best'] * 1e6,
+                (ratio - 1) * 100))
+
+
+def parse_setting(value):
+    name, _, literal = value.partition('=')
+    return name, ast.literal_eval(literal)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('names', nargs='*',
+        help='only run the benchmarks whose names start with these prefixes')
+    parser.add_argument('-n', '--number', type=int, default=1000,
+        help='the number of calls in each run (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help='the number of runs of each benchmark (default: %(default)s)')
+    parser.add_argument('-o', '--output',
+        help='write the results as JSON to this file')
+    parser.add_argument('-c', '--compare',
+        help='compare the results with a JSON file from a previous run')
+    parser.add_argument('-s', '--set', action='append', default=[],
+        type=parse_setting, metavar='NAME=VALUE',
+        help='override a setting with a Python literal for this run')
+    parser.add_argument('-j', '--processes', type=int,
+        help='run the benchmarks in this many processes at the same time')
+    parser.add_argument('--cold', action='store_true',
+        help='start the processes with empty caches')
+    options = parser.parse_args(argv)
+
+    from django.test.utils import get_runner, override_settings
+
+    if django.VERSION >= (1, 7):
+        django.setup()
+
+    runner = get_runner(settings)(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        overrides = dict(BENCHMARK_SETTINGS, **dict(options.set))
+        with override_settings(**overrides):
+            if options.processes:
+                results = run_in_processes(options.processes, options.names,
+                    options.number, options.repeat, cold=options.cold)
+            else:
+                results = run(options.names, options.number, options.repeat)
+    finally:
+        runner.teardown_databases(old_config)
+
+    document = {
+        'version': '.'.join(map(str, subdomains.__version__)),
+        'django': django.get_version(),
+        'python': platform.python_version(),
+        'settings': dict(options.set),
+        'processes': options.processes,
+        'cold': options.cold,
+        'results': results,
+    }
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as previous:
+            compare(results, json.load(previous))
+
+    return document
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
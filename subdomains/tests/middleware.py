@@ -0,0 +1,26 @@
+from django.http import HttpResponse
+
+
+class HeaderMiddleware(object):
+    """
+    Adds an ``X-Middleware`` header to responses, and rejects requests with a
+    ``reject`` query parameter before the view is called.
+    """
+    header = 'header'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        response['X-Middleware'] = ','.join(filter(None,
+            (response.get('X-Middleware'), self.header)))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if 'reject' in request.GET:
+            return HttpResponse(status=403)
+
+
+class OtherHeaderMiddleware(HeaderMiddleware):
+    header = 'other'
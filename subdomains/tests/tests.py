@@ -1,20 +1,61 @@
 import functools
 import mock
+import re
+import sys
+import tempfile
+import time
+import unittest
 import warnings
 try:
     import urlparse
 except ImportError:  # Python 3
     from urllib import parse as urlparse
 
-from django.core.urlresolvers import NoReverseMatch, set_urlconf
-from django.template import Context, Template
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+try:
+    import jinja2
+except ImportError:
+    jinja2 = None
+
+try:
+    import rest_framework
+except ImportError:
+    rest_framework = None
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponse
+from django.template import Context, Template, TemplateSyntaxError
 from django.test import TestCase
-from django.test.client import RequestFactory
+from django.test.client import Client, RequestFactory
 from django.test.utils import override_settings
 
-from subdomains.middleware import (SubdomainMiddleware,
-    SubdomainURLRoutingMiddleware)
-from subdomains.utils import reverse, urljoin
+from subdomains.compat import (NoReverseMatch, clear_url_caches, force_text,
+    get_resolver, get_resolver_count, get_urlconf, set_urlconf)
+from subdomains.hosts import (NO_MATCH, HostMatcher, RegexHostMatcher,
+    SuffixHostMatcher, _idna_names, get_host_matcher, normalize_host,
+    split_host)
+from subdomains.middleware import (SubdomainCacheMiddleware,
+    SubdomainDispatchMiddleware, SubdomainFetchFromCacheMiddleware,
+    SubdomainMiddleware, SubdomainRedirectMiddleware,
+    SubdomainUpdateCacheMiddleware, SubdomainURLRoutingMiddleware,
+    UnknownHostLog)
+from subdomains.registry import (HostEntry, HostIndex, HostRegistry,
+    host_registry)
+from subdomains.replay import (read_entries, replay, replay_in_processes,
+    run_in_processes)
+from subdomains.routing import SubdomainRouter
+from subdomains.sitemaps import URLSET_FOOTER, URLSET_HEADER, index, sitemap
+from subdomains.stats import OTHER, get_collector
+from subdomains.utils import (ResolverCache, domain_cache, shorten_url,
+    shortest_reverse, get_domain, resolver_cache, reverse,
+    reverse_cache, reverse_many, urljoin, warm_urlconfs)
 
 
 def prefix_values(dictionary, prefix):
@@ -44,6 +85,10 @@ class SubdomainTestMixin(object):
         MIDDLEWARE_CLASSES=(
             'django.middleware.common.CommonMiddleware',
             'subdomains.middleware.SubdomainURLRoutingMiddleware',
+        ),
+        MIDDLEWARE=(
+            'django.middleware.common.CommonMiddleware',
+            'subdomains.middleware.SubdomainURLRoutingMiddleware',
         ))
     def run(self, *args, **kwargs):
         super(SubdomainTestMixin, self).run(*args, **kwargs)
@@ -133,6 +178,613 @@ class SubdomainMiddlewareTestCase(SubdomainTestMixin, TestCase):
         self.middleware.process_request(request)
         self.assertEqual(request.subdomain, 'www')
 
+    def test_settings_read_once(self):
+        def subdomain():
+            host = self.get_host_for_subdomain('www')
+            request = RequestFactory().get('/', HTTP_HOST=host)
+            self.middleware.process_request(request)
+            return request.subdomain
+
+        with mock.patch('subdomains.middleware.get_host_matcher',
+                wraps=get_host_matcher) as mock_get_host_matcher:
+            for _ in range(3):
+                self.assertEqual(subdomain(), 'www')
+        self.assertEqual(mock_get_host_matcher.call_count, 1)
+
+        with override_settings(SUBDOMAIN_HOST_MATCHER='regex'):
+            self.assertEqual(subdomain(), 'www')
+            self.assertTrue(isinstance(
+                self.middleware.get_host_matcher(self.DOMAIN),
+                RegexHostMatcher))
+
+
+class RegexSubdomainMiddlewareTestCase(SubdomainMiddlewareTestCase):
+    @override_settings(SUBDOMAIN_HOST_MATCHER='regex')
+    def run(self, *args, **kwargs):
+        super(RegexSubdomainMiddlewareTestCase, self).run(*args, **kwargs)
+
+
+class LazySubdomainMiddlewareTestCase(SubdomainMiddlewareTestCase):
+    @override_settings(SUBDOMAIN_LAZY=True)
+    def run(self, *args, **kwargs):
+        super(LazySubdomainMiddlewareTestCase, self).run(*args, **kwargs)
+
+    def get_request(self, subdomain='www'):
+        host = self.get_host_for_subdomain(subdomain)
+        request = RequestFactory().get('/', HTTP_HOST=host)
+        request.get_host = mock.Mock(wraps=request.get_host)
+        return request
+
+    def test_lazy_subdomain(self):
+        request = self.get_request()
+        request_class = request.__class__
+        self.assertEqual(self.middleware.process_request(request), None)
+        self.assertFalse(request.get_host.called)
+        self.assertTrue(isinstance(request, request_class))
+
+        self.assertEqual(request.subdomain, 'www')
+        self.assertEqual(request.get_host.call_count, 1)
+        self.assertEqual(request.subdomain, 'www')
+        self.assertEqual(request.get_host.call_count, 1)
+
+    def test_unused_subdomain(self):
+        with mock.patch.object(SubdomainMiddleware,
+                'identify_subdomain') as identify_subdomain:
+            self.middleware.process_request(self.get_request())
+        self.assertFalse(identify_subdomain.called)
+
+    def test_eager_routing(self):
+        request = self.get_request()
+        SubdomainURLRoutingMiddleware().process_request(request)
+        self.assertEqual(request.get_host.call_count, 1)
+        self.assertEqual(request.__dict__['subdomain'], 'www')
+
+    def test_eager_unknown_host(self):
+        with override_settings(SUBDOMAIN_UNKNOWN_HOST='reject'):
+            request = self.get_request()
+            self.middleware.process_request(request)
+            self.assertEqual(request.get_host.call_count, 1)
+            self.assertEqual(request.__dict__['subdomain'], 'www')
+
+
+class HostMatcherTestCase(TestCase):
+    DOMAIN = 'example.com'
+
+    def test_matchers_agree(self):
+        hosts = (
+            'example.com',
+            'example.com:8000',
+            'EXAMPLE.com',
+            'www.example.com',
+            'www.example.com:443',
+            'Another.Subdomain.example.com',
+            '.example.com',
+            'example.com.example.com',
+            'example.org',
+            'badexample.com',
+            'example.com.evil.org',
+        )
+        regex = RegexHostMatcher(self.DOMAIN)
+        suffix = SuffixHostMatcher(self.DOMAIN)
+        for host in hosts:
+            self.assertEqual(regex.match(host), suffix.match(host), host)
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, HostMatcher, self.DOMAIN)
+
+    def test_match(self):
+        matcher = SuffixHostMatcher('Example.com')
+        self.assertEqual(matcher.match('example.com'), None)
+        self.assertEqual(matcher.match('api.example.com:8000'), 'api')
+        self.assertEqual(matcher.match('a.b.EXAMPLE.COM'), 'a.b')
+        self.assertTrue(matcher.match('example.org') is NO_MATCH)
+
+    def test_normalized_hosts(self):
+        self.assertEqual(split_host('Example.COM'), ('example.com', ''))
+        self.assertEqual(split_host('example.com.:8000'),
+            ('example.com', '8000'))
+        self.assertEqual(split_host(u'B\xfccher.example'),
+            ('xn--bcher-kva.example', ''))
+        self.assertEqual(split_host('XN--BCHER-KVA.example.'),
+            ('xn--bcher-kva.example', ''))
+        self.assertEqual(split_host('[::1]:8000'), ('[::1]', '8000'))
+        self.assertEqual(split_host('[::1]'), ('[::1]', ''))
+        self.assertEqual(normalize_host(u'b\xfccher.example.:80',
+            keep_port=True), 'xn--bcher-kva.example:80')
+
+        for cls in (RegexHostMatcher, SuffixHostMatcher):
+            matcher = cls(u'B\xfccher.example.')
+            for host in (u'shop.b\xfccher.example',
+                    'shop.xn--bcher-kva.example',
+                    'SHOP.XN--BCHER-KVA.EXAMPLE.:8000'):
+                self.assertEqual(matcher.match(host), 'shop', host)
+
+    def test_normalization_memo(self):
+        host = u'shop.b\xfccher.example'
+        _idna_names.clear()
+        with mock.patch('subdomains.hosts.force_text',
+                side_effect=force_text) as mock_force_text:
+            for _ in range(3):
+                normalize_host(host)
+                normalize_host(host + ':8000')
+        self.assertEqual(mock_force_text.call_count, 1)
+
+    def test_regex_cache_is_bounded(self):
+        matcher = RegexHostMatcher(self.DOMAIN, cache_size=2)
+        for subdomain in ('a', 'b', 'c', 'a'):
+            matcher.match('%s.%s' % (subdomain, self.DOMAIN))
+        self.assertEqual(len(matcher.cache), 2)
+        self.assertEqual(matcher.cache.stats()['evictions'], 2)
+        self.assertEqual(matcher.cache.items(),
+            [('c.example.com', 'c'), ('a.example.com', 'a')])
+
+        matcher.cache.get('c.example.com')
+        matcher.match('d.%s' % self.DOMAIN)
+        self.assertEqual([host for host, _ in matcher.cache.items()],
+            ['c.example.com', 'd.example.com'])
+
+    def test_get_host_matcher(self):
+        with override_settings(SUBDOMAIN_HOST_MATCHER='regex'):
+            matcher = get_host_matcher(self.DOMAIN)
+            self.assertTrue(isinstance(matcher, RegexHostMatcher))
+            self.assertTrue(get_host_matcher(self.DOMAIN) is matcher)
+
+        with override_settings(SUBDOMAIN_HOST_MATCHER='suffix'):
+            matcher = get_host_matcher(self.DOMAIN)
+            self.assertTrue(isinstance(matcher, SuffixHostMatcher))
+
+        with override_settings(SUBDOMAIN_HOST_MATCHER='invalid'):
+            self.assertRaises(ImproperlyConfigured,
+                lambda: get_host_matcher(self.DOMAIN))
+
+
+class UnknownHostTestCase(SubdomainTestMixin, TestCase):
+    def process_request(self, host, path='/', middleware=SubdomainMiddleware):
+        request = RequestFactory().get(path, HTTP_HOST=host)
+        with mock.patch('subdomains.middleware.logger'):
+            response = middleware().process_request(request)
+        self.assertEqual(request.subdomain, None)
+        return response
+
+    def test_pass(self):
+        self.assertEqual(self.process_request('example.org'), None)
+
+    def test_reject(self):
+        with override_settings(SUBDOMAIN_UNKNOWN_HOST='reject'):
+            self.assertEqual(self.process_request('example.org').status_code,
+                400)
+            response = self.process_request('example.org',
+                middleware=SubdomainURLRoutingMiddleware)
+            self.assertEqual(response.status_code, 400)
+
+            with override_settings(SUBDOMAIN_UNKNOWN_HOST_STATUS=404):
+                response = self.process_request('example.org')
+                self.assertEqual(response.status_code, 404)
+
+            self.assertEqual(self.process_request(self.DOMAIN), None)
+
+    def test_redirect(self):
+        with override_settings(SUBDOMAIN_UNKNOWN_HOST='redirect'):
+            response = self.process_request('example.org', '/view/?page=2')
+            self.assertEqual(response.status_code, 301)
+            self.assertEqual(response['Location'],
+                'http://%s/view/?page=2' % self.DOMAIN)
+
+    def test_invalid_policy(self):
+        with override_settings(SUBDOMAIN_UNKNOWN_HOST='ignore'):
+            self.assertRaises(ImproperlyConfigured, self.process_request,
+                'example.org')
+
+    @mock.patch('subdomains.middleware.logger')
+    def test_rate_limited_warnings(self, logger):
+        with mock.patch('subdomains.middleware.timer', return_value=0):
+            log = UnknownHostLog(interval=60, maxsize=2)
+
+        with mock.patch('threading.Timer'):
+            with mock.patch('subdomains.middleware.timer') as timer:
+                timer.return_value = 10
+                for host in ('a.org', 'a.org', 'b.org', 'a.org'):
+                    log.add(host, self.DOMAIN)
+                self.assertEqual(logger.warning.call_count, 2)
+                self.assertEqual(logger.warning.call_args[0][1:],
+                    ('b.org', self.DOMAIN))
+
+                timer.return_value = 70
+                log.add('b.org', self.DOMAIN)
+                self.assertEqual(logger.warning.call_count, 4)
+                summary = logger.warning.call_args_list[2][0]
+                self.assertEqual(summary[1:], (2, 1, 70, 'a.org (2)'))
+
+                log.add('b.org', self.DOMAIN)
+                self.assertEqual(logger.warning.call_count, 4)
+                self.assertEqual(len(log.hosts), 1)
+
+    @mock.patch('subdomains.middleware.logger')
+    def test_distinct_hosts_flood(self, logger):
+        with mock.patch('subdomains.middleware.timer', return_value=0):
+            log = UnknownHostLog(interval=60, limit=5)
+
+        with mock.patch('threading.Timer') as Timer:
+            with mock.patch('subdomains.middleware.timer', return_value=10):
+                for i in range(100):
+                    log.add('host%d.org' % i, self.DOMAIN)
+            self.assertEqual(logger.warning.call_count, 5)
+            self.assertEqual(Timer.call_count, 1)
+            delay, flush, args = Timer.call_args[0]
+            self.assertEqual(delay, 50)
+            self.assertTrue(Timer.return_value.daemon)
+
+            # The timer reports the interval when no further request comes.
+            with mock.patch('subdomains.middleware.timer', return_value=60):
+                flush(*args)
+            self.assertEqual(logger.warning.call_count, 6)
+            self.assertEqual(logger.warning.call_args[0][1:3], (95, 95))
+
+            flush(*args)
+            self.assertEqual(logger.warning.call_count, 6)
+
+    @mock.patch('subdomains.middleware.logger')
+    def test_flush_at_exit(self, logger):
+        from subdomains.middleware import _pending_logs, flush_unknown_hosts
+        log = UnknownHostLog(limit=1)
+        with mock.patch('threading.Timer') as Timer:
+            for host in ('a.org', 'b.org', 'b.org'):
+                log.add(host, self.DOMAIN)
+            self.assertTrue(_pending_logs[id(log)] is log)
+
+            flush_unknown_hosts()
+        self.assertEqual(logger.warning.call_args[0][1:3], (2, 1))
+        self.assertTrue(Timer.return_value.cancel.called)
+        self.assertTrue(Timer.return_value.join.called)
+        self.assertFalse(id(log) in _pending_logs)
+
+
+class SubdomainRedirectMiddlewareTestCase(SubdomainTestMixin, TestCase):
+    def process_request(self, host, path='/', **kwargs):
+        request = RequestFactory().get(path, HTTP_HOST=host, **kwargs)
+        return SubdomainRedirectMiddleware().process_request(request)
+
+    def assertRedirects(self, response, location):
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], location)
+
+    def test_www_redirect(self):
+        response = self.process_request('WWW.example.com', '/view/?page=2')
+        self.assertRedirects(response, 'http://example.com/view/?page=2')
+
+        response = self.process_request('www.example.com:8000',
+            **{'wsgi.url_scheme': 'https'})
+        self.assertRedirects(response, 'https://example.com:8000/')
+
+    def test_canonical_hosts(self):
+        for host in ('example.com', 'api.example.com', 'www.api.example.com',
+                'example.org'):
+            self.assertEqual(self.process_request(host), None)
+
+    def test_redirects(self):
+        redirects = {'old': 'new', 'older': 'old', None: 'www', 'www': None}
+        with override_settings(SUBDOMAIN_REDIRECTS=redirects):
+            self.assertRaises(ImproperlyConfigured, self.process_request,
+                'example.com')
+
+            del redirects['www']
+            with override_settings(SUBDOMAIN_REDIRECTS=redirects):
+                self.assertRedirects(self.process_request('example.com'),
+                    'http://www.example.com/')
+                self.assertRedirects(self.process_request('old.example.com'),
+                    'http://new.example.com/')
+                self.assertRedirects(self.process_request('older.example.com'),
+                    'http://new.example.com/')
+                self.assertEqual(self.process_request('www.example.com'),
+                    None)
+
+    def test_no_database_queries(self):
+        self.process_request('www.example.com')
+        with self.assertNumQueries(0):
+            self.process_request('www.example.com')
+
+
+class SubdomainCacheMiddlewareTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(SubdomainCacheMiddlewareTestCase, self).setUp()
+        cache.clear()
+
+    def make_middleware(self, cls):
+        if django.VERSION >= (1, 10):
+            return cls(lambda request: HttpResponse())
+        return cls()
+
+    def fetch(self, host, middleware=SubdomainFetchFromCacheMiddleware):
+        request = RequestFactory().get('/', HTTP_HOST=host)
+        response = self.make_middleware(middleware).process_request(request)
+        self.assertEqual(request.META['HTTP_HOST'], host)
+        return request, response
+
+    def store(self, host, content, middleware=SubdomainUpdateCacheMiddleware):
+        request, response = self.fetch(host)
+        self.assertEqual(response, None)
+        # As added by SubdomainURLRoutingMiddleware with FORCE_VARY_ON_HOST.
+        response = HttpResponse(content)
+        response['Vary'] = 'Host'
+        self.make_middleware(middleware).process_response(request, response)
+        self.assertEqual(request.META['HTTP_HOST'], host)
+
+    def test_partition_by_subdomain(self):
+        self.store('api.%s:8000' % self.DOMAIN, 'api')
+        self.store('www.%s' % self.DOMAIN, 'www')
+        self.store('example.org', 'example.org')
+
+        for host, content in (('API.%s' % self.DOMAIN, b'api'),
+                ('api.%s:8080' % self.DOMAIN, b'api'),
+                ('www.%s' % self.DOMAIN, b'www'),
+                ('example.org', b'example.org')):
+            response = self.fetch(host)[1]
+            self.assertEqual(response.content, content)
+            response = self.fetch(host, middleware=SubdomainCacheMiddleware)[1]
+            self.assertEqual(response.content, content)
+
+        for host in (self.DOMAIN, 'example.org:8000'):
+            self.assertEqual(self.fetch(host)[1], None)
+
+    def test_aliases(self):
+        with override_settings(SUBDOMAIN_CACHE_ALIASES={'www': None}):
+            self.store('www.%s' % self.DOMAIN, 'www',
+                middleware=SubdomainCacheMiddleware)
+            self.assertEqual(self.fetch(self.DOMAIN)[1].content, b'www')
+            self.assertEqual(self.fetch('api.%s' % self.DOMAIN)[1], None)
+
+
+@unittest.skipIf(django.VERSION < (1, 10), 'requires settings.MIDDLEWARE')
+class SubdomainDispatchMiddlewareTestCase(SubdomainTestMixin, TestCase):
+    MIDDLEWARE = (
+        'subdomains.middleware.SubdomainURLRoutingMiddleware',
+        'subdomains.middleware.SubdomainDispatchMiddleware',
+    )
+
+    def get(self, host, path='/'):
+        return Client().get(path, HTTP_HOST=host)
+
+    def test_dispatch(self):
+        chains = {
+            'api': ['subdomains.tests.middleware.HeaderMiddleware'],
+            'www': ['subdomains.tests.middleware.HeaderMiddleware',
+                'subdomains.tests.middleware.OtherHeaderMiddleware'],
+        }
+        with override_settings(MIDDLEWARE=self.MIDDLEWARE,
+                SUBDOMAIN_MIDDLEWARE=chains):
+            response = self.get('api.%s' % self.DOMAIN)
+            self.assertEqual(response['X-Middleware'], 'header')
+            response = self.get('www.%s' % self.DOMAIN)
+            self.assertEqual(response['X-Middleware'], 'other,header')
+            response = self.get(self.DOMAIN)
+            self.assertFalse(response.has_header('X-Middleware'))
+
+            response = self.get('api.%s' % self.DOMAIN, '/?reject')
+            self.assertEqual(response.status_code, 403)
+            response = self.get(self.DOMAIN, '/?reject')
+            self.assertEqual(response.status_code, 200)
+
+    def test_default_chain(self):
+        with override_settings(MIDDLEWARE=self.MIDDLEWARE,
+                SUBDOMAIN_MIDDLEWARE={'api': []},
+                SUBDOMAIN_DEFAULT_MIDDLEWARE=[
+                    'subdomains.tests.middleware.OtherHeaderMiddleware']):
+            response = self.get('wildcard.%s' % self.DOMAIN)
+            self.assertEqual(response['X-Middleware'], 'other')
+            response = self.get('api.%s' % self.DOMAIN)
+            self.assertFalse(response.has_header('X-Middleware'))
+
+    def test_old_style_middleware(self):
+        self.assertRaises(ImproperlyConfigured, SubdomainDispatchMiddleware)
+
+
+class HostRegistryTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(HostRegistryTestCase, self).setUp()
+        self.settings = override_settings(SUBDOMAIN_HOST_REGISTRY=True,
+            SUBDOMAIN_REGISTRY_CHECK_INTERVAL=0)
+        self.settings.enable()
+        host_registry.index = None
+
+        from subdomains.registry.models import Host
+        Host.objects.create(host='Shop.Example.org.', tenant='acme',
+            urlconf=self.get_path_to_urlconf('api'))
+        Host.objects.create(host='acme.%s' % self.DOMAIN, tenant='acme')
+
+    def tearDown(self):
+        host_registry.index = None
+        self.settings.disable()
+        super(HostRegistryTestCase, self).tearDown()
+
+    def process_request(self, host):
+        request = RequestFactory().get('/', HTTP_HOST=host)
+        SubdomainURLRoutingMiddleware().process_request(request)
+        return request
+
+    def test_get(self):
+        entry = host_registry.get('SHOP.example.org:8000')
+        self.assertEqual(entry, HostEntry('shop.example.org',
+            self.get_path_to_urlconf('api'), 'acme'))
+        self.assertEqual(host_registry.get('example.org'), None)
+
+    def test_is_current(self):
+        self.assertFalse(host_registry.is_current())
+        host_registry.get_index()
+        self.assertFalse(host_registry.is_current())
+
+        with override_settings(SUBDOMAIN_REGISTRY_CHECK_INTERVAL=5):
+            self.assertTrue(host_registry.is_current())
+            host_registry.invalidate()
+            self.assertFalse(host_registry.is_current())
+
+    def test_middleware(self):
+        self.process_request('shop.example.org')  # Loads the index and site.
+
+        with self.assertNumQueries(0):
+            request = self.process_request('shop.example.org')
+        self.assertEqual(request.subdomain, None)
+        self.assertEqual(request.tenant, 'acme')
+        self.assertEqual(request.urlconf, self.get_path_to_urlconf('api'))
+
+        request = self.process_request('acme.%s' % self.DOMAIN)
+        self.assertEqual(request.subdomain, 'acme')
+        self.assertEqual(request.tenant, 'acme')
+        self.assertFalse(hasattr(request, 'urlconf'))
+
+        request = self.process_request('www.%s' % self.DOMAIN)
+        self.assertEqual(request.host_entry, None)
+        self.assertEqual(request.tenant, None)
+        self.assertEqual(request.urlconf,
+            self.get_path_to_urlconf('marketing'))
+
+    def test_disabled(self):
+        with override_settings(SUBDOMAIN_HOST_REGISTRY=False):
+            with mock.patch('subdomains.middleware.logger'):
+                request = self.process_request('shop.example.org')
+        self.assertFalse(hasattr(request, 'tenant'))
+        self.assertEqual(host_registry.index, None)
+
+    def test_not_installed(self):
+        with mock.patch('subdomains.registry.is_installed',
+                return_value=False):
+            self.assertRaises(ImproperlyConfigured,
+                lambda: HostRegistry().get('shop.example.org'))
+
+    def test_invalidation(self):
+        index = host_registry.get_index()
+        self.assertEqual(len(index), 2)
+
+        path = 'subdomains.registry.HostRegistry.rebuild_in_background'
+        with mock.patch(path) as rebuild_in_background:
+            host_registry.get_index()
+            self.assertFalse(rebuild_in_background.called)
+
+            from subdomains.registry.models import Host
+            Host.objects.create(host='new.example.org')
+            self.assertTrue(host_registry.get_index() is index)
+            self.assertTrue(rebuild_in_background.called)
+
+        host_registry.rebuild()
+        self.assertEqual(len(host_registry.get_index()), 3)
+
+    def test_rebuild_in_background(self):
+        host_registry.get_index()
+        index = HostIndex([HostEntry('new.example.org', '', '')])
+        with mock.patch.object(host_registry, 'load', return_value=index):
+            host_registry.rebuild_in_background().join()
+        self.assertTrue(host_registry.get_index() is index)
+
+
+class NewStyleMiddlewareTestCase(SubdomainTestMixin, TestCase):
+    def get_response(self, request):
+        self.urlconf = getattr(request, 'urlconf', None)
+        return HttpResponse()
+
+    def test_sync_call(self):
+        middleware = SubdomainURLRoutingMiddleware(self.get_response)
+        self.assertFalse(middleware.is_async)
+
+        host = self.get_host_for_subdomain('api')
+        request = RequestFactory().get('/', HTTP_HOST=host)
+        response = middleware(request)
+
+        self.assertEqual(request.subdomain, 'api')
+        self.assertEqual(self.urlconf, self.get_path_to_urlconf('api'))
+        self.assertEqual(response['Vary'], 'Host')
+
+
+@unittest.skipIf(django.VERSION < (3, 1), 'requires asynchronous middleware')
+class AsyncMiddlewareTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(AsyncMiddlewareTestCase, self).setUp()
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import AsyncRequestFactory
+        self.async_to_sync = async_to_sync
+        self.sync_to_async = sync_to_async
+        self.factory = AsyncRequestFactory()
+
+    def request(self, path, subdomain=None):
+        request = self.factory.get(path)
+        request.META['HTTP_HOST'] = self.get_host_for_subdomain(subdomain)
+        return request
+
+    def test_coroutine_middleware(self):
+        from subdomains.coroutines import iscoroutinefunction
+
+        def get_response(request):
+            return HttpResponse(getattr(request, 'urlconf', ''))
+
+        middleware = SubdomainURLRoutingMiddleware(
+            self.sync_to_async(get_response))
+        self.assertTrue(middleware.is_async)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        request = self.request('/', 'api')
+        response = self.async_to_sync(middleware)(request)
+        self.assertEqual(request.subdomain, 'api')
+        self.assertEqual(response.content.decode(),
+            self.get_path_to_urlconf('api'))
+        self.assertEqual(response['Vary'], 'Host')
+
+    def test_process_request_leaves_event_loop(self):
+        import asyncio
+        from django.contrib.sites.models import Site
+        middleware = SubdomainMiddleware(
+            self.sync_to_async(lambda request: HttpResponse()))
+        loops = []
+
+        def get_domain():
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return self.DOMAIN
+
+        Site.objects.clear_cache()
+        with mock.patch('subdomains.middleware.get_domain', get_domain):
+            request = self.request('/', 'www')
+            self.async_to_sync(middleware)(request)
+        self.assertEqual(request.subdomain, 'www')
+        self.assertEqual(loops, [None])
+
+    def test_warm_request_stays_on_event_loop(self):
+        from django.contrib.sites.models import Site
+        middleware = SubdomainURLRoutingMiddleware(
+            self.sync_to_async(lambda request: HttpResponse()))
+        Site.objects.get_current()
+        self.assertTrue(middleware.is_cached())
+
+        with mock.patch('subdomains.coroutines.sync_to_async') as thread:
+            request = self.request('/', 'api')
+            self.async_to_sync(middleware)(request)
+            self.assertFalse(thread.called)
+        self.assertEqual(request.subdomain, 'api')
+        self.assertEqual(request.urlconf, self.get_path_to_urlconf('api'))
+
+        Site.objects.clear_cache()
+        self.assertFalse(middleware.is_cached())
+        with override_settings(SUBDOMAIN_CACHE_DOMAIN=True):
+            middleware.process_request(self.request('/', 'api'))
+            self.assertTrue(middleware.is_cached())
+            domain_cache.clear()
+            self.assertFalse(middleware.is_cached())
+
+    def test_async_handler(self):
+        from django.core.handlers.base import BaseHandler
+        handler = BaseHandler()
+        handler.load_middleware(is_async=True)
+        get_response = self.async_to_sync(handler.get_response_async)
+
+        for subdomain, path, status_code in (
+                (None, '/', 200),
+                (None, '/view/', 404),
+                ('api', '/view/', 200),
+                ('wildcard', '/application/', 200),
+                ('api', '/view', 301)):
+            response = get_response(self.request(path, subdomain))
+            self.assertEqual(response.status_code, status_code,
+                (subdomain, path))
+
 
 class SubdomainURLRoutingTestCase(SubdomainTestMixin, TestCase):
     def setUp(self):
@@ -181,6 +833,382 @@ class SubdomainURLRoutingTestCase(SubdomainTestMixin, TestCase):
             )
 
 
+class SiteDomainCacheTestCase(SubdomainTestMixin, TestCase):
+    @override_settings(SUBDOMAIN_CACHE_DOMAIN=True)
+    def run(self, *args, **kwargs):
+        super(SiteDomainCacheTestCase, self).run(*args, **kwargs)
+
+    def setUp(self):
+        super(SiteDomainCacheTestCase, self).setUp()
+        domain_cache.invalidate()
+
+    def test_cached_domain(self):
+        self.assertEqual(get_domain(), self.DOMAIN)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_domain(), self.DOMAIN)
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(get_domain(), self.DOMAIN)
+        self.site.domain = 'www.example.org'
+        self.site.save()
+        self.assertEqual(get_domain(), 'www.example.org')
+
+        with override_settings(REMOVE_WWW_FROM_DOMAIN=True):
+            self.assertEqual(get_domain(), 'example.org')
+
+    def test_normalized_domain(self):
+        self.site.domain = u'WWW.B\xfccher.example.:8000'
+        self.site.save()
+        self.assertEqual(get_domain(), 'www.xn--bcher-kva.example:8000')
+
+        with override_settings(REMOVE_WWW_FROM_DOMAIN=True):
+            self.assertEqual(get_domain(), 'xn--bcher-kva.example:8000')
+
+        request = RequestFactory().get('/',
+            HTTP_HOST='API.www.xn--bcher-kva.example.')
+        SubdomainMiddleware().process_request(request)
+        self.assertEqual(request.subdomain, 'api')
+
+    def test_shared_version(self):
+        with override_settings(SUBDOMAIN_DOMAIN_CACHE_TIMEOUT=0,
+                SUBDOMAIN_DOMAIN_CACHE_ALIAS='default'):
+            self.assertEqual(get_domain(), self.DOMAIN)
+
+            # The version has not changed, so the domain is not reloaded.
+            with self.assertNumQueries(0):
+                self.assertEqual(get_domain(), self.DOMAIN)
+
+            # Simulate another process changing the shared version.
+            domain_cache.get_shared_cache().set(domain_cache.version_key, 'x')
+            from django.contrib.sites.models import Site
+            Site.objects.clear_cache()
+            self.assertNumQueries(1, get_domain)
+
+    def test_shared_version_without_timeout(self):
+        from django.contrib.sites.models import Site
+        with override_settings(SUBDOMAIN_DOMAIN_CACHE_ALIAS='default'):
+            domain_cache.invalidate()
+            self.assertEqual(get_domain(), self.DOMAIN)
+            with self.assertNumQueries(0):
+                self.assertEqual(get_domain(), self.DOMAIN)
+
+            # Another process changes the site, and the version with it.
+            Site.objects.filter(pk=self.site.pk).update(domain='example.org')
+            domain_cache.get_shared_cache().set(domain_cache.version_key, 'x')
+            Site.objects.clear_cache()
+            with mock.patch('subdomains.utils.time.time',
+                    return_value=time.time() + 5):
+                self.assertEqual(get_domain(), 'example.org')
+
+    def test_check_interval(self):
+        with override_settings(SUBDOMAIN_DOMAIN_CACHE_ALIAS='default'):
+            domain_cache.invalidate()
+            self.assertEqual(get_domain(), self.DOMAIN)
+            cache = domain_cache.get_shared_cache()
+            with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+                for _ in range(200):
+                    self.assertEqual(get_domain(), self.DOMAIN)
+                self.assertFalse(get.called)
+
+                with mock.patch('subdomains.utils.time.time',
+                        return_value=time.time() + 5):
+                    self.assertEqual(get_domain(), self.DOMAIN)
+                    self.assertEqual(get.call_count, 1)
+
+
+class WarmURLConfsTestCase(SubdomainTestMixin, TestCase):
+    def test_warm_urlconfs(self):
+        timings = warm_urlconfs()
+        self.assertEqual(sorted(timings), [
+            self.get_path_to_urlconf('api'),
+            self.get_path_to_urlconf('application'),
+            self.get_path_to_urlconf('marketing'),
+        ])
+
+    def test_broken_urlconf(self):
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            broken=self.get_path_to_urlconf('__missing__'))
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs):
+            self.assertRaises(ImproperlyConfigured, warm_urlconfs)
+
+    def test_fast_reverse(self):
+        from subdomains import fastreverse
+
+        with mock.patch.object(fastreverse, 'compile_resolver',
+                wraps=fastreverse.compile_resolver) as compile_resolver:
+            warm_urlconfs()
+            self.assertFalse(compile_resolver.called)
+
+            with override_settings(SUBDOMAIN_FAST_REVERSE=True):
+                warm_urlconfs()
+                self.assertEqual(compile_resolver.call_count, 3)
+
+                # The first reversed URL uses the routes compiled at startup.
+                fastreverse.clear_engines()
+                reverse('home', subdomain='www')
+                self.assertEqual(compile_resolver.call_count, 3)
+
+    @unittest.skipIf(django.VERSION < (1, 7), 'requires application configs')
+    def test_app_config(self):
+        from django.apps import apps
+        config = apps.get_app_config('subdomains')
+
+        with mock.patch('subdomains.utils.warm_urlconfs') as warm:
+            config.ready()
+            self.assertFalse(warm.called)
+
+            with override_settings(SUBDOMAIN_WARM_URLCONFS=True):
+                config.ready()
+            self.assertTrue(warm.called)
+
+
+class SubdomainRouterTestCase(TestCase):
+    def test_match(self):
+        router = SubdomainRouter({
+            '*.api': 'api',
+            'v1.api': 'api-v1',
+            '{tenant}': 'tenant',
+            'www.{tenant}': 'tenant-www',
+            '{tenant}.{region}.app': 'app',
+            'static.{region}.app': 'static',
+        })
+        self.assertEqual(router.match(None), None)
+        self.assertEqual(router.match('api'), ('tenant', {'tenant': 'api'}))
+        self.assertEqual(router.match('v2.api'), ('api', {}))
+        self.assertEqual(router.match('v1.api'), ('api-v1', {}))
+        self.assertEqual(router.match('acme'), ('tenant', {'tenant': 'acme'}))
+        self.assertEqual(router.match('www.acme'),
+            ('tenant-www', {'tenant': 'acme'}))
+        self.assertEqual(router.match('acme.eu.app'),
+            ('app', {'tenant': 'acme', 'region': 'eu'}))
+        self.assertEqual(router.match('static.eu.app'),
+            ('static', {'region': 'eu'}))
+        self.assertEqual(router.match('a.b.c.d'), None)
+        self.assertEqual(router.urlconfs(), set(['api', 'api-v1', 'tenant',
+            'tenant-www', 'app', 'static']))
+
+    def test_backtracking(self):
+        router = SubdomainRouter({
+            'x.{tenant}': 'literal',
+            '{name}.{tenant}.y': 'parameter',
+        })
+        self.assertEqual(router.match('a.b.y'),
+            ('parameter', {'name': 'a', 'tenant': 'b'}))
+        self.assertEqual(router.match('x.b'), ('literal', {'tenant': 'b'}))
+
+    def test_sibling_parameters(self):
+        router = SubdomainRouter({
+            '{tenant}': 'tenant',
+            '{name}.api': 'api',
+            '{version}.{name}.api': 'versioned',
+        })
+        self.assertEqual(router.match('acme'), ('tenant', {'tenant': 'acme'}))
+        self.assertEqual(router.match('acme.api'), ('api', {'name': 'acme'}))
+        self.assertEqual(router.match('v1.acme.api'),
+            ('versioned', {'version': 'v1', 'name': 'acme'}))
+
+    def test_backtracking_is_bounded(self):
+        # Each label matches both parameters and wildcards, but the subdomain
+        # has one label too many for any of the patterns, so every branch of
+        # the trie is tried, and each node only once.
+        router = SubdomainRouter(dict(
+            ('.'.join(['*'] * i + ['{p}'] * (12 - i)) + '.x', i)
+            for i in range(13)))
+        nodes, stack = 0, [router.root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            stack.extend(node.children.values())
+            stack.extend(child for child in (node.parameter_node,
+                node.wildcard_node) if child is not None)
+
+        with mock.patch.object(router, '_match',
+                wraps=router._match) as mock_match:
+            self.assertEqual(router.match('.'.join(['a'] * 13 + ['x'])), None)
+        self.assertTrue(mock_match.call_count <= nodes)
+
+    def test_invalid_patterns(self):
+        for pattern in ('', 'a..b', '{a-b}', 'a*', '{a}x'):
+            self.assertRaises(ImproperlyConfigured,
+                lambda: SubdomainRouter({pattern: 'urlconf'}))
+        self.assertRaises(ImproperlyConfigured,
+            lambda: SubdomainRouter({'{a}.x': 'a', '{b}.x': 'b'}))
+
+
+class SubdomainURLPatternRoutingTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(SubdomainURLPatternRoutingTestCase, self).setUp()
+        self.settings_override = override_settings(SUBDOMAIN_URLCONF_PATTERNS={
+            '*.api': self.get_path_to_urlconf('api'),
+            '{tenant}.tenants': self.get_path_to_urlconf('marketing'),
+        })
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        super(SubdomainURLPatternRoutingTestCase, self).tearDown()
+
+    def test_url_routing(self):
+        def request(subdomain):
+            host = self.get_host_for_subdomain(subdomain)
+            request = RequestFactory().get('/', HTTP_HOST=host)
+            SubdomainURLRoutingMiddleware().process_request(request)
+            return getattr(request, 'urlconf', None), request.subdomain_kwargs
+
+        self.assertEqual(request('api'), (self.get_path_to_urlconf('api'), {}))
+        self.assertEqual(request('v2.api'),
+            (self.get_path_to_urlconf('api'), {}))
+        self.assertEqual(request('acme.tenants'),
+            (self.get_path_to_urlconf('marketing'), {'tenant': 'acme'}))
+        self.assertEqual(request('acme'), (None, {}))
+
+    def test_reverse(self):
+        self.assertEqual(reverse('view', subdomain='v2.api'),
+            'http://v2.api.%s/view/' % self.DOMAIN)
+        self.assertEqual(reverse('home', subdomain='acme.tenants'),
+            'http://acme.tenants.%s/' % self.DOMAIN)
+        self.assertRaises(NoReverseMatch,
+            lambda: reverse('view', subdomain='acme.tenants'))
+
+    def test_warm_urlconfs(self):
+        self.assertEqual(len(warm_urlconfs()), 3)
+
+
+class StatsCollectorTestCase(SubdomainTestMixin, TestCase):
+    @override_settings(
+        SUBDOMAIN_STATS_COLLECTOR='subdomains.stats.MemoryStatsCollector',
+        SUBDOMAIN_REVERSE_CACHE_SIZE=10)
+    def run(self, *args, **kwargs):
+        super(StatsCollectorTestCase, self).run(*args, **kwargs)
+
+    def test_no_collector(self):
+        with override_settings(SUBDOMAIN_STATS_COLLECTOR=None):
+            self.assertEqual(get_collector(), None)
+
+    def test_invalid_collector(self):
+        with override_settings(SUBDOMAIN_STATS_COLLECTOR='subdomains.missing'):
+            self.assertRaises(ImproperlyConfigured, get_collector)
+
+    def test_snapshot(self):
+        collector = get_collector()
+        self.assertTrue(get_collector() is collector)
+        collector.reset()
+        reverse_cache.clear()
+
+        middleware = SubdomainURLRoutingMiddleware()
+        for host in ('api.%s' % self.DOMAIN, 'api.%s' % self.DOMAIN,
+                self.DOMAIN, 'wildcard.%s' % self.DOMAIN):
+            middleware.process_request(
+                RequestFactory().get('/', HTTP_HOST=host))
+
+        with mock.patch('subdomains.middleware.logger'):
+            middleware.process_request(
+                RequestFactory().get('/', HTTP_HOST='example.org'))
+
+        for i in range(3):
+            reverse('view', subdomain='api')
+
+        snapshot = collector.snapshot(reset=True)
+        self.assertEqual(snapshot['subdomains'],
+            {'api': 2, None: 1, 'wildcard': 1})
+        self.assertEqual(snapshot['unmatched_hosts'], 1)
+        self.assertEqual(snapshot['urlconfs'], {
+            self.get_path_to_urlconf('api'): 2,
+            self.get_path_to_urlconf('marketing'): 2,
+            None: 1,
+        })
+        self.assertEqual(snapshot['reverse_cache'],
+            {'hits': 2, 'misses': 1, 'ratio': 2.0 / 3})
+        self.assertEqual(snapshot['timings']['identify']['count'], 5)
+        self.assertEqual(snapshot['timings']['route']['count'], 5)
+        self.assertEqual(snapshot['timings']['reverse']['count'], 3)
+        self.assertEqual(collector.snapshot()['timings'], {})
+
+    def test_subdomains_are_bounded(self):
+        collector = get_collector()
+        collector.reset()
+        with mock.patch.object(collector, 'max_subdomains', 2):
+            for subdomain in ('a', 'b', 'c', 'a', 'd'):
+                collector.subdomain_identified(subdomain, 0.0)
+        self.assertEqual(collector.snapshot()['subdomains'],
+            {'a': 2, 'b': 1, OTHER: 2})
+
+
+class ResolverCacheTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(ResolverCacheTestCase, self).setUp()
+        self.cache = ResolverCache()
+        self.urlconfs = [self.get_path_to_urlconf(name) for name in
+            ('api', 'marketing', 'parameters', 'synthetic')]
+
+    def test_shared_resolvers(self):
+        urlconf = self.urlconfs[0]
+        resolver = self.cache.get(urlconf)
+        self.assertTrue(self.cache.get(urlconf) is resolver)
+        self.assertFalse(get_resolver(urlconf) is resolver)
+
+        clear_url_caches()
+        self.assertFalse(self.cache.get(urlconf) is resolver)
+
+    def test_eviction(self):
+        clear_url_caches()
+        urlconfs = [settings.ROOT_URLCONF] + self.urlconfs[:2]
+        with override_settings(SUBDOMAIN_RESOLVER_CACHE_SIZE=2):
+            for urlconf in urlconfs + urlconfs[:1]:
+                self.cache.get(urlconf)
+        stats = self.cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['maxsize'], 2)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['misses'], 4)
+
+    def test_eviction_leaves_django_resolvers(self):
+        root = get_resolver(settings.ROOT_URLCONF)
+        with override_settings(SUBDOMAIN_RESOLVER_CACHE_SIZE=2):
+            resolvers = [self.cache.get(urlconf) for urlconf in self.urlconfs]
+            self.assertTrue(self.cache.get(self.urlconfs[-1]) is resolvers[-1])
+            self.assertFalse(self.cache.get(self.urlconfs[0]) is resolvers[0])
+        self.assertTrue(get_resolver(settings.ROOT_URLCONF) is root)
+
+    def test_request_resolvers_bounded(self):
+        names = ('api', 'marketing', 'parameters', 'synthetic', 'default')
+        urlconfs = dict((name, self.get_path_to_urlconf(name))
+            for name in names)
+        middleware = SubdomainURLRoutingMiddleware()
+        clear_url_caches()
+
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs,
+                SUBDOMAIN_RESOLVER_CACHE_SIZE=2):
+            version = resolver_cache.validate()
+            for name in names * 3:
+                request = RequestFactory().get('/',
+                    HTTP_HOST='%s.%s' % (name, self.DOMAIN))
+                middleware.process_request(request)
+                self.assertEqual(request.urlconf, urlconfs[name])
+                get_resolver(request.urlconf).resolve('/')
+                reverse('home', subdomain=name)
+
+                # The resolvers of the subdomains and the root urlconf.
+                self.assertTrue(get_resolver_count() <= 3)
+                self.assertTrue(resolver_cache.stats()['size'] <= 2)
+
+            # Trimming Django's resolvers does not invalidate the URLs and
+            # routes derived from them.
+            self.assertEqual(resolver_cache.validate(), version)
+            clear_url_caches()
+            self.assertEqual(resolver_cache.validate(), version + 1)
+
+    def test_reverse_uses_cached_resolver(self):
+        urlconf = self.get_path_to_urlconf('api')
+        with override_settings(SUBDOMAIN_URLCONFS={'api': urlconf}):
+            resolver_cache.clear()
+            reverse_cache.clear()
+            self.assertEqual(reverse('home', subdomain='api'),
+                'http://api.%s/' % self.DOMAIN)
+            self.assertEqual(resolver_cache.stats()['size'], 1)
+            self.assertTrue(resolver_cache.get(urlconf).reverse_dict)
+
+
 class SubdomainURLReverseTestCase(SubdomainTestMixin, TestCase):
     def test_url_join(self):
         self.assertEqual(urljoin(self.DOMAIN), 'http://%s' % self.DOMAIN)
@@ -234,6 +1262,398 @@ class SubdomainURLReverseTestCase(SubdomainTestMixin, TestCase):
             'http://%s.%s/application/' % (subdomain, self.DOMAIN))
 
 
+class ShortestReverseTestCase(SubdomainTestMixin, TestCase):
+    def test_shorten_url(self):
+        origin = ('https', 'api.example.com')
+        for url, expected in (
+                ('https://api.example.com/view/', '/view/'),
+                ('https://API.example.com', '/'),
+                ('//api.example.com/view/', '/view/'),
+                ('https://www.example.com/view/', '//www.example.com/view/'),
+                ('https://api.example.com:8000/', '//api.example.com:8000/'),
+                ('http://api.example.com/view/',
+                    'http://api.example.com/view/'),
+                ('//www.example.com/', '//www.example.com/')):
+            self.assertEqual(shorten_url(url, origin), expected)
+
+    def test_shortest_reverse(self):
+        request = RequestFactory().get('/', HTTP_HOST='api.%s' % self.DOMAIN)
+        self.assertEqual(shortest_reverse(request, 'view', subdomain='api'),
+            '/view/')
+        self.assertEqual(shortest_reverse(request, 'home'),
+            '//%s/' % self.DOMAIN)
+        self.assertEqual(shortest_reverse(request, 'view', subdomain='api',
+            scheme='https'), 'https://api.%s/view/' % self.DOMAIN)
+
+        request = RequestFactory().get('/', HTTP_HOST='api.%s' % self.DOMAIN,
+            **{'wsgi.url_scheme': 'https'})
+        self.assertEqual(shortest_reverse(request, 'view', subdomain='api'),
+            '/view/')
+        self.assertEqual(shortest_reverse(request, 'home', scheme='http'),
+            'http://%s/' % self.DOMAIN)
+
+
+class ReplayTestCase(SubdomainTestMixin, TestCase):
+    LOG = """
+        # host path
+        example.com /
+        api.example.com /view/?page=2 200
+        http://api.example.com/missing/
+        example.org /
+    """
+
+    def test_read_entries(self):
+        self.assertEqual(list(read_entries(self.LOG.splitlines())), [
+            ('example.com', '/'),
+            ('api.example.com', '/view/?page=2'),
+            ('api.example.com', '/missing/'),
+            ('example.org', '/'),
+        ])
+
+    def test_replay(self):
+        entries = list(read_entries(self.LOG.splitlines()))
+        with mock.patch('subdomains.middleware.logger'):
+            summary = replay(entries, repeat=2).summary()
+        self.assertEqual(summary['count'], 8)
+        self.assertEqual(summary['unmatched'], 2)
+        self.assertEqual(summary['unmatched_rate'], 0.25)
+        self.assertEqual(summary['unresolved'], 2)
+        self.assertEqual(summary['subdomains'][None]['count'], 4)
+        self.assertEqual(summary['subdomains']['api']['count'], 4)
+
+        with override_settings(SUBDOMAIN_UNKNOWN_HOST='reject'):
+            with mock.patch('subdomains.middleware.logger'):
+                summary = replay(entries).summary()
+        self.assertEqual(summary['responded'], 1)
+
+    def test_reverse(self):
+        entries = [('api.example.com', '/view/')]
+        with mock.patch('subdomains.replay.subdomain_reverse',
+                side_effect=reverse) as mock_reverse:
+            replay(entries, reverse=True)
+        mock_reverse.assert_called_once_with('view', subdomain='api',
+            args=(), kwargs={})
+
+    def test_replay_in_processes(self):
+        entries = list(read_entries(self.LOG.splitlines()))
+        for cold in (False, True):
+            with mock.patch('subdomains.middleware.logger'):
+                stats = replay_in_processes(entries, 2, repeat=2, cold=cold)
+            summary = stats.summary()
+            self.assertEqual(summary['workers'], 2)
+            self.assertEqual(summary['count'], 16)
+            self.assertEqual(summary['unmatched'], 4)
+            self.assertEqual(summary['subdomains']['api']['count'], 8)
+
+    def test_failed_process(self):
+        self.assertRaises(RuntimeError, run_in_processes, lambda: 1 / 0, 2)
+        self.assertEqual(run_in_processes(lambda: 1, 2), [1, 1])
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'requires get_context')
+    def test_no_fork(self):
+        with mock.patch('multiprocessing.get_context',
+                side_effect=ValueError('cannot find context for fork')):
+            self.assertRaises(RuntimeError, run_in_processes, lambda: 1, 2)
+
+    def test_command(self):
+        from django.core.management import call_command
+        with tempfile.NamedTemporaryFile('w', suffix='.log') as log:
+            log.write(self.LOG)
+            log.flush()
+
+            stdout = StringIO()
+            with mock.patch('subdomains.middleware.logger'):
+                call_command('replayhosts', log.name, profile=True,
+                    stdout=stdout)
+        output = stdout.getvalue()
+        self.assertTrue(output.startswith('Replayed 4 requests'))
+        self.assertTrue('Unmatched hosts: 1 (25.00%)' in output)
+        self.assertTrue('cumulative' in output)
+
+    def test_command_cold(self):
+        from django.core.management import call_command
+        with tempfile.NamedTemporaryFile('w', suffix='.log') as log:
+            log.write(self.LOG)
+            log.flush()
+
+            with mock.patch('subdomains.management.commands.replayhosts.'
+                    'clear_caches') as clear_caches:
+                with mock.patch('subdomains.middleware.logger'):
+                    call_command('replayhosts', log.name, cold=True,
+                        stdout=StringIO())
+        clear_caches.assert_called_once_with()
+
+    def test_command_processes(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        with tempfile.NamedTemporaryFile('w', suffix='.log') as log:
+            for processes in ('0', '-1', 'two'):
+                self.assertRaises(CommandError, call_command, 'replayhosts',
+                    log.name, processes=processes, stdout=StringIO())
+
+
+class SitemapTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(SitemapTestCase, self).setUp()
+        self.settings = override_settings(SUBDOMAIN_URLCONFS=dict(
+            settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters')))
+        self.settings.enable()
+        set_urlconf(self.get_path_to_urlconf('sitemaps'))
+
+    def tearDown(self):
+        set_urlconf(None)
+        self.settings.disable()
+        super(SitemapTestCase, self).tearDown()
+
+    def get(self, view, **kwargs):
+        from subdomains.tests.urls.sitemaps import sitemaps
+        request = RequestFactory().get('/', kwargs.pop('query', {}),
+            HTTP_HOST=self.DOMAIN)
+        response = view(request, sitemaps, **kwargs)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_index(self):
+        content = self.get(index)
+        self.assertEqual(content.count('<sitemap>'), 5)
+        for location in ('sitemap-root.xml', 'sitemap-api.xml',
+                'sitemap-users.xml', 'sitemap-users.xml?p=2',
+                'sitemap-users.xml?p=3'):
+            self.assertTrue('<loc>http://%s/%s</loc>' % (self.DOMAIN,
+                location) in content, location)
+
+    def test_sitemap(self):
+        content = self.get(sitemap, section='api')
+        self.assertTrue(content.startswith('<?xml'))
+        self.assertTrue('<url><loc>http://api.%s/</loc><changefreq>daily'
+            '</changefreq></url>' % self.DOMAIN in content)
+
+        content = self.get(sitemap, section='users', query={'p': 3})
+        self.assertEqual(content.count('<url>'), 1)
+        self.assertTrue('<loc>http://params.%s/users/user-6/</loc>'
+            '<priority>0.5</priority>' % self.DOMAIN in content)
+
+    def test_parts(self):
+        from subdomains.sitemaps import Sitemap
+        entry = ('<url><loc>http://params.%s/users/user-0/</loc>'
+            '<priority>0.5</priority></url>\n' % self.DOMAIN)
+        max_size = len(URLSET_HEADER) + len(URLSET_FOOTER) + len(entry) * 2
+        with mock.patch('subdomains.sitemaps.SITEMAP_MAX_SIZE', max_size):
+            with mock.patch.object(Sitemap, 'max_entry_size', len(entry)):
+                with mock.patch('subdomains.sitemaps.reverse_many') as rm:
+                    content = self.get(index)
+                self.assertFalse(rm.called)
+                self.assertEqual(content.count('<sitemap>'), 7)
+                self.assertTrue('<loc>http://%s/sitemap-users.xml?p=1&amp;'
+                    'part=2</loc>' % self.DOMAIN in content)
+                self.assertFalse('part=3' in content)
+
+                urls = []
+                for page, part in ((1, 1), (1, 2), (2, 1), (2, 2), (3, 1)):
+                    with mock.patch('subdomains.sitemaps.reverse_many',
+                            wraps=reverse_many) as rm:
+                        content = self.get(sitemap, section='users',
+                            query={'p': page, 'part': part})
+                    self.assertTrue(len(content) <= max_size)
+                    self.assertTrue(len(rm.call_args[0][0]) <= 2)
+                    urls += re.findall('<loc>([^<]+)</loc>', content)
+                self.assertEqual(urls, ['http://params.%s/users/user-%d/' % (
+                    self.DOMAIN, i) for i in range(7)])
+
+                with mock.patch('subdomains.sitemaps.reverse_many') as rm:
+                    self.assertRaises(Http404, self.get, sitemap,
+                        section='users', query={'p': 3, 'part': 2})
+                self.assertFalse(rm.called)
+
+    def test_oversized_entries(self):
+        from subdomains.sitemaps import Sitemap
+        with mock.patch.object(Sitemap, 'max_entry_size', 40):
+            with mock.patch('subdomains.sitemaps.logger') as logger:
+                content = self.get(sitemap, section='users')
+        self.assertEqual(content.count('<url>'), 0)
+        self.assertEqual(logger.warning.call_count, 3)
+
+    def test_not_found(self):
+        for kwargs in ({'section': 'missing'}, {},
+                {'section': 'users', 'query': {'p': 4}},
+                {'section': 'users', 'query': {'p': 'last'}},
+                {'section': 'users', 'query': {'p': 1, 'part': 0}}):
+            self.assertRaises(Http404, self.get, sitemap, **kwargs)
+
+
+class ReverseManyTestCase(SubdomainTestMixin, TestCase):
+    ITEMS = (
+        ('home', None, None, None),
+        ('home', 'api', (), {}),
+        ('view', 'api', None, None),
+        ('view', 'wildcard', None, None),
+        ('application', 'wildcard', None, None),
+        ('example', 'www', None, None),
+    )
+
+    def test_matches_reverse(self):
+        for scheme in (None, 'https', ''):
+            expected = [reverse(viewname, subdomain, scheme, args, kwargs)
+                for viewname, subdomain, args, kwargs in self.ITEMS]
+            self.assertEqual(reverse_many(self.ITEMS, scheme=scheme), expected)
+
+    def test_lazy(self):
+        urls = reverse_many(self.ITEMS, lazy=True)
+        self.assertFalse(isinstance(urls, list))
+        self.assertEqual(next(urls), 'http://%s/' % self.DOMAIN)
+
+    def test_single_domain_lookup(self):
+        with mock.patch('subdomains.utils.get_domain') as get_domain:
+            get_domain.return_value = self.DOMAIN
+            reverse_many(self.ITEMS)
+        self.assertEqual(get_domain.call_count, 1)
+
+    def test_no_reverse(self):
+        self.assertRaises(NoReverseMatch,
+            lambda: reverse_many([('view', None, None, None)]))
+
+
+class CachedSubdomainURLReverseTestCase(SubdomainURLReverseTestCase):
+    @override_settings(SUBDOMAIN_REVERSE_CACHE_SIZE=2)
+    def run(self, *args, **kwargs):
+        super(CachedSubdomainURLReverseTestCase, self).run(*args, **kwargs)
+
+    def setUp(self):
+        super(CachedSubdomainURLReverseTestCase, self).setUp()
+        reverse_cache.clear()
+
+    def test_cache_hits(self):
+        stats = reverse_cache.stats()
+        for i in range(3):
+            self.assertEqual(reverse('view', subdomain='api'),
+                'http://api.%s/view/' % self.DOMAIN)
+        self.assertEqual(reverse_cache.stats()['hits'], stats['hits'] + 2)
+        self.assertEqual(reverse_cache.stats()['misses'], stats['misses'] + 1)
+
+        self.assertEqual(reverse('view', subdomain='api', scheme='https'),
+            'https://api.%s/view/' % self.DOMAIN)
+        self.assertEqual(reverse('view', subdomain='wildcard'),
+            'http://wildcard.%s/view/' % self.DOMAIN)
+        self.assertEqual(len(reverse_cache.cache), 2)
+
+    def test_unhashable_arguments(self):
+        self.assertRaises(NoReverseMatch,
+            lambda: reverse('view', kwargs={'key': []}))
+
+    @override_settings(SUBDOMAIN_REVERSE_CACHE_SIZE=10)
+    def test_equal_arguments_of_different_types(self):
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs):
+            for value in (1, 1.0, True, 1):
+                self.assertEqual(reverse('search', subdomain='params',
+                        kwargs={'query': value}),
+                    'http://params.%s/search/%s/' % (self.DOMAIN, value))
+                self.assertEqual(reverse('search', subdomain='params',
+                        args=(value,)),
+                    'http://params.%s/search/%s/' % (self.DOMAIN, value))
+        self.assertEqual(reverse_cache.stats()['hits'], 2)
+
+    def test_cleared_on_domain_change(self):
+        reverse('view', subdomain='api')
+        self.site.domain = 'example.org'
+        self.site.save()
+        self.assertEqual(reverse('view', subdomain='api'),
+            'http://api.example.org/view/')
+        self.assertEqual(len(reverse_cache.cache), 1)
+
+    def test_cleared_on_clear_url_caches(self):
+        reverse('view', subdomain='api')
+        clear_url_caches()
+        reverse('home')
+        self.assertEqual(len(reverse_cache.cache), 1)
+
+
+class FastReverseTestCase(SubdomainTestMixin, TestCase):
+    SUBDOMAINS = (None, 'api', 'www', 'params', 'wildcard')
+    CALLS = (
+        ('home', None, None),
+        ('view', None, None),
+        ('example', None, None),
+        ('application', None, None),
+        ('user', None, {'username': 'ted'}),
+        ('user', ('ted.k',), None),
+        ('user', None, {'username': 'not valid'}),
+        ('user', None, {'username': 'ted', 'extra': 1}),
+        ('archive', (2016, '01'), None),
+        ('archive', (2016, 1), None),
+        ('archive', None, {'year': 2016}),
+        ('paged', None, None),
+        ('paged', None, {'page': '1'}),
+        ('paged', None, {'page': 2}),
+        ('paged', ('3',), None),
+        ('search', None, {'query': 'a b/c?d#e%f&g'}),
+        ('search', None, {'query': u'caf\xe9 \u2603'}),
+        ('search', None, {'query': '/leading'}),
+        ('search', None, {'query': 'a:b@c~d!$&()*+,;='}),
+        ('optional', None, None),
+        ('optional', None, {'slug': 'abc'}),
+        ('optional', None, {'slug': 'ABC'}),
+        ('percent', None, None),
+        ('unicode', None, None),
+        ('raw', None, {'path': ''}),
+        ('raw', None, {'path': '/example.com'}),
+        ('example', None, {'section': 'abc'}),
+        ('user', ('ted',), {'username': 'ted'}),
+        ('item', None, {'pk': 5, 'slug': 'abc'}),
+        ('item', (5, 'x y'), None),
+        ('item', None, {'pk': 'x', 'slug': 'abc'}),
+        ('__invalid__', None, None),
+    )
+
+    def setUp(self):
+        super(FastReverseTestCase, self).setUp()
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        self.settings_override = override_settings(SUBDOMAIN_URLCONFS=urlconfs)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        super(FastReverseTestCase, self).tearDown()
+
+    def call(self, *args, **kwargs):
+        try:
+            return reverse(*args, **kwargs)
+        except Exception as error:
+            return type(error), str(error)
+
+    def test_identical_to_reverse(self):
+        for subdomain in self.SUBDOMAINS:
+            for scheme in (None, 'https', ''):
+                for viewname, args, kwargs in self.CALLS:
+                    call = functools.partial(self.call, viewname,
+                        subdomain=subdomain, scheme=scheme, args=args,
+                        kwargs=kwargs)
+                    expected = call()
+                    with override_settings(SUBDOMAIN_FAST_REVERSE=True):
+                        self.assertEqual(call(), expected,
+                            (viewname, subdomain, scheme, args, kwargs))
+
+    def test_compiled_urls(self):
+        from subdomains.fastreverse import get_engine
+        with override_settings(SUBDOMAIN_FAST_REVERSE=True):
+            engine = get_engine()
+            self.assertEqual(engine.urls['api', 'view'],
+                'http://api.%s/view/' % self.DOMAIN)
+            self.assertEqual(engine.urls['params', 'paged'],
+                'http://params.%s/page/' % self.DOMAIN)
+            self.assertFalse(('params', 'user') in engine.urls)
+            self.assertTrue(get_engine() is engine)
+
+            self.site.domain = 'example.org'
+            self.site.save()
+            self.assertFalse(get_engine() is engine)
+            self.assertEqual(reverse('view', subdomain='api'),
+                'http://api.example.org/view/')
+
+
 class SubdomainTemplateTagTestCase(SubdomainTestMixin, TestCase):
     def make_template(self, template):
         return Template('{% load subdomainurls %}' + template)
@@ -281,3 +1701,263 @@ class SubdomainTemplateTagTestCase(SubdomainTestMixin, TestCase):
             rendered = template.render(context).strip()
             self.assertEqual(rendered,
                 'http://%s.%s/' % (subdomain, self.DOMAIN))
+
+    def test_empty_subdomain(self):
+        request = mock.Mock()
+        request.subdomain = 'api'
+        template = self.make_template("{% url 'home' subdomain='' %}")
+        rendered = template.render(Context({'request': request})).strip()
+        self.assertEqual(rendered, 'http://%s/' % self.DOMAIN)
+
+    def test_arguments(self):
+        template = self.make_template("{% url 'user' 'params' username %} "
+            "{% url 'user' subdomain='params' username=username %} "
+            "{% url 'user' subdomain='params' username=username as user_url %}"
+            "[{{ user_url }}]")
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs):
+            rendered = template.render(Context({'username': 'a.b'}))
+        url = 'http://params.%s/users/a.b/' % self.DOMAIN
+        self.assertEqual(rendered, '%s %s [%s]' % (url, url, url))
+
+    def test_constant_arguments(self):
+        template = self.make_template(
+            "{% url 'user' subdomain='api' username=username %}")
+        node = template.nodelist[-1]
+        self.assertEqual(node.view.resolve(None), 'user')
+        self.assertEqual(node.subdomain.resolve(None), 'api')
+        self.assertFalse(hasattr(node.kwargs['username'], 'value'))
+
+    def test_render_cache(self):
+        template = self.make_template("{% for i in items %}"
+            "{% url 'view' subdomain='api' %}{% url view subdomain=i %}"
+            "{% endfor %}")
+        context = Context({'items': ['www', 'www', 'api'], 'view': 'home'})
+
+        path = 'subdomains.templatetags.subdomainurls.reverse'
+        with mock.patch(path, side_effect=reverse) as mock_reverse:
+            template.render(context)
+            self.assertEqual(mock_reverse.call_count, 3)
+            template.render(context)
+            self.assertEqual(mock_reverse.call_count, 6)
+
+    def test_render_cache_argument_types(self):
+        template = self.make_template("{% for i in items %}"
+            "{% url 'search' 'params' query=i %} {% endfor %}")
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs):
+            rendered = template.render(Context({'items': [1, 1.0, True]}))
+        self.assertEqual(rendered.split(), ['http://params.%s/search/%s/'
+            % (self.DOMAIN, value) for value in (1, 1.0, True)])
+
+    def test_syntax_errors(self):
+        for source in ("{% url %}",
+                "{% url 'home' subdomain='api' 'www' %}",
+                "{% url 'home' subdomain='api' subdomain='www' %}"):
+            self.assertRaises(TemplateSyntaxError, self.make_template, source)
+
+    def test_shorturl(self):
+        template = self.make_template("{% shorturl 'view' %} "
+            "{% shorturl 'home' subdomain='' %} {% url 'view' %}")
+        request = RequestFactory().get('/', HTTP_HOST='api.%s' % self.DOMAIN)
+        request.subdomain = 'api'
+
+        rendered = template.render(Context({'request': request}))
+        self.assertEqual(rendered, '/view/ //%s/ http://api.%s/view/' %
+            (self.DOMAIN, self.DOMAIN))
+
+        template = self.make_template("{% shorturl 'home' %}")
+        rendered = template.render(Context({}))
+        self.assertEqual(rendered, 'http://%s/' % self.DOMAIN)
+
+
+@unittest.skipIf(jinja2 is None, 'requires Jinja2')
+class Jinja2TestCase(SubdomainTestMixin, TestCase):
+    def make_template(self, template):
+        from subdomains.jinja2 import SubdomainExtension
+        environment = jinja2.Environment(extensions=[SubdomainExtension])
+        return environment.from_string(template)
+
+    def test_subdomain(self):
+        template = self.make_template("{{ url(view) }} "
+            "{{ url(view, subdomain='www') }} {{ url(view, 'api') }} "
+            "{{ url(view, subdomain='') }}")
+        request = mock.Mock()
+        request.subdomain = 'api'
+
+        rendered = template.render(view='home', request=request)
+        self.assertEqual(rendered, 'http://api.%s/ http://www.%s/ '
+            'http://api.%s/ http://%s/' % ((self.DOMAIN,) * 4))
+
+        rendered = template.render(view='home')
+        self.assertEqual(rendered.split()[0], 'http://%s/' % self.DOMAIN)
+
+    def test_arguments(self):
+        template = self.make_template("{{ url('user', 'params', username) }} "
+            "{{ url('user', subdomain='params', username=username) }}")
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs):
+            rendered = template.render(username='a.b')
+        url = 'http://params.%s/users/a.b/' % self.DOMAIN
+        self.assertEqual(rendered, '%s %s' % (url, url))
+
+    def test_no_reverse(self):
+        template = self.make_template("{{ url('__invalid__') }}")
+        self.assertRaises(NoReverseMatch, template.render)
+
+    def test_render_cache(self):
+        template = self.make_template("{% for i in items %}"
+            "{{ url('view', subdomain='api') }}{{ url(view, subdomain=i) }}"
+            "{% endfor %}")
+        context = {'items': ['www', 'www', 'api'], 'view': 'home'}
+
+        with mock.patch('subdomains.jinja2.reverse',
+                side_effect=reverse) as mock_reverse:
+            template.render(context)
+            self.assertEqual(mock_reverse.call_count, 3)
+            template.render(context)
+            self.assertEqual(mock_reverse.call_count, 6)
+
+    def test_render_cache_argument_types(self):
+        template = self.make_template("{% for i in items %}"
+            "{{ url('search', 'params', query=i) }} {% endfor %}")
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        with override_settings(SUBDOMAIN_URLCONFS=urlconfs):
+            rendered = template.render(items=[1, 1.0, True])
+        self.assertEqual(rendered.split(), ['http://params.%s/search/%s/'
+            % (self.DOMAIN, value) for value in (1, 1.0, True)])
+
+    def test_shorturl(self):
+        template = self.make_template("{{ shorturl('view') }} "
+            "{{ shorturl('home', subdomain='') }} {{ url('view') }}")
+        request = RequestFactory().get('/', HTTP_HOST='api.%s' % self.DOMAIN)
+        request.subdomain = 'api'
+
+        rendered = template.render(request=request)
+        self.assertEqual(rendered, '/view/ //%s/ http://api.%s/view/' %
+            (self.DOMAIN, self.DOMAIN))
+
+        template = self.make_template("{{ shorturl('home') }}")
+        self.assertEqual(template.render(), 'http://%s/' % self.DOMAIN)
+
+
+class URLBuilderTestCase(SubdomainTestMixin, TestCase):
+    def setUp(self):
+        super(URLBuilderTestCase, self).setUp()
+        urlconfs = dict(settings.SUBDOMAIN_URLCONFS,
+            params=self.get_path_to_urlconf('parameters'))
+        self.settings_override = override_settings(SUBDOMAIN_URLCONFS=urlconfs)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        super(URLBuilderTestCase, self).tearDown()
+
+    def test_build(self):
+        from subdomains.urlbuilder import URLBuilder
+        builder = URLBuilder('user', subdomain='params', scheme='https')
+        with mock.patch('subdomains.urlbuilder.reverse_path') as mock_reverse:
+            for username in ('a', 'b.c'):
+                self.assertEqual(builder.build(kwargs={'username': username}),
+                    reverse('user', subdomain='params', scheme='https',
+                        kwargs={'username': username}))
+            self.assertEqual(URLBuilder('archive', 'params').build(
+                args=('2015', '01')),
+                'http://params.%s/archive/2015/01/' % self.DOMAIN)
+        self.assertFalse(mock_reverse.called)
+
+    def test_fallback(self):
+        from subdomains.urlbuilder import URLBuilder, build_urls
+        builder = URLBuilder('user', subdomain='params')
+        self.assertRaises(NoReverseMatch, builder.build,
+            kwargs={'username': '!'})
+        self.assertRaises(NoReverseMatch, URLBuilder('__invalid__').build)
+
+        self.assertEqual(build_urls('view', [{}, {}], subdomain='api'),
+            ['http://api.%s/view/' % self.DOMAIN] * 2)
+
+    def test_lookups_at_construction(self):
+        from subdomains.urlbuilder import URLBuilder
+        for fast in (False, True):
+            with override_settings(SUBDOMAIN_FAST_REVERSE=fast):
+                builder = URLBuilder('user', subdomain='params')
+                self.assertTrue(builder.candidates)
+
+            with mock.patch('subdomains.urlbuilder.get_domain') as get_domain:
+                with mock.patch('subdomains.utils.resolver_cache.get') as get:
+                    self.assertEqual(builder.build(kwargs={'username': 'a'}),
+                        'http://params.%s/users/a/' % self.DOMAIN)
+                    self.assertRaises(NoReverseMatch, builder.build,
+                        kwargs={'username': '!'})
+            self.assertFalse(get_domain.called)
+            self.assertFalse(get.called)
+
+        # Routes that are not compiled use the cached resolver.
+        builder = URLBuilder('search', subdomain='params')
+        with mock.patch.object(builder, 'candidates', ()):
+            self.assertEqual(builder.build(kwargs={'query': 'a b'}),
+                'http://params.%s/search/a%%20b/' % self.DOMAIN)
+        self.assertTrue(builder.resolver is
+            resolver_cache.get(self.get_path_to_urlconf('parameters')))
+
+    @unittest.skipIf(rest_framework is None, 'requires Django REST framework')
+    def test_serializer_fields(self):
+        from rest_framework import serializers
+        from subdomains.fastreverse import compile_urlconf
+        from subdomains.serializers import (SubdomainHyperlinkedIdentityField,
+            SubdomainHyperlinkedRelatedField)
+
+        class User(object):
+            def __init__(self, pk, username):
+                self.pk, self.username = pk, username
+
+        class UserSerializer(serializers.Serializer):
+            url = SubdomainHyperlinkedIdentityField(view_name='user',
+                subdomain='params', lookup_field='username',
+                lookup_url_kwarg='username')
+            home = SubdomainHyperlinkedRelatedField(view_name='paged',
+                source='*', read_only=True, lookup_field='pk',
+                lookup_url_kwarg='page')
+
+        request = RequestFactory().get('/', HTTP_HOST='params.%s' %
+            self.DOMAIN, secure=True)
+        request.subdomain = 'params'
+        users = [User(1, 'a'), User(2, 'b')]
+
+        with mock.patch('subdomains.urlbuilder.compile_urlconf',
+                wraps=compile_urlconf) as mock_compile_urlconf:
+            data = UserSerializer(users, many=True,
+                context={'request': request}).data
+        self.assertEqual(mock_compile_urlconf.call_count, 2)
+        self.assertEqual([dict(item) for item in data], [
+            {'url': 'https://params.%s/users/a/' % self.DOMAIN,
+             'home': 'https://params.%s/page/1/' % self.DOMAIN},
+            {'url': 'https://params.%s/users/b/' % self.DOMAIN,
+             'home': 'https://params.%s/page/2/' % self.DOMAIN},
+        ])
+
+    @unittest.skipIf(rest_framework is None, 'requires Django REST framework')
+    def test_serializer_input(self):
+        from rest_framework.exceptions import ValidationError
+        from subdomains.serializers import SubdomainHyperlinkedRelatedField
+
+        class UserField(SubdomainHyperlinkedRelatedField):
+            def get_object(self, view_name, view_args, view_kwargs):
+                return view_kwargs['username']
+
+        field = UserField(view_name='user', queryset=[],
+            lookup_field='username', lookup_url_kwarg='username')
+        self.assertEqual(field.to_internal_value(
+            'https://params.%s/users/a/' % self.DOMAIN), 'a')
+        self.assertEqual(get_urlconf(), None)
+        for url in ('http://api.%s/users/a/' % self.DOMAIN,
+                'http://example.org/users/a/', '/users/a/'):
+            self.assertRaises(ValidationError, field.to_internal_value, url)
+
+        field = UserField(view_name='user', queryset=[], subdomain='params',
+            lookup_field='username', lookup_url_kwarg='username')
+        self.assertEqual(field.to_internal_value('/users/b/'), 'b')
@@ -1,13 +1,13 @@
 try:
-    from django.conf.urls import patterns, url
-except ImportError:
-    from django.conf.urls.defaults import patterns, url  # noqa
+    from django.urls import re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url
 
 from subdomains.tests.urls.default import urlpatterns as default_patterns
 from subdomains.tests.views import view
 
 
-urlpatterns = default_patterns + patterns('',
-    url(regex=r'^view/$', view=view, name='view'),
-    url(regex=r'^application/$', view=view, name='application'),
-)
+urlpatterns = default_patterns + [
+    url(r'^view/$', view, name='view'),
+    url(r'^application/$', view, name='application'),
+]
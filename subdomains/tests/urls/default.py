@@ -1,12 +1,12 @@
 try:
-    from django.conf.urls import patterns, url
-except ImportError:
-    from django.conf.urls.defaults import patterns, url  # noqa
+    from django.urls import re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url
 
 from subdomains.tests.views import view
 
 
-urlpatterns = patterns('',
-    url(regex=r'^$', view=view, name='home'),
-    url(regex=r'^example/$', view=view, name='example'),
-)
+urlpatterns = [
+    url(r'^$', view, name='home'),
+    url(r'^example/$', view, name='example'),
+]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+try:
+    from django.urls import include, re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import include, url
+
+from subdomains.tests.views import view
+
+
+urlpatterns = [
+    url(r'^$', view, name='home'),
+    url(r'^users/(?P<username>[\w.-]+)/$', view, name='user'),
+    url(r'^archive/(\d{4})/(\d{2})/$', view, name='archive'),
+    url(r'^page/$', view, kwargs={'page': '1'}, name='paged'),
+    url(r'^page/(?P<page>\d+)/$', view, name='paged'),
+    url(r'^search/(?P<query>.+)/$', view, name='search'),
+    url(r'^optional/(?:(?P<slug>[a-z]+)/)?$', view, name='optional'),
+    url(r'^100%/$', view, name='percent'),
+    url(r'^caf\xe9/$', view, name='unicode'),
+    url(r'^(?P<path>.*)/raw/$', view, name='raw'),
+    url(r'^nested/(?P<section>[a-z]+)/',
+        include('subdomains.tests.urls.default')),
+]
+
+try:
+    from django.urls import path
+except ImportError:  # Django < 2.0
+    pass
+else:
+    urlpatterns += [
+        path('items/<int:pk>/<slug:slug>/', view, name='item'),
+    ]
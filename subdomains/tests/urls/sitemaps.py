@@ -0,0 +1,36 @@
+try:
+    from django.urls import re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url
+
+from subdomains.sitemaps import Sitemap, index, sitemap, subdomain_sections
+
+
+class PageSitemap(Sitemap):
+    changefreq = 'daily'
+
+    def items(self):
+        return ['home']
+
+
+class UserSitemap(Sitemap):
+    subdomain = 'params'
+    limit = 3
+    batch_size = 2
+    priority = 0.5
+
+    def items(self):
+        return ['user-%d' % i for i in range(7)]
+
+    def route(self, username):
+        return 'user', (), {'username': username}
+
+
+sitemaps = dict(subdomain_sections(PageSitemap, (None, 'api')),
+    users=UserSitemap)
+
+urlpatterns = [
+    url(r'^sitemap\.xml$', index, {'sitemaps': sitemaps}),
+    url(r'^sitemap-(?P<section>.+)\.xml$', sitemap, {'sitemaps': sitemaps},
+        name='subdomains-sitemap'),
+]
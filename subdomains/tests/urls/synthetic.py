@@ -0,0 +1,23 @@
+"""
+A large, generated urlconf for benchmarking URL routing and reversing.
+"""
+try:
+    from django.urls import re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url
+
+from subdomains.tests.urls.default import urlpatterns as default_patterns
+from subdomains.tests.views import view
+
+
+#: The number of routes of each kind in this urlconf.
+ROUTES = 250
+
+urlpatterns = default_patterns + [
+    url(r'^static-%d/$' % i, view, name='static-%d' % i)
+    for i in range(ROUTES)
+] + [
+    url(r'^objects-%d/(?P<pk>\d+)/(?P<slug>[-\w]+)/$' % i, view,
+        name='object-%d' % i)
+    for i in range(ROUTES)
+]
@@ -0,0 +1,75 @@
+"""
+Builds the URLs of one named route on one subdomain for many objects at once,
+e.g. the links of a page of API results::
+
+    from subdomains.urlbuilder import URLBuilder
+
+    builder = URLBuilder('user-detail', subdomain='api')
+    data = [{'username': user.username,
+             'url': builder.build(kwargs={'pk': user.pk})} for user in page]
+
+The domain, the urlconf, its resolver and the scheme and host prefix of the
+URLs are looked up once, when the builder is created, and the route is
+reversed from the route templates compiled by :mod:`subdomains.fastreverse`,
+so building each URL only substitutes its arguments into the template.
+Serializer fields for Django REST framework are provided by
+:mod:`subdomains.serializers`.
+"""
+from subdomains.compat import get_script_prefix
+from subdomains.fastreverse import compile_urlconf
+from subdomains.utils import (get_domain, get_urlconf_for_subdomain,
+    resolver_cache, reverse_path, urljoin)
+
+
+class URLBuilder(object):
+    """
+    Builds the full URLs of the named route ``viewname`` on ``subdomain``.
+
+    Views that cannot be compiled (such as namespaced or callable views), and
+    arguments that do not match a compiled route, are reversed with the
+    cached resolver of the urlconf instead, like
+    :func:`subdomains.utils.reverse_many`, so errors are reported exactly as
+    before.
+    """
+    def __init__(self, viewname, subdomain=None, scheme=None):
+        self.viewname = viewname
+        self.subdomain = subdomain
+        self.scheme = scheme
+
+        domain = get_domain()
+        host = domain if subdomain is None else '%s.%s' % (subdomain, domain)
+        self.prefix = urljoin(host, scheme=scheme)
+        self.urlconf = get_urlconf_for_subdomain(subdomain)
+        self.resolver = resolver_cache.get(self.urlconf)
+        self.script_prefix = get_script_prefix()
+        try:
+            self.candidates = compile_urlconf(self.urlconf,
+                self.script_prefix)[viewname]
+        except (KeyError, TypeError):
+            self.candidates = ()
+
+    def build(self, args=None, kwargs=None):
+        """
+        Returns the URL of the route for the given arguments, like
+        :func:`subdomains.utils.reverse`.
+        """
+        if not (args and kwargs):
+            for candidate in self.candidates:
+                path = candidate.reverse(args or (), kwargs or {})
+                if path is not None:
+                    return self.prefix + path
+        return self.prefix + reverse_path(self.viewname, self.urlconf, args,
+            kwargs, resolver=self.resolver, script_prefix=self.script_prefix)
+
+
+def build_urls(viewname, kwargs_list, subdomain=None, scheme=None):
+    """
+    Returns the list of the URLs of the named route ``viewname`` on
+    ``subdomain`` for each of the keyword argument dictionaries of
+    ``kwargs_list``::
+
+        >>> build_urls('user', ({'pk': pk} for pk in (1, 2)), subdomain='api')
+        ['http://api.example.com/users/1/', 'http://api.example.com/users/2/']
+    """
+    builder = URLBuilder(viewname, subdomain=subdomain, scheme=scheme)
+    return [builder.build(kwargs=kwargs) for kwargs in kwargs_list]
@@ -1,16 +1,46 @@
 import functools
+import logging
+import time
+import uuid
 try:
     from urlparse import urlunparse
 except ImportError:
     from urllib.parse import urlunparse
 
 from django.conf import settings
-from django.core.urlresolvers import reverse as simple_reverse
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+from django.utils.encoding import iri_to_uri
+
+from subdomains.compat import (clear_url_caches, force_text, get_cache,
+    get_resolver, get_resolver_count, get_script_prefix, get_urlconf,
+    make_resolver, reverse as simple_reverse, string_types)
+from subdomains.datastructures import LRUCache
+from subdomains.hosts import normalize_host
+from subdomains.routing import get_router
+from subdomains.stats import get_collector, timer
+
+
+logger = logging.getLogger(__name__)
+
+
+#: The last domain of a ``Site`` that was normalized, and its normalized form.
+_site_domain = (None, None)
 
 
 def current_site_domain():
+    """
+    Returns the domain of the current ``Site``, normalized with
+    :func:`~subdomains.hosts.normalize_host` (keeping any port.)
+    """
+    global _site_domain
     from django.contrib.sites.models import Site
     domain = Site.objects.get_current().domain
+    name, normalized = _site_domain
+    if domain != name:
+        normalized = normalize_host(domain, keep_port=True)
+        _site_domain = (domain, normalized)
+    domain = normalized
 
     prefix = 'www.'
     if getattr(settings, 'REMOVE_WWW_FROM_DOMAIN', False) \
@@ -19,7 +49,154 @@ def current_site_domain():
 
     return domain
 
-get_domain = current_site_domain
+
+class SiteDomainCache(object):
+    """
+    Keeps the value of :func:`current_site_domain` in process memory.
+
+    The cached domain is discarded whenever a ``Site`` is saved or deleted in
+    this process. When ``settings.SUBDOMAIN_DOMAIN_CACHE_ALIAS`` names a
+    Django cache, a version key stored there is compared to the version the
+    domain was loaded with, and the domain is loaded again if another process
+    has changed a ``Site`` since. The version is checked at most once every
+    ``settings.SUBDOMAIN_DOMAIN_CACHE_TIMEOUT`` seconds, or every
+    ``settings.SUBDOMAIN_DOMAIN_CACHE_CHECK_INTERVAL`` seconds (5 by default)
+    if no timeout is set. Without a shared cache, the domain is loaded again
+    once the timeout (if any) has expired.
+    """
+    version_key = 'subdomains:site-domain-version'
+
+    def __init__(self):
+        self._entries = {}
+        self._connected = False
+
+    def get(self):
+        """
+        Returns the domain of the current site.
+        """
+        if not self._connected:
+            self.connect()
+
+        key = self.get_key()
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            domain, version, expires = entry
+            if expires is None or now < expires:
+                return domain
+
+        current = self.get_version()
+        if entry is not None and version is not None and version == current:
+            self._entries[key] = (domain, version,
+                self.get_expiry(now, version))
+            return domain
+
+        version = current
+        domain = current_site_domain()
+        self._entries[key] = (domain, version, self.get_expiry(now, version))
+        return domain
+
+    def get_key(self):
+        return (getattr(settings, 'SITE_ID', None),
+            getattr(settings, 'REMOVE_WWW_FROM_DOMAIN', False))
+
+    def is_cached(self):
+        """
+        Returns whether :meth:`get` would return a domain from process memory,
+        without checking the shared version or loading the domain.
+        """
+        entry = self._entries.get(self.get_key())
+        if not self._connected or entry is None:
+            return False
+        expires = entry[2]
+        return expires is None or time.time() < expires
+
+    def get_expiry(self, now, version):
+        """
+        Returns the time when a domain loaded at ``now`` with the shared
+        ``version`` expires (or its version must be checked), or ``None`` if
+        it never does.
+        """
+        timeout = getattr(settings, 'SUBDOMAIN_DOMAIN_CACHE_TIMEOUT', None)
+        if timeout is None:
+            if version is None:
+                return None
+            timeout = getattr(settings,
+                'SUBDOMAIN_DOMAIN_CACHE_CHECK_INTERVAL', 5)
+        return now + timeout
+
+    def get_shared_cache(self):
+        alias = getattr(settings, 'SUBDOMAIN_DOMAIN_CACHE_ALIAS', None)
+        if alias is None:
+            return None
+        return get_cache(alias)
+
+    def get_version(self):
+        """
+        Returns the version of the site domains shared between processes, or
+        ``None`` if no shared cache is configured.
+        """
+        cache = self.get_shared_cache()
+        if cache is None:
+            return None
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self, **kwargs):
+        """
+        Discards the cached domains in this process and changes the shared
+        version, causing other processes to reload their domains the next time
+        they check it.
+        """
+        self.clear()
+        cache = self.get_shared_cache()
+        if cache is not None:
+            cache.set(self.version_key, uuid.uuid4().hex, None)
+
+    def clear(self):
+        """
+        Discards the cached domains in this process.
+        """
+        self._entries = {}
+
+    def connect(self):
+        from django.contrib.sites.models import Site
+        for signal in (post_save, post_delete):
+            signal.connect(self.invalidate, sender=Site, weak=False,
+                dispatch_uid='subdomains.utils.SiteDomainCache')
+        self._connected = True
+
+
+#: The process-wide :class:`SiteDomainCache` used by :func:`get_domain`.
+domain_cache = SiteDomainCache()
+
+
+def get_domain():
+    """
+    Returns the domain used to identify subdomains and build URLs.
+
+    If ``settings.SUBDOMAIN_CACHE_DOMAIN`` is set, the domain is read from
+    :data:`domain_cache`, otherwise :func:`current_site_domain` is called.
+    """
+    if getattr(settings, 'SUBDOMAIN_CACHE_DOMAIN', False):
+        return domain_cache.get()
+    return current_site_domain()
+
+
+def is_domain_cached():
+    """
+    Returns whether :func:`get_domain` can return the domain from process
+    memory, without querying the database or a shared cache.
+    """
+    if getattr(settings, 'SUBDOMAIN_CACHE_DOMAIN', False):
+        return domain_cache.is_cached()
+    from django.contrib.sites.models import SITE_CACHE
+    site_id = getattr(settings, 'SITE_ID', None)
+    return site_id is not None and site_id in SITE_CACHE
 
 
 def urljoin(domain, path=None, scheme=None):
@@ -38,12 +215,246 @@ def urljoin(domain, path=None, scheme=None):
     return urlunparse((scheme, domain, path or '', None, None, None))
 
 
+def get_urlconf_for_subdomain(subdomain):
+    """
+    Returns the urlconf used for ``subdomain``: the value listed in
+    ``settings.SUBDOMAIN_URLCONFS``, the value of the first matching pattern in
+    ``settings.SUBDOMAIN_URLCONF_PATTERNS``, or ``settings.ROOT_URLCONF``.
+    """
+    try:
+        return settings.SUBDOMAIN_URLCONFS[subdomain]
+    except KeyError:
+        match = get_router().match(subdomain)
+        if match is not None:
+            return match[0]
+        return settings.ROOT_URLCONF
+
+
+def get_urlconfs():
+    """
+    Returns the set of all urlconfs that may be used for any subdomain.
+    """
+    urlconfs = set(settings.SUBDOMAIN_URLCONFS.values())
+    urlconfs.update(get_router().urlconfs())
+    urlconfs.add(settings.ROOT_URLCONF)
+    return urlconfs
+
+
+def warm_urlconfs():
+    """
+    Imports every urlconf returned by :func:`get_urlconfs` and populates
+    their resolvers so that the first requests for each subdomain don't have
+    to. If ``settings.SUBDOMAIN_FAST_REVERSE`` is set, their named routes are
+    compiled for :mod:`subdomains.fastreverse` as well.
+
+    Raises :exc:`~django.core.exceptions.ImproperlyConfigured` if any of the
+    urlconfs cannot be loaded.
+
+    :returns: a dictionary of the time taken to warm each urlconf, in seconds
+    """
+    from subdomains import fastreverse
+
+    fast = getattr(settings, 'SUBDOMAIN_FAST_REVERSE', False)
+    timings = {}
+    for urlconf in sorted(get_urlconfs()):
+        start = time.time()
+        try:
+            resolver = resolver_cache.get(urlconf)
+            resolver.url_patterns
+            resolver.reverse_dict
+            if fast:
+                fastreverse.compile_urlconf(urlconf)
+        except ImproperlyConfigured:
+            raise
+        except Exception as error:
+            raise ImproperlyConfigured('Unable to load the urlconf %r: %s: %s'
+                % (urlconf, type(error).__name__, error))
+        timings[urlconf] = time.time() - start
+        logger.info('Warmed urlconf %s in %.2fms', urlconf,
+            timings[urlconf] * 1000)
+    return timings
+
+
+class ResolverCache(object):
+    """
+    Holds the URL resolvers used to reverse URLs for at most
+    ``settings.SUBDOMAIN_RESOLVER_CACHE_SIZE`` urlconfs (512 by default),
+    discarding the least recently used resolver first. Subdomains that use
+    the same urlconf share its resolver.
+
+    The resolvers are created apart from Django's own resolver cache, so the
+    reverse lookup tables built by :func:`reverse`, :func:`reverse_many` and
+    :mod:`subdomains.fastreverse` are freed with the resolver when it is
+    evicted. Django's cache, which holds the resolvers used to resolve
+    requests, is bounded by :meth:`get_request_resolver`. The cache clears
+    itself when :func:`~django.core.urlresolvers.clear_url_caches` has been
+    called by anything else.
+    """
+    def __init__(self):
+        self.cache = LRUCache(0)
+        self.requested = set()
+        self.resolver = None
+        self.version = 0
+
+    def validate(self):
+        """
+        Clears the cache if the size has changed, or if Django's resolvers
+        have been discarded since the cache was last used, and returns the
+        version of the resolvers, which is incremented in the latter case.
+        """
+        maxsize = getattr(settings, 'SUBDOMAIN_RESOLVER_CACHE_SIZE', 512)
+        if maxsize != self.cache.maxsize:
+            self.cache = LRUCache(maxsize)
+
+        # Django's resolver cache is cleared all at once, so a new resolver
+        # for the root urlconf means that every urlconf may have changed.
+        root = get_resolver(settings.ROOT_URLCONF)
+        if root is not self.resolver:
+            self.cache.clear()
+            self.requested = set()
+            self.resolver = root
+            self.version += 1
+        return self.version
+
+    def get(self, urlconf):
+        """
+        Returns the resolver for ``urlconf``.
+        """
+        self.validate()
+        resolver = self.cache.get(urlconf)
+        if resolver is None:
+            resolver = make_resolver(urlconf)
+            self.cache.set(urlconf, resolver)
+        return resolver
+
+    def get_request_resolver(self, urlconf):
+        """
+        Returns Django's own resolver for ``urlconf``, which Django resolves
+        requests with. Django never trims its cache, so it is cleared once it
+        holds more resolvers than this cache (and the root urlconf's.) This
+        does not discard the resolvers of this cache. Django's cache is only
+        counted for the urlconfs that were not requested since it was last
+        cleared.
+        """
+        resolver = get_resolver(urlconf)
+        if urlconf in self.requested:
+            return resolver
+
+        self.requested.add(urlconf)
+        if get_resolver_count() > self.cache.maxsize + 1:
+            # Notice whether the resolvers were discarded before, not now,
+            # and read the size if the cache has not been used yet.
+            self.validate()
+            if get_resolver_count() > self.cache.maxsize + 1:
+                clear_url_caches()
+                self.resolver = get_resolver(settings.ROOT_URLCONF)
+                self.requested = set([urlconf])
+                resolver = get_resolver(urlconf)
+        return resolver
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        """
+        Returns the hit, miss and eviction counts and the size of the cache.
+        """
+        return self.cache.stats()
+
+
+#: The process-wide :class:`ResolverCache` used by the middleware,
+#: :func:`reverse` and :func:`reverse_many`.
+resolver_cache = ResolverCache()
+
+
+def get_arguments_key(args, kwargs):
+    """
+    Returns a key for the positional and keyword arguments of a URL, which
+    includes the type of each value: values that are equal but of different
+    types, such as ``1``, ``1.0`` and ``True``, are formatted differently in
+    URLs.
+    """
+    return (tuple((type(arg), arg) for arg in args or ()),
+        tuple((name, type(value), value)
+            for name, value in sorted((kwargs or {}).items())))
+
+
+class ReverseCache(object):
+    """
+    Memoizes the URLs returned by :func:`reverse`, keeping at most
+    ``settings.SUBDOMAIN_REVERSE_CACHE_SIZE`` URLs and discarding the least
+    recently used ones first.
+
+    Cache keys include the active urlconf and script prefix of the current
+    thread, so changing either (e.g. with
+    :func:`~django.core.urlresolvers.set_urlconf`) never returns stale URLs.
+    The cache clears itself when the domain changes or when
+    :func:`~django.core.urlresolvers.clear_url_caches` has discarded the
+    resolvers the cached URLs were generated with.
+    """
+    def __init__(self):
+        self.cache = LRUCache(0)
+        self.domain = None
+        self.version = None
+
+    def get_key(self, viewname, subdomain, scheme, args, kwargs, current_app,
+            urlconf, domain):
+        """
+        Returns a hashable key for the provided arguments, or ``None`` if any
+        of them cannot be hashed.
+        """
+        key = (viewname, subdomain, scheme, get_arguments_key(args, kwargs),
+            current_app, urlconf, domain, get_urlconf(), get_script_prefix())
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def validate(self, domain, maxsize):
+        """
+        Clears the cache if the domain or the size have changed since the
+        cache was last used, or if the URL resolvers have been discarded.
+        """
+        if maxsize != self.cache.maxsize:
+            self.cache = LRUCache(maxsize)
+
+        version = resolver_cache.validate()
+        if domain != self.domain or version != self.version:
+            self.clear()
+            self.domain, self.version = domain, version
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, url):
+        self.cache.set(key, url)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        """
+        Returns the hit, miss and eviction counts and the size of the cache.
+        """
+        return self.cache.stats()
+
+
+#: The process-wide :class:`ReverseCache` used by :func:`reverse`.
+reverse_cache = ReverseCache()
+
+
 def reverse(viewname, subdomain=None, scheme=None, args=None, kwargs=None,
         current_app=None):
     """
     Reverses a URL from the given parameters, in a similar fashion to
     :meth:`django.core.urlresolvers.reverse`.
 
+    If ``settings.SUBDOMAIN_REVERSE_CACHE_SIZE`` is set, generated URLs are
+    memoized in :data:`reverse_cache`. If ``settings.SUBDOMAIN_FAST_REVERSE``
+    is set, URLs are reversed with the compiled routes of
+    :mod:`subdomains.fastreverse` where possible.
+
     :param viewname: the name of URL
     :param subdomain: the subdomain to use for URL reversing
     :param scheme: the scheme to use when generating the full URL
@@ -51,17 +462,179 @@ def reverse(viewname, subdomain=None, scheme=None, args=None, kwargs=None,
     :param kwargs: named arguments used for URL reversing
     :param current_app: hint for the currently executing application
     """
-    urlconf = settings.SUBDOMAIN_URLCONFS.get(subdomain, settings.ROOT_URLCONF)
+    collector = get_collector()
+    if collector is None:
+        return _cached_reverse(viewname, subdomain, scheme, args, kwargs,
+            current_app)[0]
+
+    start = timer()
+    url, cached = _cached_reverse(viewname, subdomain, scheme, args, kwargs,
+        current_app)
+    collector.url_reversed(viewname, subdomain, timer() - start, cached)
+    return url
 
+
+def _cached_reverse(viewname, subdomain, scheme, args, kwargs, current_app):
+    """
+    Returns the reversed URL, and whether it was found in the reverse cache
+    (or ``None`` if the cache was not used.)
+    """
+    urlconf = get_urlconf_for_subdomain(subdomain)
     domain = get_domain()
+
+    maxsize = getattr(settings, 'SUBDOMAIN_REVERSE_CACHE_SIZE', None)
+    if not maxsize:
+        return _reverse(viewname, subdomain, scheme, args, kwargs,
+            current_app, urlconf, domain), None
+
+    if scheme is None:
+        scheme = getattr(settings, 'DEFAULT_URL_SCHEME', 'http')
+
+    reverse_cache.validate(domain, maxsize)
+    key = reverse_cache.get_key(viewname, subdomain, scheme, args, kwargs,
+        current_app, urlconf, domain)
+    if key is None:
+        return _reverse(viewname, subdomain, scheme, args, kwargs,
+            current_app, urlconf, domain), None
+
+    url = reverse_cache.get(key)
+    if url is not None:
+        return url, True
+
+    url = _reverse(viewname, subdomain, scheme, args, kwargs, current_app,
+        urlconf, domain)
+    reverse_cache.set(key, url)
+    return url, False
+
+
+def _reverse(viewname, subdomain, scheme, args, kwargs, current_app, urlconf,
+        domain):
+    if current_app is None and \
+            getattr(settings, 'SUBDOMAIN_FAST_REVERSE', False):
+        from subdomains import fastreverse
+        url = fastreverse.reverse(viewname, subdomain, urlconf, scheme, args,
+            kwargs, domain=domain)
+        if url is not None:
+            return url
+
     if subdomain is not None:
         domain = '%s.%s' % (subdomain, domain)
 
-    path = simple_reverse(viewname, urlconf=urlconf, args=args, kwargs=kwargs,
-        current_app=current_app)
+    path = reverse_path(viewname, urlconf, args, kwargs, current_app)
     return urljoin(domain, path, scheme=scheme)
 
 
+def reverse_path(viewname, urlconf, args, kwargs, current_app=None,
+        resolver=None, script_prefix=None):
+    """
+    Returns the path of ``viewname`` in ``urlconf``, like
+    :func:`django.core.urlresolvers.reverse`, with the resolver of
+    :data:`resolver_cache` (or ``resolver``, if given.) Namespaced views are
+    reversed by Django.
+    """
+    if current_app is not None or not isinstance(viewname, string_types) \
+            or ':' in viewname:
+        resolver_cache.get_request_resolver(urlconf or settings.ROOT_URLCONF)
+        return simple_reverse(viewname, urlconf=urlconf, args=args,
+            kwargs=kwargs, current_app=current_app)
+
+    if resolver is None:
+        resolver = resolver_cache.get(urlconf or settings.ROOT_URLCONF)
+    if script_prefix is None:
+        script_prefix = get_script_prefix()
+    return force_text(iri_to_uri(resolver._reverse_with_prefix(viewname,
+        script_prefix, *(args or ()), **(kwargs or {}))))
+
+
+def reverse_many(items, scheme=None, current_app=None, lazy=False):
+    """
+    Reverses many URLs at once, returning them in the same order as ``items``.
+
+    Each item is a ``(viewname, subdomain, args, kwargs)`` tuple, taking the
+    same values as the respective arguments to :func:`reverse`. The domain is
+    only looked up once per call, and the resolver and the scheme and host
+    prefix of the URLs are only determined once per subdomain::
+
+        >>> reverse_many([('home', None, None, None), ('view', 'api', (), {})])
+        ['http://example.com/', 'http://api.example.com/view/']
+
+    :param items: an iterable of ``(viewname, subdomain, args, kwargs)``
+    :param scheme: the scheme to use when generating the full URLs
+    :param current_app: hint for the currently executing application
+    :param lazy: if true, returns an iterator that reverses each URL as it is
+        consumed instead of a list
+    :returns: a list (or iterator) of full URLs
+    """
+    urls = _reverse_many(items, scheme, current_app)
+    if lazy:
+        return urls
+    return list(urls)
+
+
+def _reverse_many(items, scheme, current_app):
+    domain = get_domain()
+    script_prefix = get_script_prefix()
+    prefixes = {}
+
+    for viewname, subdomain, args, kwargs in items:
+        try:
+            urlconf, resolver, prefix = prefixes[subdomain]
+        except KeyError:
+            urlconf = get_urlconf_for_subdomain(subdomain)
+            resolver = resolver_cache.get(urlconf)
+            host = domain if subdomain is None else \
+                '%s.%s' % (subdomain, domain)
+            prefix = urljoin(host, scheme=scheme)
+            prefixes[subdomain] = urlconf, resolver, prefix
+
+        yield prefix + reverse_path(viewname, urlconf, args, kwargs,
+            current_app, resolver=resolver, script_prefix=script_prefix)
+
+
+def get_request_origin(request):
+    """
+    Returns the scheme and the lowercased host (including any port) of
+    ``request``.
+    """
+    scheme = 'https' if request.is_secure() else 'http'
+    return scheme, request.get_host().lower()
+
+
+def shorten_url(url, origin):
+    """
+    Returns the shortest form of the absolute ``url`` that refers to the same
+    resource from a page of ``origin``, as returned by
+    :func:`get_request_origin`: the path of URLs on the same host and scheme,
+    a scheme-relative URL for other hosts on the same scheme, or the URL itself
+    if the scheme is different.
+    """
+    if url.startswith('//'):
+        scheme, rest = '', url[2:]
+    else:
+        scheme, _, rest = url.partition('://')
+    if scheme and scheme != origin[0]:
+        return url
+
+    host, slash, path = rest.partition('/')
+    if host.lower() == origin[1]:
+        return slash + path or '/'
+    return '//' + rest
+
+
+def shortest_reverse(request, viewname, subdomain=None, scheme=None, args=None,
+        kwargs=None, current_app=None):
+    """
+    Reverses a URL like :func:`reverse`, returning the shortest URL that
+    refers to it from the page of ``request`` (see :func:`shorten_url`.) The
+    scheme defaults to the scheme of ``request``.
+    """
+    origin = get_request_origin(request)
+    url = reverse(viewname, subdomain=subdomain,
+        scheme=origin[0] if scheme is None else scheme, args=args,
+        kwargs=kwargs, current_app=current_app)
+    return shorten_url(url, origin)
+
+
 #: :func:`reverse` bound to insecure (non-HTTPS) URLs scheme
 insecure_reverse = functools.partial(reverse, scheme='http')
 